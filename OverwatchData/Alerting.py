@@ -0,0 +1,322 @@
+"""
+Connector to the ALICE Overwatch histogram database based on Elasticsearch
+Copyright (C) 2017  Markus Fasel
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import threading
+from array import array
+
+class OverwatchAlert(object):
+    """
+    Alert raised when a histogram changes suddenly with respect
+    to its rolling baseline
+    """
+
+    __slots__ = ("__detector", "__histogram", "__kind", "__value", "__baseline", "__timekey")
+
+    EMPTY = "empty"
+    SPIKE = "spike"
+    DROP = "drop"
+    OCCUPANCY = "occupancy"
+
+    def __init__(self, detector, histogram, kind, value, baseline, timekey = None):
+        """
+        Constructor
+
+        :param detector: Name of the detector
+        :type detector: String
+        :param histogram: Name of the histogram
+        :type histogram: String
+        :param kind: Type of the alert (empty, spike, drop, occupancy)
+        :type kind: String
+        :param value: Observed value (integral or number of filled bins)
+        :type value: Float
+        :param baseline: Baseline value (mean over the rolling window)
+        :type baseline: Float
+        :param timekey: Time of the snapshot
+        :type timekey: Int
+        """
+        self.__detector = detector
+        self.__histogram = histogram
+        self.__kind = kind
+        self.__value = value
+        self.__baseline = baseline
+        self.__timekey = timekey
+
+    def GetDetector(self):
+        return self.__detector
+
+    def GetHistogram(self):
+        return self.__histogram
+
+    def GetKind(self):
+        return self.__kind
+
+    def GetValue(self):
+        return self.__value
+
+    def GetBaseline(self):
+        return self.__baseline
+
+    def GetTimeKey(self):
+        return self.__timekey
+
+    def MakeDict(self):
+        """
+        Create dictionary representation
+
+        :return: Dictionary representation of the alert
+        :rtype: Dictionary
+        """
+        return {"detector": self.__detector, "histogram": self.__histogram, "kind": self.__kind, "value": self.__value, "baseline": self.__baseline, "timekey": self.__timekey}
+
+class OverwatchChangeDetector(object):
+    """
+    Streaming change detection on ingested histograms.
+
+    For each histogram the integral and the number of filled bins of the
+    last snapshots are kept in ring buffers, together with their running
+    sums (baseline = mean over the window). The ring buffers of all
+    histograms are slices of flat arrays, so the memory is bounded by
+    maxhistograms * window * 16 bytes. Histograms beyond maxhistograms
+    are not tracked. Process can be called from several ingest threads.
+
+    The baseline of a histogram restarts when the run number changes, so
+    the first snapshots of a run are not compared with the end of the
+    previous run (no alerts before minsnapshots snapshots of the run).
+
+    Alerts (compared to the baseline):
+    - empty: no filled bin while the baseline has filled bins
+    - spike: integral above spikefactor * baseline
+    - drop: integral below dropfraction * baseline (positive baseline)
+    - occupancy: filled bins below occupancyfraction * baseline
+    """
+
+    def __init__(self, window = 10, minsnapshots = 3, spikefactor = 5., dropfraction = 0.2, occupancyfraction = 0.5, maxhistograms = 50000):
+        """
+        Constructor
+
+        :param window: Number of snapshots in the rolling baseline
+        :type window: Int
+        :param minsnapshots: Minimum number of snapshots in the baseline before alerts are raised
+        :type minsnapshots: Int
+        :param spikefactor: Integral / baseline above which a spike alert is raised
+        :type spikefactor: Float
+        :param dropfraction: Integral / baseline below which a drop alert is raised
+        :type dropfraction: Float
+        :param occupancyfraction: Filled bins / baseline below which an occupancy alert is raised
+        :type occupancyfraction: Float
+        :param maxhistograms: Maximum number of histograms tracked
+        :type maxhistograms: Int
+        :raise ValueError: window < 1 or minsnapshots not in [1, window]
+        """
+        if window < 1:
+            raise ValueError("Window must contain at least one snapshot, got %d" %window)
+        if minsnapshots < 1 or minsnapshots > window:
+            raise ValueError("Minimum number of snapshots must be between 1 and the window (%d), got %d" %(window, minsnapshots))
+        self.__window = window
+        self.__minsnapshots = minsnapshots
+        self.__spikefactor = spikefactor
+        self.__dropfraction = dropfraction
+        self.__occupancyfraction = occupancyfraction
+        self.__maxhistograms = maxhistograms
+        self.__slots = {}
+        self.__integrals = array("d")
+        self.__filled = array("d")
+        self.__integralsums = array("d")
+        self.__filledsums = array("d")
+        self.__counts = array("l")
+        self.__positions = array("l")
+        self.__runs = []
+        self.__listeners = []
+        self.__untracked = 0
+        self.__lock = threading.Lock()
+
+    def AddListener(self, listener):
+        """
+        Register function called for each alert
+
+        :param listener: Function called with the alert
+        :type listener: Callable
+        """
+        self.__listeners.append(listener)
+
+    def GetNumberOfTrackedHistograms(self):
+        """
+        Get the number of histograms with a baseline
+
+        :return: Number of tracked histograms
+        :rtype: Int
+        """
+        return len(self.__slots)
+
+    def GetNumberOfUntrackedSnapshots(self):
+        """
+        Get the number of snapshots ignored because the maximum
+        number of tracked histograms was reached
+
+        :return: Number of untracked snapshots
+        :rtype: Int
+        """
+        return self.__untracked
+
+    def GetBaseline(self, detector, histname):
+        """
+        Get the current baseline of a histogram
+
+        :param detector: Name of the detector
+        :type detector: String
+        :param histname: Name of the histogram
+        :type histname: String
+        :return: Tuple (mean integral, mean number of filled bins), None if not tracked
+        :rtype: Tuple
+        """
+        slot = self.__slots.get((detector, histname))
+        if slot is None or not self.__counts[slot]:
+            return None
+        return self.__integralsums[slot] / self.__counts[slot], self.__filledsums[slot] / self.__counts[slot]
+
+    def __GetSlot(self, key):
+        """
+        Get the slot of a histogram, allocating a new ring buffer if needed
+        (lock held by the caller)
+        """
+        slot = self.__slots.get(key)
+        if slot is not None:
+            return slot
+        if len(self.__slots) >= self.__maxhistograms:
+            return None
+        slot = len(self.__slots)
+        self.__slots[key] = slot
+        self.__integrals.extend([0.] * self.__window)
+        self.__filled.extend([0.] * self.__window)
+        self.__integralsums.append(0.)
+        self.__filledsums.append(0.)
+        self.__counts.append(0)
+        self.__positions.append(0)
+        self.__runs.append(None)
+        return slot
+
+    def Process(self, detector, histname, integral, nfilled, timekey = None, run = None):
+        """
+        Check snapshot against the baseline and add it to the baseline
+
+        :param detector: Name of the detector
+        :type detector: String
+        :param histname: Name of the histogram
+        :type histname: String
+        :param integral: Integral of the snapshot
+        :type integral: Float
+        :param nfilled: Number of filled bins of the snapshot
+        :type nfilled: Int
+        :param timekey: Time of the snapshot
+        :type timekey: Int
+        :param run: Run number (None: the baseline is kept across runs)
+        :type run: Int
+        :return: Alerts raised
+        :rtype: List
+        """
+        with self.__lock:
+            alerts = self.__Update(detector, histname, integral, nfilled, timekey, run)
+        for alert in alerts:
+            for listener in self.__listeners:
+                try:
+                    listener(alert)
+                except Exception:
+                    import logging
+                    logging.exception("Alert listener failed")
+        return alerts
+
+    def __Update(self, detector, histname, integral, nfilled, timekey, run):
+        """
+        Check snapshot against the baseline and add it to the ring buffer
+        (lock held by the caller)
+        """
+        slot = self.__GetSlot((detector, histname))
+        if slot is None:
+            self.__untracked += 1
+            return []
+        if run is not None and run != self.__runs[slot]:
+            # New run: restart the baseline
+            self.__runs[slot] = run
+            self.__integralsums[slot] = 0.
+            self.__filledsums[slot] = 0.
+            self.__counts[slot] = 0
+            self.__positions[slot] = 0
+        alerts = []
+        count = self.__counts[slot]
+        if count >= self.__minsnapshots:
+            meanintegral = self.__integralsums[slot] / count
+            meanfilled = self.__filledsums[slot] / count
+            if nfilled == 0 and meanfilled > 0:
+                alerts.append(OverwatchAlert(detector, histname, OverwatchAlert.EMPTY, nfilled, meanfilled, timekey))
+            else:
+                if meanintegral > 0 and integral > self.__spikefactor * meanintegral:
+                    alerts.append(OverwatchAlert(detector, histname, OverwatchAlert.SPIKE, integral, meanintegral, timekey))
+                elif meanintegral > 0 and integral < self.__dropfraction * meanintegral:
+                    alerts.append(OverwatchAlert(detector, histname, OverwatchAlert.DROP, integral, meanintegral, timekey))
+                if nfilled < self.__occupancyfraction * meanfilled:
+                    alerts.append(OverwatchAlert(detector, histname, OverwatchAlert.OCCUPANCY, nfilled, meanfilled, timekey))
+
+        # Add snapshot to the ring buffer, replacing the oldest one once the window is full
+        position = slot * self.__window + self.__positions[slot]
+        if count == self.__window:
+            self.__integralsums[slot] -= self.__integrals[position]
+            self.__filledsums[slot] -= self.__filled[position]
+        else:
+            self.__counts[slot] = count + 1
+        self.__integrals[position] = integral
+        self.__filled[position] = nfilled
+        self.__integralsums[slot] += integral
+        self.__filledsums[slot] += nfilled
+        self.__positions[slot] = (self.__positions[slot] + 1) % self.__window
+        return alerts
+
+    def ProcessHistogram(self, detector, histogram, timekey = None, run = None):
+        """
+        Check snapshot of a histogram
+
+        :param detector: Name of the detector
+        :type detector: String
+        :param histogram: Histogram snapshot
+        :type histogram: OverwatchHistogram
+        :param timekey: Time of the snapshot
+        :type timekey: Int
+        :param run: Run number (None: the baseline is kept across runs)
+        :type run: Int
+        :return: Alerts raised
+        :rtype: List
+        """
+        data = histogram.GetData()
+        return self.Process(detector, histogram.GetName(), data.GetIntegral(), data.GetNfilledBins(), timekey, run)
+
+    def ProcessBatch(self, batch):
+        """
+        Check all histogram snapshots of an entry batch (pipeline stage
+        before or after sending the batch)
+
+        :param batch: Batch of histograms
+        :type batch: EntryBatch
+        :return: Alerts raised
+        :rtype: List
+        """
+        alerts = []
+        detector = batch.GetDetector()
+        timekey = batch.GetTimeKey()
+        run = batch.GetRunNumber()
+        for i in range(0, batch.GetNumberOfHistograms()):
+            alerts.extend(self.Process(detector, batch.GetHistogramName(i), batch.GetIntegral(i), batch.GetNfilledBins(i), timekey, run))
+        return alerts
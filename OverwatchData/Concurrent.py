@@ -0,0 +1,382 @@
+"""
+Connector to the ALICE Overwatch histogram database based on Elasticsearch
+Copyright (C) 2017  Markus Fasel
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Thread-safe versions of the metadata shared among receiver threads.
+#
+# Writers serialize on locks (sharded where the key space is large), readers
+# never take a lock: they read immutable snapshots (tuples, frozensets) or
+# single dictionary lookups, which are atomic in CPython. A snapshot is
+# replaced as a whole (copy-on-write) when a writer adds information.
+
+import threading
+
+from OverwatchData.Metadata import OverwatchDetectorDescriptor, OverwatchRunDescriptor
+
+class OverwatchSharedDetectorDescriptor(object):
+    """
+    Thread-safe list of histograms sent by a detector (copy-on-write)
+    """
+
+    __slots__ = ("__detector", "__histograms", "__lookup", "__lock")
+
+    def __init__(self, detname):
+        """
+        Constructor
+
+        :param detname: Name of the detector
+        :type detname: String
+        """
+        self.__detector = detname
+        self.__histograms = ()
+        self.__lookup = frozenset()
+        self.__lock = threading.Lock()
+
+    def GetDetector(self):
+        """
+        Get the name of the detector
+
+        :return: Name of the detector
+        :rtype: String
+        """
+        return self.__detector
+
+    def AddHistogram(self, histname):
+        """
+        Add histogram (only in case it was not found)
+
+        :param histname: Name of the histogram
+        :type histname: String
+        :return: True if the histogram was added
+        :rtype: Bool
+        """
+        if histname in self.__lookup:
+            return False
+        with self.__lock:
+            if histname in self.__lookup:
+                return False
+            self.__histograms = self.__histograms + (histname,)
+            self.__lookup = self.__lookup | frozenset((histname,))
+            return True
+
+    def HasHistogram(self, histname):
+        """
+        Check whether the detector has sent a certain histogram (lock-free)
+
+        :param histname: Name of the histogram
+        :type histname: String
+        :return: True if the histogram was found
+        :rtype: Bool
+        """
+        return histname in self.__lookup
+
+    def GetListOfHistograms(self):
+        """
+        Get snapshot of the list of histograms (lock-free)
+
+        :return: Names of the histograms in order of insertion
+        :rtype: Tuple
+        """
+        return self.__histograms
+
+    def MakeDetectorDescriptor(self):
+        """
+        Create (non thread-safe) detector descriptor from the current snapshot
+
+        :return: Detector descriptor
+        :rtype: OverwatchDetectorDescriptor
+        """
+        descriptor = OverwatchDetectorDescriptor()
+        descriptor.FromDict({"detector": self.__detector, "histograms": list(self.__histograms)})
+        return descriptor
+
+class OverwatchSharedRunDescriptor(object):
+    """
+    Thread-safe run descriptor: Detectors are created atomically
+    (no duplicate detectors when several threads add the first
+    histogram of a detector at the same time)
+    """
+
+    __slots__ = ("__runnumber", "__detectors", "__lock")
+
+    def __init__(self, runnumber = -1):
+        """
+        Constructor
+
+        :param runnumber: run number
+        :type runnumber: Int
+        """
+        self.__runnumber = runnumber
+        self.__detectors = {}
+        self.__lock = threading.Lock()
+
+    def GetRunNumber(self):
+        """
+        Get the run number
+
+        :return: Run number
+        :rtype: Int
+        """
+        return self.__runnumber
+
+    def GetDetector(self, detector, create = True):
+        """
+        Get the descriptor of a detector, creating it if not existing
+
+        :param detector: Name of the detector
+        :type detector: String
+        :param create: Create detector descriptor if not found
+        :type create: Bool
+        :return: Detector descriptor (None if not found and not created)
+        :rtype: OverwatchSharedDetectorDescriptor
+        """
+        descriptor = self.__detectors.get(detector)
+        if descriptor is not None or not create:
+            return descriptor
+        with self.__lock:
+            descriptor = self.__detectors.get(detector)
+            if descriptor is None:
+                descriptor = OverwatchSharedDetectorDescriptor(detector)
+                detectors = dict(self.__detectors)
+                detectors[detector] = descriptor
+                self.__detectors = detectors
+            return descriptor
+
+    def AddDetector(self, detector):
+        """
+        Add new detector (only in case it was not found)
+
+        :param detector: Name of the detector / histogram group
+        :type detector: String
+        """
+        self.GetDetector(detector)
+
+    def AddHistogramForDetector(self, detector, histogram):
+        """
+        Adding histogram to the detector, creating the detector
+        in case it is not yet present
+
+        :param detector: Name of the detector for which to add the histogram
+        :type detector: String
+        :param histogram: Name of the histogram to be added
+        :type histogram: String
+        :return: True if the histogram was added
+        :rtype: Bool
+        """
+        return self.GetDetector(detector).AddHistogram(histogram)
+
+    def GetListOfDetectors(self):
+        """
+        Get the names of the detectors (lock-free)
+
+        :return: Names of the detectors (sorted)
+        :rtype: List
+        """
+        return sorted(self.__detectors.keys())
+
+    def MakeRunDescriptor(self):
+        """
+        Create (non thread-safe) run descriptor from the current snapshot
+
+        :return: Run descriptor
+        :rtype: OverwatchRunDescriptor
+        """
+        descriptor = OverwatchRunDescriptor(self.__runnumber)
+        detectors = self.__detectors
+        for name in sorted(detectors.keys()):
+            descriptor.InsertDetectorDescriptor(detectors[name].MakeDetectorDescriptor())
+        return descriptor
+
+    def MakeDict(self):
+        """
+        Create dictionary representation of the current snapshot
+
+        :return: Dictionary representation of the run descriptor
+        :rtype: Dictionary
+        """
+        return self.MakeRunDescriptor().MakeDict()
+
+    def FromRunDescriptor(self, descriptor):
+        """
+        Add all detectors and histograms of a run descriptor
+
+        :param descriptor: Run descriptor (i.e. read from the database)
+        :type descriptor: OverwatchRunDescriptor
+        """
+        for detector in descriptor.MakeDict()["detectors"]:
+            shared = self.GetDetector(detector["detector"])
+            for histogram in detector["histograms"]:
+                shared.AddHistogram(histogram)
+
+class OverwatchShardedMap(object):
+    """
+    Thread-safe map with sharded write locks and lock-free reads
+    """
+
+    __slots__ = ("__shards", "__locks")
+
+    def __init__(self, nshards = 16):
+        """
+        Constructor
+
+        :param nshards: Number of shards
+        :type nshards: Int
+        """
+        self.__shards = [{} for i in range(0, nshards)]
+        self.__locks = [threading.Lock() for i in range(0, nshards)]
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.__shards)
+
+    def Get(self, key, default = None):
+        """
+        Get value (lock-free)
+
+        :param key: Key
+        :param default: Value returned if the key is not found
+        :return: Value
+        """
+        return self.__shards[hash(key) % len(self.__shards)].get(key, default)
+
+    def SetDefault(self, key, factory):
+        """
+        Get value, inserting the value created by the factory if the
+        key is not found. The factory is called at most once per key.
+
+        :param key: Key
+        :param factory: Function creating the value
+        :type factory: Callable
+        :return: Tuple (value, True if inserted)
+        :rtype: Tuple
+        """
+        shardindex = hash(key) % len(self.__shards)
+        shard = self.__shards[shardindex]
+        value = shard.get(key)
+        if value is not None:
+            return value, False
+        with self.__locks[shardindex]:
+            value = shard.get(key)
+            if value is not None:
+                return value, False
+            value = factory()
+            shard[key] = value
+            return value, True
+
+    def Keys(self):
+        """
+        Get all keys
+
+        :return: Keys of all shards
+        :rtype: List
+        """
+        result = []
+        for shard in self.__shards:
+            result.extend(list(shard.keys()))
+        return result
+
+class OverwatchSharedRunRegistry(object):
+    """
+    Thread-safe registry of the run descriptors of all active runs
+    """
+
+    __slots__ = ("__runs",)
+
+    def __init__(self, nshards = 16):
+        """
+        Constructor
+
+        :param nshards: Number of lock shards
+        :type nshards: Int
+        """
+        self.__runs = OverwatchShardedMap(nshards)
+
+    def GetRun(self, runnumber):
+        """
+        Get the descriptor of a run, creating it if not existing
+
+        :param runnumber: Run number
+        :type runnumber: Int
+        :return: Run descriptor
+        :rtype: OverwatchSharedRunDescriptor
+        """
+        return self.__runs.SetDefault(runnumber, lambda: OverwatchSharedRunDescriptor(runnumber))[0]
+
+    def AddHistogram(self, runnumber, detector, histogram):
+        """
+        Register histogram for detector and run
+
+        :param runnumber: Run number
+        :type runnumber: Int
+        :param detector: Name of the detector
+        :type detector: String
+        :param histogram: Name of the histogram
+        :type histogram: String
+        :return: True if the histogram was new for the detector in this run
+        :rtype: Bool
+        """
+        return self.GetRun(runnumber).AddHistogramForDetector(detector, histogram)
+
+    def GetListOfRuns(self):
+        """
+        Get the run numbers of all registered runs
+
+        :return: Run numbers (sorted)
+        :rtype: List
+        """
+        return sorted(self.__runs.Keys())
+
+class OverwatchSharedHeaderCache(object):
+    """
+    Thread-safe cache of histogram headers, used to write each
+    header only once to the header index
+    """
+
+    __slots__ = ("__headers",)
+
+    def __init__(self, nshards = 16):
+        """
+        Constructor
+
+        :param nshards: Number of lock shards
+        :type nshards: Int
+        """
+        self.__headers = OverwatchShardedMap(nshards)
+
+    def __len__(self):
+        return len(self.__headers)
+
+    def GetHeader(self, histname):
+        """
+        Get header of a histogram (lock-free)
+
+        :param histname: Name of the histogram
+        :type histname: String
+        :return: Histogram header (None if not found)
+        :rtype: OverwatchHistogramHeader
+        """
+        return self.__headers.Get(histname)
+
+    def AddHeader(self, header):
+        """
+        Add header, only in case no header with the same name exists
+
+        :param header: Histogram header
+        :type header: OverwatchHistogramHeader
+        :return: True if the header was added (first time seen)
+        :rtype: Bool
+        """
+        return self.__headers.SetDefault(header.GetName(), lambda: header)[1]
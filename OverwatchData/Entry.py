@@ -16,12 +16,119 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-class Entry():
+import math
+from array import array
+from OverwatchData.Histogram import MakeErrorList, NOERROR, OverwatchHistogram, OverwatchHistogramData, OverwatchSparseHistogramData
+from OverwatchData.Instrumentation import Count, Timed
+from OverwatchData.Metadata import OverwatchSnapshotManifest
+from OverwatchData.Serialization import EncodeJSON, OverwatchBulkBuffer
+from OverwatchData.Symbols import GetSymbolTable
+
+def MakeDataIndexName(detector, run):
+    """
+    Name of the index holding the histogram data
+    of a given detector and run
+
+    :param detector: Name of the detector
+    :type detector: String
+    :param run: Run number
+    :type run: Int
+    :return: Name of the data index
+    :rtype: String
+    """
+    return "alice_overwatchdata_%s_%d" %(detector, run)
+
+def MakeDataIndexPattern(detector):
+    """
+    Pattern matching the data indices of a detector in all runs
+
+    :param detector: Name of the detector
+    :type detector: String
+    :return: Index pattern
+    :rtype: String
+    """
+    return "alice_overwatchdata_%s_*" %detector
+
+def MakeHeaderIndexName():
+    """
+    Name of the index holding the histogram headers
+
+    :return: Name of the header index
+    :rtype: String
+    """
+    return "alice_overwatchmeta_histogram"
+
+def MakeManifestIndexName():
+    """
+    Name of the index holding the snapshot manifests
+
+    :return: Name of the manifest index
+    :rtype: String
+    """
+    return "alice_overwatchmeta_manifest"
+
+def MakeDocumentId(histname, timekey):
+    """
+    ID of the document of a histogram snapshot in the
+    data index (unique per detector and run)
+
+    :param histname: Name of the histogram
+    :type histname: String
+    :param timekey: Time of the snapshot (see OverwatchTimestamp.MakeSortKey)
+    :type timekey: Int
+    :return: Document ID
+    :rtype: String
+    """
+    return "%s_%d" %(histname, timekey)
+
+def ParseDocumentId(docid):
+    """
+    Split a document ID of the form <histogram>_<timekey> (see
+    MakeDocumentId) into histogram name and time key
+
+    :param docid: Document ID
+    :type docid: String
+    :return: Tuple (histogram name, time key), None if the ID has a different form
+    :rtype: Tuple
+    """
+    histname, separator, timekey = docid.rpartition("_")
+    if not separator or not histname or len(timekey) != 14 or not timekey.isdigit():
+        return None
+    return histname, int(timekey)
+
+# Painless script appending document IDs to an existing manifest
+MANIFEST_UPDATE_SCRIPT = "Set known = new HashSet(ctx._source.documents); for (String id : params.documents) { if (known.add(id)) { ctx._source.documents.add(id); } }"
+
+def WriteManifestUpdate(buf, manifest):
+    """
+    Write the bulk update (NDJSON) of a snapshot manifest into the
+    output buffer: the document IDs are appended to the stored manifest,
+    or the manifest is created.
+
+    :param buf: Output buffer
+    :type buf: OverwatchBulkBuffer
+    :param manifest: Manifest with the document IDs to be added
+    :type manifest: OverwatchSnapshotManifest
+    """
+    buf.WriteValue({"update": {"_index": MakeManifestIndexName(), "_id": manifest.GetManifestId()}})
+    buf.WriteNewline()
+    buf.WriteRaw(b'{"script":{"lang":"painless","source":')
+    buf.WriteValue(MANIFEST_UPDATE_SCRIPT)
+    buf.WriteRaw(b',"params":{"documents":')
+    buf.WriteValue(manifest.GetListOfDocuments())
+    buf.WriteRaw(b'}},"upsert":')
+    manifest.Serialize(buf)
+    buf.WriteRaw(b'}')
+    buf.WriteNewline()
+
+class Entry(object):
     """ 
     Full datapoint representation of a histogram entry.
     """
+
+    __slots__ = ("__detector", "__datatype", "__run", "__time", "__histogram")
     
-    def __init__(self, det = None, datatype = None, run = None, histogram):
+    def __init__(self, det = None, datatype = None, run = None, histogram = None):
         """
         Constructor
         """
@@ -29,7 +136,7 @@ class Entry():
         self.__datatype = datatype
         self.__run = run
         self.__time = None
-        self.__histogram = None
+        self.__histogram = histogram
         
     def GetRunNumber(self):
         return self.__run
@@ -50,10 +157,10 @@ class Entry():
         return self.__time
     
     def GetDataIndex(self):
-        return "alice_overwatchdata_%s_%d" %(self.__detector, self.__run)
+        return MakeDataIndexName(self.__detector, self.__run)
     
     def GetHeaderIndex(self):
-        return "alice_overwatchmeta_histogram"
+        return MakeHeaderIndexName()
     
     def GetDataDict(self):
         return {"time" : self.__time, "data": self.__histogram.GetData()}
@@ -71,4 +178,448 @@ class Entry():
         self.__time = entrytime
         
     def SetHistogram(self, histogram):
-        self.__histogram = histogram
\ No newline at end of file
+        self.__histogram = histogram
+
+class EntryBatch(object):
+    """
+    Collection of histograms sharing the same context (detector, data type,
+    run and time), as sent by one merger at a time.
+
+    The shared context is stored only once and the histogram data is kept
+    in a columnar layout (flat arrays of bin numbers and values, with offsets
+    per histogram, bin errors only for histograms which have them). Data of N-dimensional histograms is already packed and is
+    kept by reference. Index names and the JSON fragments of the shared context
+    are computed once per batch when the bulk request is built.
+    """
+
+    __slots__ = ("__detector", "__datatype", "__run", "__time", "__dataindex", "__symbols", "__headers", "__names", "__nbins", "__offsets", "__bins", "__values", "__errors", "__sparse")
+
+    def __init__(self, det = None, datatype = None, run = None, entrytime = None, symbols = None):
+        """
+        Constructor
+
+        :param det: Name of the detector
+        :type det: String
+        :param datatype: Data type
+        :type datatype: String
+        :param run: Run number
+        :type run: Int
+        :param entrytime: Time of the snapshot
+        :type entrytime: OverwatchTimestamp
+        :param symbols: Symbol table for the histogram names (default: shared symbol table)
+        :type symbols: OverwatchSymbolTable
+        """
+        self.__detector = det
+        self.__datatype = datatype
+        self.__run = run
+        self.__time = entrytime
+        self.__dataindex = None
+        self.__symbols = symbols if symbols is not None else GetSymbolTable()
+        self.__headers = []
+        self.__names = array("l")
+        self.__nbins = array("l")
+        self.__offsets = array("l", [0])
+        self.__bins = array("l")
+        self.__values = array("d")
+        self.__errors = {}
+        self.__sparse = {}
+
+    def __len__(self):
+        return len(self.__names)
+
+    def GetRunNumber(self):
+        return self.__run
+
+    def GetDetector(self):
+        return self.__detector
+
+    def GetDataType(self):
+        return self.__datatype
+
+    def GetTime(self):
+        return self.__time
+
+    def GetDataIndex(self):
+        """
+        Get the name of the data index. The name is computed
+        only once as long as the context does not change
+
+        :return: Name of the data index
+        :rtype: String
+        """
+        if self.__dataindex is None:
+            self.__dataindex = MakeDataIndexName(self.__detector, self.__run)
+        return self.__dataindex
+
+    def GetHeaderIndex(self):
+        return MakeHeaderIndexName()
+
+    def GetManifestIndex(self):
+        return MakeManifestIndexName()
+
+    def GetTimeKey(self):
+        """
+        Get the time of the batch as integer (YYYYMMDDhhmmss). Batches
+        without time key are written without document IDs and manifest.
+
+        :return: Time key (None if the time is not a complete OverwatchTimestamp)
+        :rtype: Int
+        :raise ValueError: The timestamp has fractional seconds (see OverwatchTimestamp.MakeSortKey)
+        """
+        if hasattr(self.__time, "MakeSortKey") and self.__time.IsComplete():
+            return self.__time.MakeSortKey()
+        return None
+
+    def GetDocumentId(self, index):
+        """
+        Get the document ID of the histogram at a given position
+
+        :param index: Position of the histogram in the batch
+        :type index: Int
+        :return: Document ID (None if the batch has no timestamp)
+        :rtype: String
+        """
+        timekey = self.GetTimeKey()
+        if timekey is None:
+            return None
+        return MakeDocumentId(self.__symbols.GetSymbol(self.__names[index]), timekey)
+
+    def MakeManifest(self):
+        """
+        Create the snapshot manifest of the batch
+
+        :return: Manifest listing the documents of all histograms in the batch
+        :rtype: OverwatchSnapshotManifest
+        """
+        manifest = OverwatchSnapshotManifest(self.__run, self.__detector, self.GetTimeKey(), self.GetDataIndex())
+        manifest.SetDocuments([self.GetDocumentId(i) for i in range(0, len(self.__names))])
+        return manifest
+
+    def SetRunNumber(self, run):
+        self.__run = run
+        self.__dataindex = None
+
+    def SetDetector(self, detector):
+        self.__detector = detector
+        self.__dataindex = None
+
+    def SetDataType(self, datatype):
+        self.__datatype = datatype
+
+    def SetTime(self, entrytime):
+        self.__time = entrytime
+
+    def AddHistogram(self, histogram):
+        """
+        Append histogram to the batch. The header is kept by
+        reference, the data is copied into the columnar storage
+
+        :param histogram: Histogram to be added
+        :type histogram: OverwatchHistogram
+        """
+        data = histogram.GetData()
+        if isinstance(data, OverwatchSparseHistogramData):
+            self.__sparse[len(self.__names)] = data
+            self.__headers.append(histogram.GetHeader())
+            self.__names.append(self.__symbols.GetId(histogram.GetName()))
+            self.__nbins.append(-1)
+            self.__offsets.append(len(self.__bins))
+            return
+        if data.HasErrors():
+            self.__errors[len(self.__names)] = array("d", data.GetErrors())
+        self.__headers.append(histogram.GetHeader())
+        self.__names.append(self.__symbols.GetId(histogram.GetName()))
+        self.__nbins.append(data.GetNbinsTotal())
+        self.__bins.extend(data.GetBinNumbers())
+        self.__values.extend(data.GetValues())
+        self.__offsets.append(len(self.__bins))
+
+    def AddHistograms(self, histograms):
+        """
+        Append several histograms to the batch, interning their
+        names in the symbol table at once
+
+        :param histograms: Histograms to be added
+        :type histograms: List
+        """
+        self.__symbols.AddSymbols([histogram.GetName() for histogram in histograms])
+        for histogram in histograms:
+            self.AddHistogram(histogram)
+
+    def GetNumberOfHistograms(self):
+        """
+        Get the number of histograms in the batch
+
+        :return: Number of histograms
+        :rtype: Int
+        """
+        return len(self.__names)
+
+    def GetHistogramName(self, index):
+        """
+        Get the name of the histogram at a given position
+
+        :param index: Position of the histogram in the batch
+        :type index: Int
+        :return: Name of the histogram
+        :rtype: String
+        """
+        return self.__symbols.GetSymbol(self.__names[index])
+
+    def GetHistogramNameId(self, index):
+        """
+        Get the ID of the name of the histogram at a given position
+
+        :param index: Position of the histogram in the batch
+        :type index: Int
+        :return: ID of the histogram name in the symbol table
+        :rtype: Int
+        """
+        return self.__names[index]
+
+    def GetNfilledBins(self, index):
+        """
+        Get the number of filled bins of the histogram at a given position
+
+        :param index: Position of the histogram in the batch
+        :type index: Int
+        :return: Number of filled bins
+        :rtype: Int
+        """
+        if index in self.__sparse:
+            return self.__sparse[index].GetNfilledBins()
+        return self.__offsets[index+1] - self.__offsets[index]
+
+    def GetIntegral(self, index):
+        """
+        Get the integral of the histogram at a given position, computed
+        on the columnar storage
+
+        :param index: Position of the histogram in the batch
+        :type index: Int
+        :return: Integral
+        :rtype: Float
+        """
+        if index in self.__sparse:
+            return self.__sparse[index].GetIntegral()
+        return sum(self.__values[self.__offsets[index]:self.__offsets[index+1]])
+
+    def GetHistogramData(self, index):
+        """
+        Rebuild the histogram data at a given position
+
+        :param index: Position of the histogram in the batch
+        :type index: Int
+        :return: Histogram data
+        :rtype: OverwatchHistogramData or OverwatchSparseHistogramData
+        """
+        if index in self.__sparse:
+            return self.__sparse[index]
+        data = OverwatchHistogramData()
+        data.SetNbinsTotal(self.__nbins[index])
+        errors = self.__errors.get(index)
+        start = self.__offsets[index]
+        for pos in range(start, self.__offsets[index+1]):
+            error = errors[pos - start] if errors is not None else NOERROR
+            data.SetBin(self.__bins[pos], self.__values[pos], None if math.isnan(error) else error)
+        return data
+
+    def GetEntry(self, index):
+        """
+        Create full entry for the histogram at a given position
+
+        :param index: Position of the histogram in the batch
+        :type index: Int
+        :return: Entry with the batch context
+        :rtype: Entry
+        """
+        histogram = OverwatchHistogram()
+        histogram.SetHeader(self.__headers[index])
+        histogram.SetData(self.GetHistogramData(index))
+        result = Entry(self.__detector, self.__datatype, self.__run, histogram)
+        result.SetTime(self.__time)
+        return result
+
+    def Clear(self):
+        """
+        Remove all histograms from the batch, keeping the context
+        """
+        self.__headers = []
+        self.__names = array("l")
+        self.__nbins = array("l")
+        self.__offsets = array("l", [0])
+        self.__bins = array("l")
+        self.__values = array("d")
+        self.__errors = {}
+        self.__sparse = {}
+
+    def __MakeAction(self, index, docid = None):
+        """
+        Create encoded bulk action line for a given index (typeless,
+        the data type is a field of the data documents)
+        """
+        meta = {"_index": index}
+        if docid is not None:
+            meta["_id"] = docid
+        return EncodeJSON({"index": meta}) + b"\n"
+
+    def __MakeTime(self):
+        """
+        Create encoded time fragment
+        """
+        if hasattr(self.__time, "Serialize"):
+            timebuf = OverwatchBulkBuffer()
+            self.__time.Serialize(timebuf)
+            return timebuf.GetBytes()
+        return EncodeJSON(self.__time)
+
+    def __MakeDocumentPrefix(self):
+        """
+        Create encoded start of the data documents (shared
+        context) up to the histogram name
+        """
+        prefix = b'{"time":' + self.__MakeTime()
+        timekey = self.GetTimeKey()
+        if timekey is not None:
+            prefix += b',"timekey":' + EncodeJSON(timekey)
+        if self.__datatype is not None:
+            prefix += b',"datatype":' + EncodeJSON(self.__datatype)
+        return prefix + b',"name":'
+
+    def __WriteDocument(self, buf, index, prefix):
+        """
+        Write data document of the histogram at a given position
+        """
+        buf.WriteRaw(prefix)
+        buf.WriteValue(self.__symbols.GetSymbol(self.__names[index]))
+        buf.WriteRaw(b',"data":')
+        if index in self.__sparse:
+            self.__sparse[index].Serialize(buf)
+            buf.WriteRaw(b'}')
+            return
+        start = self.__offsets[index]
+        end = self.__offsets[index+1]
+        buf.WriteRaw(b'{"nbins":')
+        buf.WriteValue(self.__nbins[index])
+        buf.WriteRaw(b',"bins":')
+        buf.WriteValue(self.__bins[start:end].tolist())
+        buf.WriteRaw(b',"values":')
+        buf.WriteValue(self.__values[start:end].tolist())
+        if index in self.__errors:
+            buf.WriteRaw(b',"errors":')
+            buf.WriteValue(MakeErrorList(self.__errors[index]))
+        buf.WriteRaw(b'}}')
+
+    def IterDataDocuments(self):
+        """
+        Iterate over the encoded data documents of the batch (for
+        storage backends not using bulk requests)
+
+        :return: Generator of (document ID, histogram name, encoded document)
+        :rtype: Generator
+        """
+        prefix = self.__MakeDocumentPrefix()
+        buf = OverwatchBulkBuffer()
+        for i in range(0, len(self.__names)):
+            buf.Clear()
+            self.__WriteDocument(buf, i, prefix)
+            yield self.GetDocumentId(i), self.__symbols.GetSymbol(self.__names[i]), buf.GetBytes()
+
+    def WriteDataBulk(self, buf):
+        """
+        Write the bulk request (NDJSON) for the histogram data into
+        the output buffer. The action line and the time are serialized
+        only once per batch. In case the batch has a timestamp the
+        documents get the ID <histogram>_<timekey>.
+
+        :param buf: Output buffer
+        :type buf: OverwatchBulkBuffer
+        """
+        timekey = self.GetTimeKey()
+        action = self.__MakeAction(self.GetDataIndex())
+        if timekey is not None:
+            # Action line without closing braces, the document ID is appended
+            action = action[:-3] + b',"_id":'
+        prefix = self.__MakeDocumentPrefix()
+        for i in range(0, len(self.__names)):
+            buf.WriteRaw(action)
+            if timekey is not None:
+                buf.WriteValue(MakeDocumentId(self.__symbols.GetSymbol(self.__names[i]), timekey))
+                buf.WriteRaw(b'}}\n')
+            self.__WriteDocument(buf, i, prefix)
+            buf.WriteNewline()
+
+    def GetHeader(self, index):
+        """
+        Get the header of the histogram at a given position
+
+        :param index: Position of the histogram in the batch
+        :type index: Int
+        :return: Histogram header
+        :rtype: OverwatchHistogramHeader
+        """
+        return self.__headers[index]
+
+    def WriteHeaderBulk(self, buf):
+        """
+        Write the bulk request (NDJSON) for the histogram headers into
+        the output buffer. The name of the histogram is used as document
+        ID, so that each header is stored only once in the header index.
+
+        :param buf: Output buffer
+        :type buf: OverwatchBulkBuffer
+        """
+        headerindex = self.GetHeaderIndex()
+        for i in range(0, len(self.__names)):
+            buf.WriteRaw(self.__MakeAction(headerindex, self.__symbols.GetSymbol(self.__names[i])))
+            self.__headers[i].Serialize(buf)
+            buf.WriteNewline()
+
+    def WriteManifestBulk(self, buf):
+        """
+        Write the bulk update (NDJSON) of the snapshot manifest into
+        the output buffer. The document IDs of the batch are appended
+        to an existing manifest (several batches from the same detector
+        and time), or the manifest is created.
+
+        :param buf: Output buffer
+        :type buf: OverwatchBulkBuffer
+        """
+        if self.GetTimeKey() is None or not len(self.__names):
+            return
+        WriteManifestUpdate(buf, self.MakeManifest())
+
+    def WriteBulk(self, buf, withheaders = True, withmanifest = True):
+        """
+        Write the full bulk request (NDJSON) for the batch into
+        the output buffer
+
+        :param buf: Output buffer
+        :type buf: OverwatchBulkBuffer
+        :param withheaders: Include also the histogram headers
+        :type withheaders: Bool
+        :param withmanifest: Include also the update of the snapshot manifest
+        :type withmanifest: Bool
+        """
+        with Timed("overwatch_bulk_build_seconds"):
+            if withheaders:
+                self.WriteHeaderBulk(buf)
+            self.WriteDataBulk(buf)
+            if withmanifest:
+                self.WriteManifestBulk(buf)
+        Count("overwatch_bulk_documents_total", len(self.__names))
+
+    def MakeBulk(self, withheaders = True, withmanifest = True):
+        """
+        Create the full bulk request (NDJSON) for the batch
+
+        :param withheaders: Include also the histogram headers
+        :type withheaders: Bool
+        :param withmanifest: Include also the update of the snapshot manifest
+        :type withmanifest: Bool
+        :return: Bulk request body
+        :rtype: Bytes
+        """
+        buf = OverwatchBulkBuffer()
+        self.WriteBulk(buf, withheaders, withmanifest)
+        return buf.GetBytes()
\ No newline at end of file
@@ -16,18 +16,75 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import math
+from array import array
+
+from OverwatchData.Instrumentation import Timed
+
+# Marker for bin errors equal to sqrt(content), which are not stored
+NOERROR = float("nan")
+
+def IsPoissonError(value, error):
+    """
+    Check whether the bin error is the one of an unweighted
+    filling (sqrt(content))
+
+    :param value: Bin content
+    :type value: Float
+    :param error: Bin error
+    :type error: Float
+    :return: True if the error is equal to sqrt(|content|) within numerical precision
+    :rtype: Bool
+    """
+    return abs(error - math.sqrt(abs(value))) <= 1e-9 * max(1., error)
+
+def MakeErrorList(errors):
+    """
+    Convert array of bin errors into a JSON-compatible list,
+    replacing errors equal to sqrt(content) by None
+
+    :param errors: Bin errors
+    :type errors: array
+    :return: Bin errors
+    :rtype: List
+    """
+    return [None if e != e else e for e in errors]
+
+def IsMultiDimensional(roothist):
+    """
+    Check whether the ROOT histogram is a N-dimensional
+    histogram (THnSparse, THn)
+
+    :param roothist: Input histogram
+    :type roothist: TH1, TH2, TH3, THnSparse or THn
+    :return: True if the histogram inherits from THnBase
+    :rtype: Bool
+    """
+    return roothist.IsA().InheritsFrom("THnBase")
+
 class OverwatchHistogramData(object):
     """
     Compressed histogram data array:
     Store only bins which are non-zero
+
+    Bin numbers and values are stored in parallel arrays. Bin errors
+    are optional and share the array of bin numbers with the values.
+    Empty bins of weighted histograms are kept if their error is non-zero
+    (weights cancelling).
+    Errors which are equal to sqrt(content) (unweighted filling) are
+    not stored (NaN internally, null in the JSON representation).
     """
 
+    __slots__ = ("__nbins", "__bins", "__values", "__errors")
+
     def __init__(self):
         """
         Constructor, init empty compressed array
         """
         self.__nbins = 0
-        self.__data = {}
+        self.__bins = array("l")
+        self.__values = array("d")
+        self.__errors = None
 
     def SetNbinsTotal(self, nbins):
         """
@@ -42,36 +99,302 @@ class OverwatchHistogramData(object):
         """
         self.__nbins = nbins
 
-    def SetBin(self, number, value):
+    def SetBin(self, number, value, error = None):
         """
-        Set a non-zero bin value
+        Set a non-zero bin value. Bins are appended, a bin which
+        is already set is overwritten.
         
         :param number: Bin number
         :type number: Int
         :param value: Value
         :type value: Float
+        :param error: Bin error (None: sqrt(value))
+        :type error: Float
         """
-        self.__data[number] = value
+        if error is not None and IsPoissonError(value, error):
+            error = None
+        if error is not None and self.__errors is None:
+            self.__errors = array("d", [NOERROR] * len(self.__values))
+        # Bins are usually set in ascending order, only then the bin is new for sure
+        if self.__bins and number <= self.__bins[-1] and number in self.__bins:
+            position = self.__bins.index(number)
+            self.__values[position] = value
+            if self.__errors is not None:
+                self.__errors[position] = NOERROR if error is None else error
+            return
+        self.__bins.append(number)
+        self.__values.append(value)
+        if self.__errors is not None:
+            self.__errors.append(NOERROR if error is None else error)
+
+    def GetNbinsTotal(self):
+        """
+        Get the amount of bins of the original
+        histogram
+
+        :return: Number of bins
+        :rtype: Int
+        """
+        return self.__nbins
+
+    def GetBinNumbers(self):
+        """
+        Get the numbers of the non-zero bins
+
+        :return: Bin numbers
+        :rtype: array
+        """
+        return self.__bins
+
+    def GetValues(self):
+        """
+        Get the values of the non-zero bins (same order as the bin numbers)
+
+        :return: Bin values
+        :rtype: array
+        """
+        return self.__values
+
+    def GetErrors(self):
+        """
+        Get the stored bin errors (same order as the bin numbers,
+        NaN for errors equal to sqrt(content))
+
+        :return: Bin errors (None if no error was stored)
+        :rtype: array
+        """
+        return self.__errors
+
+    def HasErrors(self):
+        """
+        Check whether bin errors are stored
+
+        :return: True if at least one error different from sqrt(content) is stored
+        :rtype: Bool
+        """
+        return self.__errors is not None
+
+    def GetBinError(self, index):
+        """
+        Get the error of a non-zero bin
+
+        :param index: Position of the bin in the array of bin numbers
+        :type index: Int
+        :return: Bin error
+        :rtype: Float
+        """
+        if self.__errors is not None and not math.isnan(self.__errors[index]):
+            return self.__errors[index]
+        return math.sqrt(abs(self.__values[index]))
+
+    def GetBins(self):
+        """
+        Get the non-zero bins
+
+        :return: Map bin number -> value
+        :rtype: Dictionary
+        """
+        return dict(zip(self.__bins, self.__values))
+
+    def GetNfilledBins(self):
+        """
+        Get the number of non-zero bins
+
+        :return: Number of non-zero bins
+        :rtype: Int
+        """
+        return len(self.__values)
+
+    def GetIntegral(self):
+        """
+        Get the sum of all bin contents (including under- and overflow)
+
+        :return: Integral
+        :rtype: Float
+        """
+        return sum(self.__values)
 
     def MakeDict(self):
         """
         Creating dictionary representation with
-        key and value of the compressed histogram
-        data
+        bin numbers and values (and errors) of the
+        compressed histogram data
         
         :return: Dictionary representation of the histogram data
         :rtype: Dictionary
         """
-        return {"nbins":self.__nbins, "data": self.__data}
+        result = {"nbins":self.__nbins, "bins": self.__bins.tolist(), "values": self.__values.tolist()}
+        if self.__errors is not None:
+            result["errors"] = MakeErrorList(self.__errors)
+        return result
 
     def FromDict(self, inputdict):
         """
+        Initialize from dictionary representation. The previous
+        representation (map bin number -> value in "data") is
+        still supported.
         
         :param inputdict: Dictionary representation of the histogram data
         :type inputdict: Dictionary
         """
         self.__nbins = inputdict["nbins"]
-        self.__data = inputdict["data"]
+        if "data" in inputdict:
+            bins = sorted((int(k), v) for k, v in inputdict["data"].items())
+            self.__bins = array("l", [k for k, v in bins])
+            self.__values = array("d", [v for k, v in bins])
+            self.__errors = None
+            return
+        self.__bins = array("l", inputdict["bins"])
+        self.__values = array("d", inputdict["values"])
+        self.__errors = None
+        if inputdict.get("errors") is not None:
+            self.__errors = array("d", [NOERROR if e is None else e for e in inputdict["errors"]])
+
+    def Serialize(self, buf):
+        """
+        Write JSON representation of the histogram data
+        directly into the output buffer
+
+        :param buf: Output buffer
+        :type buf: OverwatchBulkBuffer
+        """
+        buf.WriteRaw(b'{"nbins":')
+        buf.WriteValue(self.__nbins)
+        buf.WriteRaw(b',"bins":')
+        buf.WriteValue(self.__bins.tolist())
+        buf.WriteRaw(b',"values":')
+        buf.WriteValue(self.__values.tolist())
+        if self.__errors is not None:
+            buf.WriteRaw(b',"errors":')
+            buf.WriteValue(MakeErrorList(self.__errors))
+        buf.WriteRaw(b'}')
+
+class OverwatchSparseHistogramData(object):
+    """
+    Compressed data array of N-dimensional histograms:
+    Store only filled bins as packed coordinate tuples
+    (ndim consecutive axis bin numbers per bin) and values
+    """
+
+    __slots__ = ("__ndim", "__coords", "__values")
+
+    def __init__(self, ndim = 0):
+        """
+        Constructor, init empty compressed array
+
+        :param ndim: Number of dimensions
+        :type ndim: Int
+        """
+        self.__ndim = ndim
+        self.__coords = array("i")
+        self.__values = array("d")
+
+    def SetNdimensions(self, ndim):
+        """
+        Set the number of dimensions
+
+        :param ndim: Number of dimensions
+        :type ndim: Int
+        """
+        self.__ndim = ndim
+
+    def GetNdimensions(self):
+        """
+        Get the number of dimensions
+
+        :return: Number of dimensions
+        :rtype: Int
+        """
+        return self.__ndim
+
+    def AddBin(self, coords, value):
+        """
+        Add filled bin
+
+        :param coords: Bin number on each axis (ndim values)
+        :type coords: List
+        :param value: Value
+        :type value: Float
+        """
+        self.__coords.extend(coords[0:self.__ndim])
+        self.__values.append(value)
+
+    def GetNfilledBins(self):
+        """
+        Get the number of filled bins
+
+        :return: Number of filled bins
+        :rtype: Int
+        """
+        return len(self.__values)
+
+    def GetCoordinates(self, index):
+        """
+        Get the coordinates of a filled bin
+
+        :param index: Index of the filled bin
+        :type index: Int
+        :return: Bin number on each axis
+        :rtype: Tuple
+        """
+        return tuple(self.__coords[index * self.__ndim:(index + 1) * self.__ndim])
+
+    def GetValue(self, index):
+        """
+        Get the value of a filled bin
+
+        :param index: Index of the filled bin
+        :type index: Int
+        :return: Value
+        :rtype: Float
+        """
+        return self.__values[index]
+
+    def GetIntegral(self):
+        """
+        Get the sum of all bin contents
+
+        :return: Integral
+        :rtype: Float
+        """
+        return sum(self.__values)
+
+    def MakeDict(self):
+        """
+        Creating dictionary representation of the compressed
+        histogram data
+
+        :return: Dictionary representation of the histogram data
+        :rtype: Dictionary
+        """
+        return {"ndim": self.__ndim, "coords": self.__coords.tolist(), "values": self.__values.tolist()}
+
+    def FromDict(self, inputdict):
+        """
+        Initialize from dictionary representation
+
+        :param inputdict: Dictionary representation of the histogram data
+        :type inputdict: Dictionary
+        """
+        self.__ndim = inputdict["ndim"]
+        self.__coords = array("i", inputdict["coords"])
+        self.__values = array("d", inputdict["values"])
+
+    def Serialize(self, buf):
+        """
+        Write JSON representation of the histogram data
+        directly into the output buffer
+
+        :param buf: Output buffer
+        :type buf: OverwatchBulkBuffer
+        """
+        buf.WriteRaw(b'{"ndim":')
+        buf.WriteValue(self.__ndim)
+        buf.WriteRaw(b',"coords":')
+        buf.WriteValue(self.__coords.tolist())
+        buf.WriteRaw(b',"values":')
+        buf.WriteValue(self.__values.tolist())
+        buf.WriteRaw(b'}')
 
 class OverwatchHistogramAxis(object):
     """
@@ -82,6 +405,8 @@ class OverwatchHistogramAxis(object):
     in order to re-initialize the histogram
     """
 
+    __slots__ = ("__name", "__title", "__nbins", "__min", "__max", "__binedges")
+
     def __init__(self):
         """
         Constructor
@@ -183,6 +508,28 @@ class OverwatchHistogramAxis(object):
         """
         return {"name": self.__name, "title": self.__title, "nbins": self.__nbins, "xmin": self.__min, "xmax": self.__max, "binedges": self.__binedges}
 
+    def Serialize(self, buf):
+        """
+        Write JSON representation of the axis
+        directly into the output buffer
+
+        :param buf: Output buffer
+        :type buf: OverwatchBulkBuffer
+        """
+        buf.WriteRaw(b'{"name":')
+        buf.WriteValue(self.__name)
+        buf.WriteRaw(b',"title":')
+        buf.WriteValue(self.__title)
+        buf.WriteRaw(b',"nbins":')
+        buf.WriteValue(self.__nbins)
+        buf.WriteRaw(b',"xmin":')
+        buf.WriteValue(self.__min)
+        buf.WriteRaw(b',"xmax":')
+        buf.WriteValue(self.__max)
+        buf.WriteRaw(b',"binedges":')
+        buf.WriteValue(self.__binedges)
+        buf.WriteRaw(b'}')
+
 class OverwatchHistogramHeader(object):
     """
     Header information of a histogram share information for all histograms of the same 
@@ -196,6 +543,8 @@ class OverwatchHistogramHeader(object):
     as a different class and shared among all histograms of the same type in a single document
     """
 
+    __slots__ = ("__type", "__name", "__title", "__axes")
+
     def __init__(self):
         """
         Constructor
@@ -221,7 +570,7 @@ class OverwatchHistogramHeader(object):
         :param title: Title of the histogram
         :type title: String
         """
-        self.__tite = title
+        self.__title = title
 
     def SetType(self, histtype):
         """
@@ -281,16 +630,21 @@ class OverwatchHistogramHeader(object):
         - Title
         - Typ
 
-        Initialize axes
+        Initialize axes (x, y, z for TH1, TH2 and TH3, axis
+        number for N-dimensional histograms)
         
         :param roothist: Input histogram
-        :type roothist: TH1, TH2 TH3
+        :type roothist: TH1, TH2, TH3, THnSparse or THn
         """
         self.SetType(roothist.IsA().GetName())
         self.SetName(roothist.GetName())
         self.SetTitle(roothist.GetTitle())
 
         # Initialize axes
+        if IsMultiDimensional(roothist):
+            for i in range(0, roothist.GetNdimensions()):
+                self.InitAxis(str(i), roothist.GetAxis(i))
+            return
         if roothist.GetXaxis():
             self.InitAxis("x", roothist.GetXaxis())
         if roothist.GetYaxis():
@@ -306,9 +660,34 @@ class OverwatchHistogramHeader(object):
         :rtype: Dictionary
         """
         axes = {}
-        for k, v in self.__axes.iteritems():
+        for k, v in self.__axes.items():
             axes[k] = v.MakeDict()
         return {"type": self.__type, "name": self.__name, "title": self.__title, "axes": axes}
+
+    def Serialize(self, buf):
+        """
+        Write JSON representation of the histogram header
+        directly into the output buffer
+
+        :param buf: Output buffer
+        :type buf: OverwatchBulkBuffer
+        """
+        buf.WriteRaw(b'{"type":')
+        buf.WriteValue(self.__type)
+        buf.WriteRaw(b',"name":')
+        buf.WriteValue(self.__name)
+        buf.WriteRaw(b',"title":')
+        buf.WriteValue(self.__title)
+        buf.WriteRaw(b',"axes":{')
+        first = True
+        for k, v in self.__axes.items():
+            if not first:
+                buf.WriteRaw(b',')
+            first = False
+            buf.WriteValue(k)
+            buf.WriteRaw(b':')
+            v.Serialize(buf)
+        buf.WriteRaw(b'}}')
     
     def FromDict(self, inputdict):
         """
@@ -320,10 +699,10 @@ class OverwatchHistogramHeader(object):
         self.__type = inputdict["type"]
         self.__name = inputdict["name"]
         self.__title = inputdict["title"]
-        for k,v in inputdict["axes"].iteritems():
+        for k,v in inputdict["axes"].items():
             myaxis = OverwatchHistogramAxis()
             myaxis.FromDict(v)
-            self.__axes[k] = v
+            self.__axes[k] = myaxis
 
 class OverwatchHistogram(object):
     """
@@ -333,6 +712,8 @@ class OverwatchHistogram(object):
     reconstruc the histogram from a JSON entry
     """
 
+    __slots__ = ("__header", "__data")
+
     def __init__(self):
         """
         Constructor
@@ -356,7 +737,7 @@ class OverwatchHistogram(object):
         Set the histogram data
         
         :param data: Histogram data
-        :type data: OverwatchHistogramData
+        :type data: OverwatchHistogramData or OverwatchSparseHistogramData
         """
         self.__data = data
 
@@ -403,7 +784,7 @@ class OverwatchHistogram(object):
         Get the histogram data
         
         :return: Histogram data
-        :rtype: OverwatchHistogramData
+        :rtype: OverwatchHistogramData or OverwatchSparseHistogramData
         """
         return self.__data
 
@@ -445,22 +826,51 @@ class OverwatchHistogram(object):
         """
         self.__header.InitAxis(direction, axis)
 
-    def Initialize(self, roothist):
+    def Initialize(self, roothist, witherrors = True):
         """
         Fully initialize overatch histogram (type, name, title, axes, data)
         from underlying root histogram
+
+        Bin errors are stored only for TH1, TH2 and TH3 with sumw2, and only
+        where they differ from sqrt(content). Empty bins of these histograms
+        are kept if their error is non-zero.
+
+        For N-dimensional histograms only the filled bins are visited
+        (for THnSparse GetNbins is the number of filled bins), so the time
+        is proportional to the number of filled bins.
         
         :param roothist: Intput histogram from roothist
-        :type roothist: TH1, TH2 or TH3
-        """
-        self.__header.Initialize(roothist)
-
-        # Initialize data points
-        self.__data.SetNbinsTotal(roothist.GetNcells())
-        for histbin in range(0, roothist.GetNcells()):
-            value = float(roothist.GetBinContent(histbin))
-            if abs(value) > 1e-12:
-                self.__data.SetBin(histbin, value)
+        :type roothist: TH1, TH2, TH3, THnSparse or THn
+        :param witherrors: Store bin errors of weighted histograms
+        :type witherrors: Bool
+        """
+        with Timed("overwatch_histogram_initialize_seconds"):
+            self.__header.Initialize(roothist)
+
+            if IsMultiDimensional(roothist):
+                ndim = roothist.GetNdimensions()
+                self.__data = OverwatchSparseHistogramData(ndim)
+                coords = array("i", [0] * ndim)
+                for filledbin in range(0, roothist.GetNbins()):
+                    value = float(roothist.GetBinContent(filledbin, coords))
+                    if abs(value) > 1e-12:
+                        self.__data.AddBin(coords, value)
+                return
+
+            # Initialize data points, with bin errors only for
+            # weighted histograms (sumw2), where also empty bins
+            # with non-zero error are kept
+            self.__data = OverwatchHistogramData()
+            self.__data.SetNbinsTotal(roothist.GetNcells())
+            witherrors = witherrors and roothist.GetSumw2N() > 0
+            for histbin in range(0, roothist.GetNcells()):
+                value = float(roothist.GetBinContent(histbin))
+                if witherrors:
+                    error = float(roothist.GetBinError(histbin))
+                    if abs(value) > 1e-12 or error > 0.:
+                        self.__data.SetBin(histbin, value, error)
+                elif abs(value) > 1e-12:
+                    self.__data.SetBin(histbin, value)
 
     def MakeDict(self):
         """
@@ -470,6 +880,21 @@ class OverwatchHistogram(object):
         :rtype: Dictionary
         """
         return {"header": self.__header.MakeDict(), "data": self.__data.MakeDict()}
+
+    def Serialize(self, buf):
+        """
+        Write JSON representation of the overwatch histogram
+        directly into the output buffer
+
+        :param buf: Output buffer
+        :type buf: OverwatchBulkBuffer
+        """
+        with Timed("overwatch_histogram_serialize_seconds"):
+            buf.WriteRaw(b'{"header":')
+            self.__header.Serialize(buf)
+            buf.WriteRaw(b',"data":')
+            self.__data.Serialize(buf)
+            buf.WriteRaw(b'}')
     
     def FromDict(self, inputdict):
         """ 
@@ -479,7 +904,11 @@ class OverwatchHistogram(object):
         :param inputdict: Input data as dictionary representation
         :type inputdict: Dictionary
         """
-        self.__header = OverwatchHistogramHeader()
-        self.__Header.FromDict(inputdict["header"])
-        self.__data = OverwatchHistogramData()
-        self.__data.FromDict(inputdict["data"])
+        with Timed("overwatch_histogram_decode_seconds"):
+            self.__header = OverwatchHistogramHeader()
+            self.__header.FromDict(inputdict["header"])
+            if "ndim" in inputdict["data"]:
+                self.__data = OverwatchSparseHistogramData()
+            else:
+                self.__data = OverwatchHistogramData()
+            self.__data.FromDict(inputdict["data"])
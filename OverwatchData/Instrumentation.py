@@ -0,0 +1,308 @@
+"""
+Connector to the ALICE Overwatch histogram database based on Elasticsearch
+Copyright (C) 2017  Markus Fasel
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import bisect
+import threading
+import time
+
+_clock = getattr(time, "perf_counter", time.time)
+
+class OverwatchLatencyHistogram(object):
+    """
+    Histogram of latencies (in seconds) with fixed, logarithmically
+    spaced bucket bounds
+    """
+
+    __slots__ = ("__bounds", "__counts", "__sum", "__count")
+
+    BOUNDS = (1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 1e-2, 5e-2, 0.1, 0.5, 1., 5., 10.)
+
+    def __init__(self, bounds = None):
+        """
+        Constructor
+
+        :param bounds: Upper bounds of the buckets (ordered), default: 1 us to 10 s
+        :type bounds: List
+        """
+        self.__bounds = tuple(bounds) if bounds else OverwatchLatencyHistogram.BOUNDS
+        self.__counts = [0] * (len(self.__bounds) + 1)
+        self.__sum = 0.
+        self.__count = 0
+
+    def Observe(self, value):
+        """
+        Add observed latency
+
+        :param value: Latency in seconds
+        :type value: Float
+        """
+        self.__counts[bisect.bisect_left(self.__bounds, value)] += 1
+        self.__sum += value
+        self.__count += 1
+
+    def GetCount(self):
+        """
+        Get the number of observations
+
+        :return: Number of observations
+        :rtype: Int
+        """
+        return self.__count
+
+    def GetSum(self):
+        """
+        Get the sum of all observed latencies
+
+        :return: Sum of latencies in seconds
+        :rtype: Float
+        """
+        return self.__sum
+
+    def GetCumulativeBuckets(self):
+        """
+        Get the cumulative bucket counts (the last bucket has no upper bound)
+
+        :return: List of (upper bound, cumulative count)
+        :rtype: List
+        """
+        result = []
+        total = 0
+        for bound, count in zip(list(self.__bounds) + [float("inf")], self.__counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def MakeDict(self):
+        """
+        Create dictionary representation
+
+        :return: Dictionary representation of the histogram
+        :rtype: Dictionary
+        """
+        return {"count": self.__count, "sum": self.__sum, "bounds": list(self.__bounds), "counts": list(self.__counts)}
+
+class OverwatchMetricsRegistry(object):
+    """
+    In-process registry of counters and latency histograms
+    """
+
+    __slots__ = ("__counters", "__latencies", "__lock")
+
+    def __init__(self):
+        """
+        Constructor, init empty registry
+        """
+        self.__counters = {}
+        self.__latencies = {}
+        self.__lock = threading.Lock()
+
+    def Increment(self, name, value = 1):
+        """
+        Increment counter
+
+        :param name: Name of the counter
+        :type name: String
+        :param value: Increment
+        :type value: Int
+        """
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + value
+
+    def Observe(self, name, seconds):
+        """
+        Add latency observation
+
+        :param name: Name of the latency histogram
+        :type name: String
+        :param seconds: Latency in seconds
+        :type seconds: Float
+        """
+        with self.__lock:
+            histogram = self.__latencies.get(name)
+            if histogram is None:
+                histogram = OverwatchLatencyHistogram()
+                self.__latencies[name] = histogram
+            histogram.Observe(seconds)
+
+    def GetCounter(self, name):
+        """
+        Get the value of a counter
+
+        :param name: Name of the counter
+        :type name: String
+        :return: Value of the counter (0 if not existing)
+        :rtype: Int
+        """
+        return self.__counters.get(name, 0)
+
+    def GetLatencyHistogram(self, name):
+        """
+        Get latency histogram
+
+        :param name: Name of the latency histogram
+        :type name: String
+        :return: Latency histogram (None if not existing)
+        :rtype: OverwatchLatencyHistogram
+        """
+        return self.__latencies.get(name)
+
+    def Reset(self):
+        """
+        Remove all metrics
+        """
+        with self.__lock:
+            self.__counters = {}
+            self.__latencies = {}
+
+    def MakeDict(self):
+        """
+        Create dictionary representation
+
+        :return: Dictionary representation of all metrics
+        :rtype: Dictionary
+        """
+        with self.__lock:
+            return {"counters": dict(self.__counters), "latencies": dict((k, v.MakeDict()) for k, v in self.__latencies.items())}
+
+    def ExportJSON(self):
+        """
+        Export all metrics as JSON
+
+        :return: JSON representation of all metrics
+        :rtype: String
+        """
+        import json
+        return json.dumps(self.MakeDict(), sort_keys = True)
+
+    def ExportPrometheus(self):
+        """
+        Export all metrics in the Prometheus text exposition format
+
+        :return: Metrics in Prometheus text format
+        :rtype: String
+        """
+        lines = []
+        with self.__lock:
+            for name in sorted(self.__counters):
+                lines.append("# TYPE %s counter" %name)
+                lines.append("%s %d" %(name, self.__counters[name]))
+            for name in sorted(self.__latencies):
+                histogram = self.__latencies[name]
+                lines.append("# TYPE %s histogram" %name)
+                for bound, count in histogram.GetCumulativeBuckets():
+                    lines.append('%s_bucket{le="%s"} %d' %(name, "+Inf" if bound == float("inf") else repr(bound), count))
+                lines.append("%s_sum %r" %(name, histogram.GetSum()))
+                lines.append("%s_count %d" %(name, histogram.GetCount()))
+        return "\n".join(lines) + "\n"
+
+class OverwatchTimer(object):
+    """
+    Context manager measuring the time spent in a block
+    and adding it to the registry
+    """
+
+    __slots__ = ("__registry", "__name", "__start")
+
+    def __init__(self, registry, name):
+        self.__registry = registry
+        self.__name = name
+        self.__start = None
+
+    def __enter__(self):
+        self.__start = _clock()
+        return self
+
+    def __exit__(self, exctype, excvalue, traceback):
+        self.__registry.Observe(self.__name, _clock() - self.__start)
+        return False
+
+class OverwatchNullTimer(object):
+    """
+    Context manager doing nothing, used when the
+    instrumentation is disabled
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exctype, excvalue, traceback):
+        return False
+
+_nulltimer = OverwatchNullTimer()
+_registry = OverwatchMetricsRegistry()
+_state = {"enabled": False}
+
+def EnableInstrumentation(enable = True):
+    """
+    Switch the instrumentation on (or off)
+
+    :param enable: If true the instrumentation is enabled
+    :type enable: Bool
+    """
+    _state["enabled"] = enable
+
+def DisableInstrumentation():
+    """
+    Switch the instrumentation off
+    """
+    _state["enabled"] = False
+
+def IsInstrumentationEnabled():
+    """
+    Check whether the instrumentation is enabled
+
+    :return: True if the instrumentation is enabled
+    :rtype: Bool
+    """
+    return _state["enabled"]
+
+def GetRegistry():
+    """
+    Get the process-wide metrics registry
+
+    :return: Metrics registry
+    :rtype: OverwatchMetricsRegistry
+    """
+    return _registry
+
+def Timed(name):
+    """
+    Time a block of code (with Timed("name"): ...). When the
+    instrumentation is disabled a shared no-op timer is returned.
+
+    :param name: Name of the latency histogram
+    :type name: String
+    :return: Timer context manager
+    """
+    if _state["enabled"]:
+        return OverwatchTimer(_registry, name)
+    return _nulltimer
+
+def Count(name, value = 1):
+    """
+    Increment counter if the instrumentation is enabled
+
+    :param name: Name of the counter
+    :type name: String
+    :param value: Increment
+    :type value: Int
+    """
+    if _state["enabled"]:
+        _registry.Increment(name, value)
@@ -16,20 +16,30 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-class OverwatchDetectorDescriptor:
+from OverwatchData.Symbols import GetSymbolTable
+
+class OverwatchDetectorDescriptor(object):
     """
     Descriptor for the collection of histograms
     from a given detector (merger)
+
+    Detector and histogram names are kept as IDs in the
+    symbol table, comparisons are done on the IDs.
     """
 
-    def __init__(self, detname = ""):
+    __slots__ = ("__symbols", "__detector", "__histlist")
+
+    def __init__(self, detname = "", symbols = None):
         """
         Initialize collection
         
         :param detname: Name of the detector
         :type detname: String
+        :param symbols: Symbol table (default: shared symbol table)
+        :type symbols: OverwatchSymbolTable
         """
-        self.__detector = detname
+        self.__symbols = symbols if symbols is not None else GetSymbolTable()
+        self.__detector = self.__symbols.GetId(detname)
         self.__histlist = []
 
     def __cmp__(self, other):
@@ -49,12 +59,16 @@ class OverwatchDetectorDescriptor:
         """
         Check for equalness
 
-        Comparison is based on the name of the detector.
+        Comparison is based on the ID of the detector name.
         Implemented comparisons:
         - String
         - DetectorHistogramCollection
         """
-        return self.__detector == self.__GetOtherName(other)
+        return self.__detector == self.__GetOtherId(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
 
     def __lt__(self, other):
         """
@@ -66,7 +80,7 @@ class OverwatchDetectorDescriptor:
         - String
         - DetectorHistogramCollection
         """
-        return self.__detector < self.__GetOtherName(other)
+        return self.GetDetector() < self.__GetOtherName(other)
 
     def __gt__(self, other):
         """
@@ -78,7 +92,7 @@ class OverwatchDetectorDescriptor:
         - String
         - DetectorHistogramCollection
         """
-        return self.__detector > self.__GetOtherName(other)
+        return self.GetDetector() > self.__GetOtherName(other)
 
     def __GetOtherName(self, other):
         """
@@ -92,9 +106,43 @@ class OverwatchDetectorDescriptor:
         if isinstance(other, str):
             othername = other
         if isinstance(other, OverwatchDetectorDescriptor):
-            othername = other.GetName()
+            othername = other.GetDetector()
         return othername
 
+    def __GetOtherId(self, other):
+        """
+        Helper function obtaining the ID of the
+        detector name for the comparison
+
+        :param other: Object to obtain the ID from
+        :type other: String or OverwatchDetectorDescriptor
+        """
+        if isinstance(other, OverwatchDetectorDescriptor):
+            if other.GetSymbolTable() is self.__symbols:
+                return other.GetDetectorId()
+            return self.__symbols.FindId(other.GetDetector())
+        if isinstance(other, str):
+            return self.__symbols.FindId(other)
+        return -1
+
+    def GetSymbolTable(self):
+        """
+        Get the symbol table holding the names
+
+        :return: Symbol table
+        :rtype: OverwatchSymbolTable
+        """
+        return self.__symbols
+
+    def GetDetectorId(self):
+        """
+        Get the ID of the detector name
+
+        :return: ID in the symbol table
+        :rtype: Int
+        """
+        return self.__detector
+
     def SetDetector(self, det):
         """
         Set the name of the detector
@@ -102,7 +150,7 @@ class OverwatchDetectorDescriptor:
         :param det: Name of the detector
         :type det: String
         """
-        self.__detector = det
+        self.__detector = self.__symbols.GetId(det)
 
     def GetDetector(self):
         """
@@ -111,7 +159,7 @@ class OverwatchDetectorDescriptor:
         :return: Name of the detector
         :rtype: String
         """
-        return self.__detector
+        return self.__symbols.GetSymbol(self.__detector)
 
     def AddHistogram(self, histname):
         """
@@ -121,8 +169,9 @@ class OverwatchDetectorDescriptor:
         :param histname: Name of the histogram
         :type histname: String
         """
-        if not histname in self.__histlist:
-            self.__histlist.append(histname)
+        histid = self.__symbols.GetId(histname)
+        if not histid in self.__histlist:
+            self.__histlist.append(histid)
 
     def GetListOfHistograms(self):
         """
@@ -132,6 +181,15 @@ class OverwatchDetectorDescriptor:
         :return: List of histograms in the detector descriptor
         :rtype: List
         """
+        return [self.__symbols.GetSymbol(h) for h in self.__histlist]
+
+    def GetListOfHistogramIds(self):
+        """
+        Get the IDs of the histogram names in the symbol table
+
+        :return: IDs of the histogram names
+        :rtype: List
+        """
         return self.__histlist
 
     def HasHistorgam(self, histname):
@@ -145,7 +203,7 @@ class OverwatchDetectorDescriptor:
         :return: True if the histogram was found in the detector descriptor
         :rtype: Bool
         """
-        return histname in self.__histlist
+        return self.__symbols.FindId(histname) in self.__histlist
 
     def MakeDict(self):
         """
@@ -155,7 +213,21 @@ class OverwatchDetectorDescriptor:
         :return: Dictionary representation of the detector descriptor
         :rtype: Dictionary
         """
-        return {"detector": self.__detector, "histograms": self.__histlist}
+        return {"detector": self.GetDetector(), "histograms": self.GetListOfHistograms()}
+
+    def Serialize(self, buf):
+        """
+        Write JSON representation of the detector descriptor
+        directly into the output buffer
+
+        :param buf: Output buffer
+        :type buf: OverwatchBulkBuffer
+        """
+        buf.WriteRaw(b'{"detector":')
+        buf.WriteValue(self.GetDetector())
+        buf.WriteRaw(b',"histograms":')
+        buf.WriteValue(self.GetListOfHistograms())
+        buf.WriteRaw(b'}')
 
     def FromDict(self, inputdict):
         """
@@ -164,13 +236,16 @@ class OverwatchDetectorDescriptor:
         :param inputdict: Input dictionary
         :type inputdict:
         """
-        self.__detector = inputdict["detector"]
-        self.__histlist = inputdict["histograms"]
+        self.__symbols.AddSymbols([inputdict["detector"]] + inputdict["histograms"])
+        self.__detector = self.__symbols.GetId(inputdict["detector"])
+        self.__histlist = [self.__symbols.GetId(h) for h in inputdict["histograms"]]
 
-class OverwatchRunDescriptor:
+class OverwatchRunDescriptor(object):
     """
     Descriptor for run-based information
     """
+
+    __slots__ = ("__runnumber", "__detectors")
     
     def __init__(self, runnumber = -1):
         """
@@ -191,6 +266,24 @@ class OverwatchRunDescriptor:
         """
         self.__runnumber = runnumber
 
+    def GetRunNumber(self):
+        """
+        Get the run number
+
+        :return: run number
+        :rtype: Int
+        """
+        return self.__runnumber
+
+    def GetListOfDetectors(self):
+        """
+        Get the names of the detectors in the run
+
+        :return: Names of the detectors
+        :rtype: List
+        """
+        return [d.GetDetector() for d in self.__detectors]
+
     def AddDetector(self, detector):
         """
         Add new detector to the list of detectors
@@ -244,6 +337,25 @@ class OverwatchRunDescriptor:
             detlist.append(d.MakeDict())
         return {"run": self.__runnumber, "detectors": detlist}
 
+    def Serialize(self, buf):
+        """
+        Write JSON representation of the run descriptor
+        directly into the output buffer
+
+        :param buf: Output buffer
+        :type buf: OverwatchBulkBuffer
+        """
+        buf.WriteRaw(b'{"run":')
+        buf.WriteValue(self.__runnumber)
+        buf.WriteRaw(b',"detectors":[')
+        first = True
+        for d in self.__detectors:
+            if not first:
+                buf.WriteRaw(b',')
+            first = False
+            d.Serialize(buf)
+        buf.WriteRaw(b']}')
+
     def FromDict(self, inputdict):
         """
         Create run descriptor from dictionary representation
@@ -252,8 +364,153 @@ class OverwatchRunDescriptor:
         :type inputdict: Dictionary
         """
         self.__runnumber = inputdict["run"]
-        self.__detlist = []
+        self.__detectors = []
         for d in inputdict["detectors"]:
             mydet = OverwatchDetectorDescriptor()
             mydet.FromDict(d)
             self.InsertDetectorDescriptor(mydet)
+
+
+class OverwatchSnapshotManifest(object):
+    """
+    Manifest of all histogram snapshots sent by a detector
+    in a given run at a given time. Lists the document IDs
+    of the snapshots in the data index, so that a whole
+    detector page can be loaded with a single multi-get.
+    """
+
+    __slots__ = ("__runnumber", "__detector", "__timekey", "__index", "__documents")
+
+    def __init__(self, runnumber = -1, detector = "", timekey = 0, index = ""):
+        """
+        Constructor
+
+        :param runnumber: Run number
+        :type runnumber: Int
+        :param detector: Name of the detector
+        :type detector: String
+        :param timekey: Time of the snapshot (see OverwatchTimestamp.MakeSortKey)
+        :type timekey: Int
+        :param index: Name of the data index holding the snapshots
+        :type index: String
+        """
+        self.__runnumber = runnumber
+        self.__detector = detector
+        self.__timekey = timekey
+        self.__index = index
+        self.__documents = []
+
+    def GetRunNumber(self):
+        """
+        Get the run number
+
+        :return: Run number
+        :rtype: Int
+        """
+        return self.__runnumber
+
+    def GetDetector(self):
+        """
+        Get the name of the detector
+
+        :return: Name of the detector
+        :rtype: String
+        """
+        return self.__detector
+
+    def GetTimeKey(self):
+        """
+        Get the time of the snapshot
+
+        :return: Time of the snapshot (YYYYMMDDhhmmss)
+        :rtype: Int
+        """
+        return self.__timekey
+
+    def GetIndex(self):
+        """
+        Get the name of the data index
+
+        :return: Name of the data index
+        :rtype: String
+        """
+        return self.__index
+
+    def GetManifestId(self):
+        """
+        Get the document ID of the manifest
+
+        :return: Document ID
+        :rtype: String
+        """
+        return "%s_%d_%d" %(self.__detector, self.__runnumber, self.__timekey)
+
+    def AddDocument(self, docid):
+        """
+        Add document ID of a histogram snapshot (only in case it was not found)
+
+        :param docid: Document ID
+        :type docid: String
+        """
+        if not docid in self.__documents:
+            self.__documents.append(docid)
+
+    def SetDocuments(self, documents):
+        """
+        Set the list of document IDs
+
+        :param documents: Document IDs of the histogram snapshots
+        :type documents: List
+        """
+        self.__documents = list(documents)
+
+    def GetListOfDocuments(self):
+        """
+        Get the document IDs of the histogram snapshots
+
+        :return: Document IDs
+        :rtype: List
+        """
+        return self.__documents
+
+    def MakeDict(self):
+        """
+        Create dictionary representation
+
+        :return: Dictionary representation of the manifest
+        :rtype: Dictionary
+        """
+        return {"run": self.__runnumber, "detector": self.__detector, "timekey": self.__timekey, "index": self.__index, "documents": self.__documents}
+
+    def FromDict(self, inputdict):
+        """
+        Create manifest from dictionary representation
+
+        :param inputdict: Input dictionary with manifest information
+        :type inputdict: Dictionary
+        """
+        self.__runnumber = inputdict["run"]
+        self.__detector = inputdict["detector"]
+        self.__timekey = inputdict["timekey"]
+        self.__index = inputdict["index"]
+        self.__documents = inputdict["documents"]
+
+    def Serialize(self, buf):
+        """
+        Write JSON representation of the manifest
+        directly into the output buffer
+
+        :param buf: Output buffer
+        :type buf: OverwatchBulkBuffer
+        """
+        buf.WriteRaw(b'{"run":')
+        buf.WriteValue(self.__runnumber)
+        buf.WriteRaw(b',"detector":')
+        buf.WriteValue(self.__detector)
+        buf.WriteRaw(b',"timekey":')
+        buf.WriteValue(self.__timekey)
+        buf.WriteRaw(b',"index":')
+        buf.WriteValue(self.__index)
+        buf.WriteRaw(b',"documents":')
+        buf.WriteValue(self.__documents)
+        buf.WriteRaw(b'}')
@@ -0,0 +1,191 @@
+"""
+Connector to the ALICE Overwatch histogram database based on Elasticsearch
+Copyright (C) 2017  Markus Fasel
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+def _MakeStdlibEncoder():
+    """
+    Encoder based on the json module of the standard library
+    (always available)
+    """
+    import json
+    encoder = json.JSONEncoder(separators = (",", ":"))
+    def encode(value):
+        return encoder.encode(value).encode("utf-8")
+    return encode
+
+def _MakeUjsonEncoder():
+    """
+    Encoder based on ujson
+    """
+    import ujson
+    def encode(value):
+        return ujson.dumps(value).encode("utf-8")
+    return encode
+
+def _MakeOrjsonEncoder():
+    """
+    Encoder based on orjson (writes directly to bytes)
+    """
+    import orjson
+    options = orjson.OPT_NON_STR_KEYS
+    def encode(value):
+        return orjson.dumps(value, option = options)
+    return encode
+
+_factories = {"orjson": _MakeOrjsonEncoder, "ujson": _MakeUjsonEncoder, "json": _MakeStdlibEncoder}
+_preference = ["orjson", "ujson", "json"]
+_encoders = {}
+_active = {"name": None, "encoder": None}
+
+def RegisterEncoder(name, encoder):
+    """
+    Register a custom encoder. The encoder must be a callable
+    converting a JSON-compatible value into UTF-8 encoded bytes.
+
+    :param name: Name of the encoder
+    :type name: String
+    :param encoder: Encoder function
+    :type encoder: Callable
+    """
+    _encoders[name] = encoder
+
+def GetEncoder(name):
+    """
+    Get the encoder with a given name
+
+    :param name: Name of the encoder (orjson, ujson, json or registered custom encoder)
+    :type name: String
+    :return: Encoder function
+    :rtype: Callable
+    :raise ImportError: The library behind the encoder is not available
+    :raise KeyError: No encoder with the given name
+    """
+    if not name in _encoders:
+        _encoders[name] = _factories[name]()
+    return _encoders[name]
+
+def SetEncoder(name):
+    """
+    Select the encoder used for serialization
+
+    :param name: Name of the encoder (orjson, ujson, json or registered custom encoder)
+    :type name: String
+    """
+    _active["encoder"] = GetEncoder(name)
+    _active["name"] = name
+
+def GetEncoderName():
+    """
+    Get the name of the active encoder. In case no encoder was selected,
+    the fastest available encoder is chosen (orjson, ujson, json).
+
+    :return: Name of the active encoder
+    :rtype: String
+    """
+    if _active["name"] is None:
+        for name in _preference:
+            try:
+                SetEncoder(name)
+                break
+            except ImportError:
+                continue
+    return _active["name"]
+
+def GetListOfEncoders():
+    """
+    Get the names of all encoders which can be used
+
+    :return: Names of the available encoders
+    :rtype: List
+    """
+    result = []
+    for name in _preference + [k for k in _encoders if not k in _preference]:
+        try:
+            GetEncoder(name)
+            result.append(name)
+        except ImportError:
+            continue
+    return result
+
+def EncodeJSON(value):
+    """
+    Encode value with the active encoder
+
+    :param value: JSON-compatible value
+    :return: JSON representation
+    :rtype: Bytes
+    """
+    if _active["encoder"] is None:
+        GetEncoderName()
+    return _active["encoder"](value)
+
+class OverwatchBulkBuffer(object):
+    """
+    Reusable output buffer for JSON documents and bulk (NDJSON)
+    requests. The data classes write directly into the buffer
+    (see the Serialize methods) without building intermediate
+    dictionaries.
+    """
+
+    __slots__ = ("__buffer",)
+
+    def __init__(self):
+        """
+        Constructor, init empty buffer
+        """
+        self.__buffer = bytearray()
+
+    def __len__(self):
+        return len(self.__buffer)
+
+    def Clear(self):
+        """
+        Clear content of the buffer (the memory is kept for reuse)
+        """
+        del self.__buffer[:]
+
+    def GetBytes(self):
+        """
+        Get the content of the buffer
+
+        :return: Content of the buffer
+        :rtype: Bytes
+        """
+        return bytes(self.__buffer)
+
+    def WriteRaw(self, data):
+        """
+        Write pre-encoded data
+
+        :param data: Encoded JSON fragment
+        :type data: Bytes
+        """
+        self.__buffer += data
+
+    def WriteValue(self, value):
+        """
+        Write JSON-compatible value using the active encoder
+
+        :param value: Value to be written
+        """
+        self.__buffer += EncodeJSON(value)
+
+    def WriteNewline(self):
+        """
+        Terminate a line of a bulk request
+        """
+        self.__buffer += b"\n"
@@ -0,0 +1,125 @@
+"""
+Connector to the ALICE Overwatch histogram database based on Elasticsearch
+Copyright (C) 2017  Markus Fasel
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Interning of the strings repeated in all metadata (detector names,
+# histogram names). Each string gets a dense integer ID (its position in
+# the table), the descriptors and batches keep the IDs and compare them
+# instead of the strings. The table only grows, so IDs are stable.
+#
+# The table is local to the process: the IDs never leave memory, the
+# documents keep the strings, so no agreement on the IDs between
+# processes is needed.
+#
+# Readers do not take a lock (single dictionary / list lookups are atomic
+# in CPython), writers serialize on the table lock.
+
+import threading
+
+class OverwatchSymbolTable(object):
+    """
+    Table mapping strings to dense integer IDs
+    """
+
+    __slots__ = ("__ids", "__symbols", "__lock")
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.__ids = {}
+        self.__symbols = []
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__symbols)
+
+    def __contains__(self, symbol):
+        return symbol in self.__ids
+
+    def GetId(self, symbol):
+        """
+        Get the ID of a string, adding it to the table if not yet present
+
+        :param symbol: String to intern
+        :type symbol: String
+        :return: ID of the string
+        :rtype: Int
+        """
+        result = self.__ids.get(symbol)
+        if result is None:
+            self.AddSymbols([symbol])
+            result = self.__ids[symbol]
+        return result
+
+    def AddSymbols(self, symbols):
+        """
+        Add several strings at once (taking the lock only once)
+
+        :param symbols: Strings to intern
+        :type symbols: List
+        """
+        ids = self.__ids
+        if all(symbol in ids for symbol in symbols):
+            return
+        with self.__lock:
+            for symbol in symbols:
+                if not symbol in ids:
+                    ids[symbol] = len(self.__symbols)
+                    self.__symbols.append(symbol)
+
+    def FindId(self, symbol):
+        """
+        Get the ID of a string without adding it to the table
+
+        :param symbol: String to find
+        :type symbol: String
+        :return: ID of the string (-1 if not found)
+        :rtype: Int
+        """
+        return self.__ids.get(symbol, -1)
+
+    def GetSymbol(self, symbolid):
+        """
+        Get the string for an ID
+
+        :param symbolid: ID of the string
+        :type symbolid: Int
+        :return: String
+        :rtype: String
+        """
+        return self.__symbols[symbolid]
+
+    def GetListOfSymbols(self):
+        """
+        Get all strings, ordered by ID
+
+        :return: List of strings
+        :rtype: List
+        """
+        return list(self.__symbols)
+
+_symbols = OverwatchSymbolTable()
+
+def GetSymbolTable():
+    """
+    Get the symbol table shared by all descriptors and batches of the process
+
+    :return: Symbol table
+    :rtype: OverwatchSymbolTable
+    """
+    return _symbols
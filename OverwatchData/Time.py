@@ -21,6 +21,10 @@ class OverwatchTimestamp(object):
     Class saving the time stamp as JSON document
     """
 
+    __slots__ = ("__year", "__month", "__day", "__hours", "__minutes", "__seconds")
+
+    JSONTEMPLATE = '{"year":%d,"month":%d,"day":%d,"hours":%d,"minutes":%d,"seconds":%d}'
+
     def __init__(self, year = None, month = None, day = None, hours = None, minutes = None, seconds = None):
         """
         Constructor
@@ -143,6 +147,46 @@ class OverwatchTimestamp(object):
         """
         return self.__seconds
     
+    def IsComplete(self):
+        """
+        Check whether all fields of the timestamp are set
+
+        :return: True if year, month, day, hours, minutes and seconds are set
+        :rtype: Bool
+        """
+        return not None in (self.__year, self.__month, self.__day, self.__hours, self.__minutes, self.__seconds)
+
+    def MakeSortKey(self):
+        """
+        Create integer representation of the timestamp (YYYYMMDDhhmmss),
+        ordered in time, used in document IDs and for time ranges. The
+        resolution is one second: timestamps with fractional seconds have
+        no time key, as snapshots within the same second would get the
+        same document ID.
+        
+        :return: Integer representation of the timestamp
+        :rtype: Int
+        :raise ValueError: The timestamp is incomplete or has fractional seconds
+        """
+        if not self.IsComplete():
+            raise ValueError("Incomplete timestamp %s has no time key" %self.MakeDict())
+        if self.__seconds != int(self.__seconds):
+            raise ValueError("Timestamp with fractional seconds (%s) has no time key (resolution: 1 s)" %self.__seconds)
+        return ((((self.__year * 100 + self.__month) * 100 + self.__day) * 100 + self.__hours) * 100 + self.__minutes) * 100 + int(self.__seconds)
+
+    def FromSortKey(self, key):
+        """
+        Initialize time stamp from integer representation (YYYYMMDDhhmmss)
+        
+        :param key: Integer representation of the timestamp
+        :type key: Int
+        """
+        key, self.__seconds = divmod(key, 100)
+        key, self.__minutes = divmod(key, 100)
+        key, self.__hours = divmod(key, 100)
+        key, self.__day = divmod(key, 100)
+        self.__year, self.__month = divmod(key, 100)
+
     def FromDict(self, inputdict):
         """
         Initialize time stamp from dictionary representation
@@ -164,4 +208,19 @@ class OverwatchTimestamp(object):
         :return: Dictionary representation of the timestamp
         :rtype: Dictionary
         """
-        return {"year": self.__year, "month": self.__month, "day": self.__day, "hours": self.__hours, "minutes": self.__minutes, "seconds": self.__seconds}
\ No newline at end of file
+        return {"year": self.__year, "month": self.__month, "day": self.__day, "hours": self.__hours, "minutes": self.__minutes, "seconds": self.__seconds}
+
+    def Serialize(self, buf):
+        """
+        Write JSON representation of the timestamp directly
+        into the output buffer
+
+        :param buf: Output buffer
+        :type buf: OverwatchBulkBuffer
+        """
+        fields = (self.__year, self.__month, self.__day, self.__hours, self.__minutes, self.__seconds)
+        if all(type(field) is int for field in fields):
+            buf.WriteRaw((OverwatchTimestamp.JSONTEMPLATE %fields).encode("ascii"))
+        else:
+            # Incomplete timestamp or fractional seconds: the template would truncate
+            buf.WriteValue(self.MakeDict())
\ No newline at end of file
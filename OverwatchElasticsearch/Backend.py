@@ -0,0 +1,122 @@
+"""
+Connector to the ALICE Overwatch histogram database based on Elasticsearch
+Copyright (C) 2017  Markus Fasel
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+class OverwatchStorageBackend(object):
+    """
+    Interface of the storage of the Overwatch histogram database.
+
+    Documents are addressed with the index names of the data model
+    (Entry.GetDataIndex, Entry.GetHeaderIndex, ...). Times are given as
+    integer time keys (see OverwatchTimestamp.MakeSortKey).
+    Implementations:
+    - OverwatchElasticsearchConnector (Elasticsearch cluster)
+    - OverwatchSQLiteBackend (local embedded store)
+    """
+
+    def WriteBatch(self, batch, withheaders = True):
+        """
+        Write entry batch (data documents, snapshot manifest and optionally headers)
+
+        :param batch: Batch of histograms to be written
+        :type batch: EntryBatch
+        :param withheaders: Write also the histogram headers
+        :type withheaders: Bool
+        """
+        raise NotImplementedError("WriteBatch not implemented for %s" %self.__class__.__name__)
+
+    def GetIndices(self, pattern):
+        """
+        Get the names of all indices matching a pattern
+
+        :param pattern: Index pattern (i.e. alice_overwatchdata_*)
+        :type pattern: String
+        :return: Sorted list of index names
+        :rtype: List
+        """
+        raise NotImplementedError("GetIndices not implemented for %s" %self.__class__.__name__)
+
+    def GetHeader(self, histname):
+        """
+        Get the header document of a histogram
+
+        :param histname: Name of the histogram
+        :type histname: String
+        :return: Header document (None if not found)
+        :rtype: Dictionary
+        """
+        raise NotImplementedError("GetHeader not implemented for %s" %self.__class__.__name__)
+
+    def ScanTimeRange(self, index, histname, start, end):
+        """
+        Get all snapshots of a histogram in a time range, ordered in time
+
+        :param index: Name of the data index
+        :type index: String
+        :param histname: Name of the histogram (None: all histograms)
+        :type histname: String
+        :param start: Start of the time range (time key, inclusive)
+        :type start: Int
+        :param end: End of the time range (time key, inclusive)
+        :type end: Int
+        :return: Data documents ordered by time
+        :rtype: Generator
+        """
+        raise NotImplementedError("ScanTimeRange not implemented for %s" %self.__class__.__name__)
+
+    def GetLatestSnapshot(self, index, histname):
+        """
+        Get the most recent snapshot of a histogram
+
+        :param index: Name of the data index
+        :type index: String
+        :param histname: Name of the histogram
+        :type histname: String
+        :return: Data document (None if not found)
+        :rtype: Dictionary
+        """
+        raise NotImplementedError("GetLatestSnapshot not implemented for %s" %self.__class__.__name__)
+
+    def GetManifest(self, detector, run, timekey):
+        """
+        Get the snapshot manifest of a detector for a given run and time
+
+        :param detector: Name of the detector
+        :type detector: String
+        :param run: Run number
+        :type run: Int
+        :param timekey: Time of the snapshot
+        :type timekey: Int
+        :return: Snapshot manifest (None if not found)
+        :rtype: OverwatchSnapshotManifest
+        """
+        raise NotImplementedError("GetManifest not implemented for %s" %self.__class__.__name__)
+
+    def GetDetectorSnapshot(self, detector, run, timekey):
+        """
+        Load all histogram snapshots of a detector for a given run and time
+
+        :param detector: Name of the detector
+        :type detector: String
+        :param run: Run number
+        :type run: Int
+        :param timekey: Time of the snapshot
+        :type timekey: Int
+        :return: Data documents of all histograms in the snapshot (empty if not found)
+        :rtype: List
+        """
+        raise NotImplementedError("GetDetectorSnapshot not implemented for %s" %self.__class__.__name__)
@@ -0,0 +1,453 @@
+"""
+Connector to the ALICE Overwatch histogram database based on Elasticsearch
+Copyright (C) 2017  Markus Fasel
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import collections
+import threading
+import time
+
+from OverwatchData.Entry import MANIFEST_UPDATE_SCRIPT, MakeHeaderIndexName, MakeManifestIndexName
+from OverwatchData.Instrumentation import Count
+from OverwatchData.Metadata import OverwatchSnapshotManifest
+from OverwatchData.Serialization import OverwatchBulkBuffer
+
+def IsRejection(status, error):
+    """
+    Check whether a bulk response (or bulk item) signals an overloaded
+    cluster: HTTP 429 or rejected execution
+
+    :param status: HTTP status
+    :type status: Int
+    :param error: Error information (optional)
+    :return: True if the request was rejected because of overload
+    :rtype: Bool
+    """
+    if status == 429:
+        return True
+    return error is not None and "rejected_execution" in str(error)
+
+class OverwatchAIMDController(object):
+    """
+    Additive-increase / multiplicative-decrease control of the bulk
+    batch size and of the number of concurrent bulk requests.
+
+    As long as requests succeed below the target latency the batch size
+    grows linearly, and once it reached the maximum the concurrency grows
+    by one. Rejections (429, rejected execution) or latencies above the
+    target shrink both multiplicatively.
+    """
+
+    __slots__ = ("__batchsize", "__concurrency", "__minbatch", "__maxbatch", "__maxconcurrency", "__additive", "__multiplicative", "__targetlatency", "__lock")
+
+    def __init__(self, startbatch = 500, minbatch = 50, maxbatch = 5000, maxconcurrency = 8, additive = 50, multiplicative = 0.5, targetlatency = 1.):
+        """
+        Constructor
+
+        :param startbatch: Initial number of documents per bulk request
+        :type startbatch: Int
+        :param minbatch: Minimum number of documents per bulk request
+        :type minbatch: Int
+        :param maxbatch: Maximum number of documents per bulk request
+        :type maxbatch: Int
+        :param maxconcurrency: Maximum number of concurrent bulk requests
+        :type maxconcurrency: Int
+        :param additive: Increase of the batch size after a successful request
+        :type additive: Int
+        :param multiplicative: Factor applied to batch size and concurrency on overload
+        :type multiplicative: Float
+        :param targetlatency: Maximum acceptable latency of a bulk request in seconds
+        :type targetlatency: Float
+        """
+        self.__batchsize = startbatch
+        self.__concurrency = 1
+        self.__minbatch = minbatch
+        self.__maxbatch = maxbatch
+        self.__maxconcurrency = maxconcurrency
+        self.__additive = additive
+        self.__multiplicative = multiplicative
+        self.__targetlatency = targetlatency
+        self.__lock = threading.Lock()
+
+    def GetBatchSize(self):
+        """
+        Get the current number of documents per bulk request
+
+        :return: Batch size
+        :rtype: Int
+        """
+        return self.__batchsize
+
+    def GetConcurrency(self):
+        """
+        Get the current number of concurrent bulk requests
+
+        :return: Concurrency
+        :rtype: Int
+        """
+        return self.__concurrency
+
+    def GetMaxConcurrency(self):
+        """
+        Get the maximum number of concurrent bulk requests
+
+        :return: Maximum concurrency
+        :rtype: Int
+        """
+        return self.__maxconcurrency
+
+    def OnResponse(self, latency, overloaded):
+        """
+        Update batch size and concurrency after a bulk request
+
+        :param latency: Latency of the bulk request in seconds
+        :type latency: Float
+        :param overloaded: Request (or some of its items) rejected because of overload
+        :type overloaded: Bool
+        """
+        with self.__lock:
+            if overloaded or latency > self.__targetlatency:
+                self.__batchsize = max(self.__minbatch, int(self.__batchsize * self.__multiplicative))
+                self.__concurrency = max(1, int(self.__concurrency * self.__multiplicative))
+            elif self.__batchsize < self.__maxbatch:
+                self.__batchsize = min(self.__maxbatch, self.__batchsize + self.__additive)
+            else:
+                self.__concurrency = min(self.__maxconcurrency, self.__concurrency + 1)
+
+class OverwatchBulkDocument(object):
+    """
+    Pending document of the bulk sender
+    """
+
+    __slots__ = ("index", "docid", "name", "body", "manifest", "lowpriority")
+
+    def __init__(self, index, docid, name, body, manifest = None, lowpriority = False):
+        self.index = index
+        self.docid = docid
+        self.name = name
+        self.body = body
+        self.manifest = manifest
+        self.lowpriority = lowpriority
+
+class OverwatchAdaptiveBulkSender(object):
+    """
+    Asynchronous bulk sender with adaptive batch size and concurrency
+    (see OverwatchAIMDController) and backpressure.
+
+    Documents of high priority are sent in order and Submit blocks when
+    too many of them are pending. For documents of low priority only the
+    latest pending snapshot of each histogram is kept: when ingest falls
+    behind, older snapshots are replaced (shed) before they are sent.
+
+    Snapshot manifests only reference documents which were written: the
+    IDs of the documents acknowledged by the cluster are collected in
+    pending manifest updates, which are sent with the next bulk request
+    (and requeued if they are rejected themselves).
+
+    Ingest stages (i.e. OverwatchChangeDetector.ProcessBatch or
+    OverwatchRunCatalog.AddBatch) are called with every submitted batch.
+    """
+
+    def __init__(self, transport, controller = None, maxpending = 100000):
+        """
+        Constructor, starting the sender threads
+
+        :param transport: Object sending bulk requests (Bulk(body) -> response), i.e. OverwatchElasticsearchConnector
+        :type transport: OverwatchElasticsearchConnector
+        :param controller: Batch size and concurrency control (default: OverwatchAIMDController())
+        :type controller: OverwatchAIMDController
+        :param maxpending: Maximum number of pending high-priority documents before Submit blocks
+        :type maxpending: Int
+        """
+        self.__transport = transport
+        self.__controller = controller if controller else OverwatchAIMDController()
+        self.__maxpending = maxpending
+        self.__high = collections.deque()
+        self.__low = collections.OrderedDict()
+        self.__manifests = collections.OrderedDict()
+        self.__stages = []
+        self.__condition = threading.Condition()
+        self.__active = 0
+        self.__stopped = False
+        self.__statistics = {"documents": 0, "requests": 0, "rejected": 0, "shed": 0, "failed": 0, "manifests": 0}
+        self.__threads = [threading.Thread(target = self.__Run) for i in range(0, self.__controller.GetMaxConcurrency())]
+        for thread in self.__threads:
+            thread.daemon = True
+            thread.start()
+
+    def AddIngestStage(self, stage):
+        """
+        Register function called with every submitted batch before it is
+        queued. Errors of a stage are logged and do not stop the ingest.
+
+        :param stage: Function called with the batch (EntryBatch)
+        :type stage: Callable
+        """
+        self.__stages.append(stage)
+
+    def GetController(self):
+        """
+        Get the batch size and concurrency control
+
+        :return: Controller
+        :rtype: OverwatchAIMDController
+        """
+        return self.__controller
+
+    def GetStatistics(self):
+        """
+        Get the statistics of the sender (documents sent, bulk requests,
+        rejected documents, shed snapshots, failed documents, manifest
+        updates sent)
+
+        :return: Statistics
+        :rtype: Dictionary
+        """
+        with self.__condition:
+            result = dict(self.__statistics)
+            result["pending"] = len(self.__high) + len(self.__low)
+            result["pendingmanifests"] = len(self.__manifests)
+        result["batchsize"] = self.__controller.GetBatchSize()
+        result["concurrency"] = self.__controller.GetConcurrency()
+        return result
+
+    def Submit(self, batch, lowpriority = False, withheaders = False):
+        """
+        Queue all documents of an entry batch for sending
+
+        :param batch: Batch of histograms
+        :type batch: EntryBatch
+        :param lowpriority: Only the latest pending snapshot of each histogram is kept
+        :type lowpriority: Bool
+        :param withheaders: Send also the histogram headers (high priority)
+        :type withheaders: Bool
+        """
+        for stage in self.__stages:
+            try:
+                stage(batch)
+            except Exception:
+                import logging
+                logging.exception("Ingest stage failed")
+        index = batch.GetDataIndex()
+        manifest = None
+        if batch.GetTimeKey() is not None:
+            manifest = OverwatchSnapshotManifest(batch.GetRunNumber(), batch.GetDetector(), batch.GetTimeKey(), index)
+        documents = [OverwatchBulkDocument(index, docid, name, body, manifest, lowpriority) for docid, name, body in batch.IterDataDocuments()]
+        if withheaders:
+            buf = OverwatchBulkBuffer()
+            for i in range(0, batch.GetNumberOfHistograms()):
+                buf.Clear()
+                batch.GetHeader(i).Serialize(buf)
+                name = batch.GetHistogramName(i)
+                documents.append(OverwatchBulkDocument(MakeHeaderIndexName(), name, name, buf.GetBytes()))
+        with self.__condition:
+            for document in documents:
+                if document.lowpriority:
+                    key = (document.index, document.name)
+                    if key in self.__low:
+                        self.__statistics["shed"] += 1
+                        Count("overwatch_bulk_shed_total")
+                    self.__low[key] = document
+                else:
+                    while len(self.__high) >= self.__maxpending and not self.__stopped:
+                        self.__condition.wait()
+                    self.__high.append(document)
+            self.__condition.notify_all()
+
+    def Flush(self, timeout = None):
+        """
+        Wait until all pending documents are sent
+
+        :param timeout: Maximum time to wait in seconds (None: no limit)
+        :type timeout: Float
+        :return: True if all documents were sent
+        :rtype: Bool
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self.__condition:
+            while self.__high or self.__low or self.__manifests or self.__active:
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.__condition.wait(remaining)
+            return True
+
+    def Close(self, timeout = None):
+        """
+        Send pending documents and stop the sender threads
+
+        :param timeout: Maximum time to wait for pending documents in seconds (None: no limit)
+        :type timeout: Float
+        """
+        self.Flush(timeout)
+        with self.__condition:
+            self.__stopped = True
+            self.__condition.notify_all()
+        for thread in self.__threads:
+            thread.join()
+
+    def __Take(self):
+        """
+        Wait for a free request slot and pending documents, and take
+        the documents (high priority first) and the pending manifest
+        updates of the next request
+
+        :return: Tuple (documents, manifest updates), None if stopped
+        """
+        with self.__condition:
+            while not self.__stopped and (self.__active >= self.__controller.GetConcurrency() or not (self.__high or self.__low or self.__manifests)):
+                self.__condition.wait(0.1)
+            if self.__stopped:
+                return None
+            batchsize = self.__controller.GetBatchSize()
+            documents = []
+            while self.__high and len(documents) < batchsize:
+                documents.append(self.__high.popleft())
+            while self.__low and len(documents) < batchsize:
+                documents.append(self.__low.popitem(last = False)[1])
+            manifests = list(self.__manifests.values())
+            self.__manifests.clear()
+            self.__active += 1
+            self.__condition.notify_all()
+            return documents, manifests
+
+    def __Requeue(self, documents):
+        """
+        Put rejected documents back into the queues (lock held by the caller):
+        high priority in front of the queue, low priority only if no newer
+        snapshot of the same histogram is pending
+        """
+        for document in reversed(documents):
+            if not document.lowpriority:
+                self.__high.appendleft(document)
+                continue
+            key = (document.index, document.name)
+            if key in self.__low:
+                self.__statistics["shed"] += 1
+                continue
+            self.__low[key] = document
+
+    def __AddToManifests(self, template, docids):
+        """
+        Add document IDs to the pending update of a manifest (lock held by the caller)
+        """
+        manifest = self.__manifests.get(template.GetManifestId())
+        if manifest is None:
+            manifest = OverwatchSnapshotManifest(template.GetRunNumber(), template.GetDetector(), template.GetTimeKey(), template.GetIndex())
+            self.__manifests[template.GetManifestId()] = manifest
+        for docid in docids:
+            manifest.AddDocument(docid)
+
+    def __MakeBody(self, documents, manifests):
+        """
+        Build the bulk request body: documents followed by the
+        pending manifest updates
+        """
+        buf = OverwatchBulkBuffer()
+        for document in documents:
+            meta = {"_index": document.index}
+            if document.docid is not None:
+                meta["_id"] = document.docid
+            buf.WriteValue({"index": meta})
+            buf.WriteNewline()
+            buf.WriteRaw(document.body)
+            buf.WriteNewline()
+        for manifest in manifests:
+            buf.WriteValue({"update": {"_index": MakeManifestIndexName(), "_id": manifest.GetManifestId()}})
+            buf.WriteNewline()
+            buf.WriteRaw(b'{"script":{"lang":"painless","source":')
+            buf.WriteValue(MANIFEST_UPDATE_SCRIPT)
+            buf.WriteRaw(b',"params":{"documents":')
+            buf.WriteValue(manifest.GetListOfDocuments())
+            buf.WriteRaw(b'}},"upsert":')
+            manifest.Serialize(buf)
+            buf.WriteRaw(b'}')
+            buf.WriteNewline()
+        return buf.GetBytes()
+
+    def __Send(self, documents, manifests):
+        """
+        Send one bulk request and sort out the results of the items
+
+        :return: Tuple (latency, overloaded, written documents, rejected documents,
+                 number of failed documents, rejected manifest updates, number of failed manifest updates)
+        """
+        body = self.__MakeBody(documents, manifests)
+        start = time.time()
+        try:
+            response = self.__transport.Bulk(body)
+        except Exception as error:
+            if IsRejection(getattr(error, "status_code", None), error):
+                return time.time() - start, True, [], documents, 0, manifests, 0
+            raise
+        latency = time.time() - start
+        if not response.get("errors"):
+            return latency, False, documents, [], 0, [], 0
+        results = []
+        # Items of the documents come first, followed by the manifest updates
+        for item in response["items"]:
+            result = list(item.values())[0]
+            if not "error" in result:
+                results.append(True)
+            elif IsRejection(result.get("status"), result.get("error")):
+                results.append(None)
+            else:
+                results.append(False)
+        written = [d for d, r in zip(documents, results) if r]
+        rejected = [d for d, r in zip(documents, results) if r is None]
+        nfailed = len([r for r in results[:len(documents)] if r is False])
+        manifestresults = results[len(documents):]
+        rejectedmanifests = [m for m, r in zip(manifests, manifestresults) if r is None]
+        nfailedmanifests = len([r for r in manifestresults if r is False])
+        overloaded = len(rejected) > 0 or len(rejectedmanifests) > 0
+        return latency, overloaded, written, rejected, nfailed, rejectedmanifests, nfailedmanifests
+
+    def __Run(self):
+        """
+        Sender thread
+        """
+        while True:
+            taken = self.__Take()
+            if taken is None:
+                return
+            documents, manifests = taken
+            try:
+                latency, overloaded, written, rejected, nfailed, rejectedmanifests, nfailedmanifests = self.__Send(documents, manifests)
+            except Exception:
+                import logging
+                logging.exception("Bulk request with %d documents failed", len(documents))
+                latency, overloaded, written, rejected, nfailed, rejectedmanifests, nfailedmanifests = 0., False, [], [], len(documents), [], len(manifests)
+            self.__controller.OnResponse(latency, overloaded)
+            Count("overwatch_bulk_rejected_total", len(rejected))
+            with self.__condition:
+                self.__active -= 1
+                self.__statistics["requests"] += 1
+                self.__statistics["documents"] += len(written)
+                self.__statistics["rejected"] += len(rejected)
+                self.__statistics["failed"] += nfailed + nfailedmanifests
+                self.__statistics["manifests"] += len(manifests) - len(rejectedmanifests) - nfailedmanifests
+                self.__Requeue(rejected)
+                # Rejected manifest updates are merged into the pending ones
+                for manifest in rejectedmanifests:
+                    self.__AddToManifests(manifest, manifest.GetListOfDocuments())
+                # Only documents acknowledged by the cluster enter the manifests
+                for document in written:
+                    if document.manifest is not None and document.docid is not None:
+                        self.__AddToManifests(document.manifest, [document.docid])
+                self.__condition.notify_all()
+            if overloaded:
+                # Give the cluster time to recover before the next request
+                time.sleep(min(1., latency))
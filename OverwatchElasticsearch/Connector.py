@@ -14,4 +14,237 @@ GNU General Public License for more details.
 
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
-"""
\ No newline at end of file
+"""
+
+from OverwatchData.Entry import MakeHeaderIndexName, MakeManifestIndexName, WriteManifestUpdate
+from OverwatchData.Instrumentation import Count, Timed
+from OverwatchData.Metadata import OverwatchSnapshotManifest
+from OverwatchData.Serialization import OverwatchBulkBuffer
+from OverwatchElasticsearch.Backend import OverwatchStorageBackend
+
+class OverwatchBulkError(Exception):
+    """
+    Error raised when documents of a bulk request were not written
+    """
+    pass
+
+def GetFailedItems(response):
+    """
+    Get the items of a bulk response which were not written
+
+    :param response: Response of the bulk request
+    :type response: Dictionary
+    :return: Failed items
+    :rtype: List
+    """
+    if not response.get("errors"):
+        return []
+    return [item for item in response["items"] if "error" in list(item.values())[0]]
+
+class OverwatchElasticsearchConnector(OverwatchStorageBackend):
+    """
+    Connection to the Elasticsearch cluster hosting the
+    Overwatch histogram database
+    """
+
+    def __init__(self, hosts = None, **kwargs):
+        """
+        Constructor
+
+        :param hosts: List of Elasticsearch hosts (default: localhost)
+        :type hosts: List
+        :param kwargs: Further arguments for the Elasticsearch client
+        """
+        # Imported here, so that the data model can be used without the client library
+        from elasticsearch import Elasticsearch, helpers
+        self.__helpers = helpers
+        self.__client = Elasticsearch(hosts, **kwargs)
+
+    def GetClient(self):
+        """
+        Get the underlying Elasticsearch client
+
+        :return: Elasticsearch client
+        :rtype: Elasticsearch
+        """
+        return self.__client
+
+    def GetIndices(self, pattern):
+        """
+        Get the names of all indices matching a pattern
+
+        :param pattern: Index pattern (i.e. alice_overwatchdata_*)
+        :type pattern: String
+        :return: Sorted list of index names
+        :rtype: List
+        """
+        return sorted(self.__client.indices.get(index = pattern, ignore_unavailable = True).keys())
+
+    def Bulk(self, body):
+        """
+        Send bulk request
+
+        :param body: Bulk request body (NDJSON)
+        :type body: Bytes
+        :return: Response of the bulk request
+        :rtype: Dictionary
+        """
+        with Timed("overwatch_bulk_send_seconds"):
+            response = self.__client.bulk(body = body)
+        Count("overwatch_bulk_requests_total")
+        Count("overwatch_bulk_bytes_total", len(body))
+        if response.get("errors"):
+            Count("overwatch_bulk_failed_requests_total")
+        return response
+
+    def IndexBatch(self, batch, withheaders = True):
+        """
+        Write data documents (and optionally headers) of an entry batch
+        in one bulk request. The snapshot manifest is not updated (see
+        WriteBatch).
+
+        :param batch: Batch of histograms to be written
+        :type batch: EntryBatch
+        :param withheaders: Write also the histogram headers
+        :type withheaders: Bool
+        :return: Response of the bulk request
+        :rtype: Dictionary
+        """
+        buf = OverwatchBulkBuffer()
+        batch.WriteBulk(buf, withheaders, False)
+        return self.Bulk(buf.GetBytes())
+
+    def WriteBatch(self, batch, withheaders = True):
+        """
+        Write entry batch (data documents, snapshot manifest and optionally
+        headers). The manifest is updated in a second bulk request, only
+        with the data documents acknowledged in the first one.
+
+        :param batch: Batch of histograms to be written
+        :type batch: EntryBatch
+        :param withheaders: Write also the histogram headers
+        :type withheaders: Bool
+        :raise OverwatchBulkError: Documents (or the manifest) were not written
+        """
+        response = self.IndexBatch(batch, withheaders)
+        failed = GetFailedItems(response)
+        if batch.GetTimeKey() is not None and batch.GetNumberOfHistograms():
+            manifest = batch.MakeManifest()
+            if failed:
+                # Items are in request order: headers first, then the data documents
+                first = batch.GetNumberOfHistograms() if withheaders else 0
+                results = [list(item.values())[0] for item in response["items"][first:]]
+                manifest.SetDocuments([docid for docid, result in zip(manifest.GetListOfDocuments(), results) if not "error" in result])
+            if manifest.GetListOfDocuments():
+                buf = OverwatchBulkBuffer()
+                WriteManifestUpdate(buf, manifest)
+                failed.extend(GetFailedItems(self.Bulk(buf.GetBytes())))
+        if failed:
+            import json
+            raise OverwatchBulkError("%d documents failed, first error: %s" %(len(failed), json.dumps(failed[0])))
+
+    def GetHeader(self, histname):
+        """
+        Get the header document of a histogram
+
+        :param histname: Name of the histogram
+        :type histname: String
+        :return: Header document (None if not found)
+        :rtype: Dictionary
+        """
+        response = self.__client.get(index = MakeHeaderIndexName(), id = histname, ignore = 404)
+        return response["_source"] if response.get("found") else None
+
+    def ScanTimeRange(self, index, histname, start, end):
+        """
+        Get all snapshots of a histogram in a time range, ordered in time
+
+        :param index: Name of the data index
+        :type index: String
+        :param histname: Name of the histogram (None: all histograms)
+        :type histname: String
+        :param start: Start of the time range (time key, inclusive)
+        :type start: Int
+        :param end: End of the time range (time key, inclusive)
+        :type end: Int
+        :return: Data documents ordered by time
+        :rtype: Generator
+        """
+        # name.keyword: keyword sub-field of the default dynamic mapping of strings
+        filters = [{"range": {"timekey": {"gte": start, "lte": end}}}]
+        if histname is not None:
+            filters.append({"term": {"name.keyword": histname}})
+        query = {"query": {"bool": {"filter": filters}}, "sort": [{"timekey": "asc"}]}
+        for hit in self.__helpers.scan(self.__client, index = index, query = query, preserve_order = True, ignore_unavailable = True):
+            yield hit["_source"]
+
+    def GetLatestSnapshot(self, index, histname):
+        """
+        Get the most recent snapshot of a histogram
+
+        :param index: Name of the data index
+        :type index: String
+        :param histname: Name of the histogram
+        :type histname: String
+        :return: Data document (None if not found)
+        :rtype: Dictionary
+        """
+        query = {"query": {"term": {"name.keyword": histname}}, "sort": [{"timekey": "desc"}], "size": 1}
+        hits = self.__client.search(index = index, body = query, ignore_unavailable = True)["hits"]["hits"]
+        return hits[0]["_source"] if hits else None
+
+    def GetManifest(self, detector, run, timekey):
+        """
+        Get the snapshot manifest of a detector for a given run and time
+
+        :param detector: Name of the detector
+        :type detector: String
+        :param run: Run number
+        :type run: Int
+        :param timekey: Time of the snapshot (see OverwatchTimestamp.MakeSortKey)
+        :type timekey: Int
+        :return: Snapshot manifest (None if not found)
+        :rtype: OverwatchSnapshotManifest
+        """
+        manifest = OverwatchSnapshotManifest(run, detector, timekey)
+        response = self.__client.get(index = MakeManifestIndexName(), id = manifest.GetManifestId(), ignore = 404)
+        if not response.get("found"):
+            return None
+        manifest.FromDict(response["_source"])
+        return manifest
+
+    def GetDetectorSnapshot(self, detector, run, timekey):
+        """
+        Load all histogram snapshots of a detector for a given run and
+        time: One request for the manifest and one multi-get for the
+        histograms
+
+        :param detector: Name of the detector
+        :type detector: String
+        :param run: Run number
+        :type run: Int
+        :param timekey: Time of the snapshot (see OverwatchTimestamp.MakeSortKey)
+        :type timekey: Int
+        :return: Data documents of all histograms in the snapshot (empty if not found)
+        :rtype: List
+        """
+        manifest = self.GetManifest(detector, run, timekey)
+        if manifest is None or not manifest.GetListOfDocuments():
+            return []
+        response = self.__client.mget(index = manifest.GetIndex(), body = {"ids": manifest.GetListOfDocuments()})
+        return [doc["_source"] for doc in response["docs"] if doc.get("found")]
+
+    def Scan(self, index, query = None, size = 500):
+        """
+        Iterate over all documents of an index (scroll)
+
+        :param index: Name or pattern of the index
+        :type index: String
+        :param query: Optional query (default: all documents)
+        :type query: Dictionary
+        :param size: Number of documents per scroll request
+        :type size: Int
+        :return: Generator of hits (with _index, _type, _id and _source)
+        :rtype: Generator
+        """
+        return self.__helpers.scan(self.__client, index = index, query = query, size = size)
@@ -0,0 +1,360 @@
+"""
+Connector to the ALICE Overwatch histogram database based on Elasticsearch
+Copyright (C) 2017  Markus Fasel
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import collections
+import heapq
+import threading
+
+from OverwatchData.Entry import MakeDataIndexName, MakeDataIndexPattern
+from OverwatchData.Instrumentation import Count
+
+def MakeTimeKey(value):
+    """
+    Convert time to time key
+
+    :param value: Time (OverwatchTimestamp or time key YYYYMMDDhhmmss)
+    :type value: OverwatchTimestamp or Int
+    :return: Time key
+    :rtype: Int
+    """
+    if hasattr(value, "MakeSortKey"):
+        return value.MakeSortKey()
+    return int(value)
+
+class OverwatchRunCatalog(object):
+    """
+    Catalog of the time range covered by each detector in each run,
+    used to find the data indices relevant for a time window without
+    querying all alice_overwatchdata_* indices.
+
+    The catalog is filled from the run descriptors (with the start and
+    end of the run) and extended with every snapshot written.
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.__runs = {}
+        self.__lock = threading.Lock()
+
+    def AddSnapshot(self, run, detector, timekey):
+        """
+        Extend the time range of a detector in a run
+
+        :param run: Run number
+        :type run: Int
+        :param detector: Name of the detector
+        :type detector: String
+        :param timekey: Time of the snapshot (time key or OverwatchTimestamp)
+        :type timekey: Int
+        """
+        self.AddTimeRange(run, detector, timekey, timekey)
+
+    def AddTimeRange(self, run, detector, start, end):
+        """
+        Extend the time range of a detector in a run
+
+        :param run: Run number
+        :type run: Int
+        :param detector: Name of the detector
+        :type detector: String
+        :param start: Start of the time range (time key or OverwatchTimestamp)
+        :type start: Int
+        :param end: End of the time range (time key or OverwatchTimestamp)
+        :type end: Int
+        """
+        start = MakeTimeKey(start)
+        end = MakeTimeKey(end)
+        with self.__lock:
+            detectors = self.__runs.setdefault(run, {})
+            known = detectors.get(detector)
+            if known is None:
+                detectors[detector] = (start, end)
+            elif start < known[0] or end > known[1]:
+                detectors[detector] = (min(start, known[0]), max(end, known[1]))
+
+    def AddRunDescriptor(self, descriptor, start, end):
+        """
+        Add all detectors of a run with the time range of the run
+
+        :param descriptor: Run descriptor
+        :type descriptor: OverwatchRunDescriptor
+        :param start: Start of the run (time key or OverwatchTimestamp)
+        :type start: Int
+        :param end: End of the run (time key or OverwatchTimestamp)
+        :type end: Int
+        """
+        for detector in descriptor.GetListOfDetectors():
+            self.AddTimeRange(descriptor.GetRunNumber(), detector, start, end)
+
+    def AddBatch(self, batch):
+        """
+        Add the snapshot of an entry batch
+
+        :param batch: Batch of histograms
+        :type batch: EntryBatch
+        """
+        timekey = batch.GetTimeKey()
+        if timekey is not None:
+            self.AddSnapshot(batch.GetRunNumber(), batch.GetDetector(), timekey)
+
+    def GetTimeRange(self, run, detector):
+        """
+        Get the time range of a detector in a run
+
+        :param run: Run number
+        :type run: Int
+        :param detector: Name of the detector
+        :type detector: String
+        :return: Tuple (start, end) as time keys (None if not found)
+        :rtype: Tuple
+        """
+        with self.__lock:
+            return self.__runs.get(run, {}).get(detector)
+
+    def GetListOfRuns(self, detector, start, end):
+        """
+        Get the runs in which a detector has data overlapping a time window
+
+        :param detector: Name of the detector
+        :type detector: String
+        :param start: Start of the time window (time key or OverwatchTimestamp, inclusive)
+        :type start: Int
+        :param end: End of the time window (time key or OverwatchTimestamp, inclusive)
+        :type end: Int
+        :return: Sorted list of run numbers
+        :rtype: List
+        """
+        start = MakeTimeKey(start)
+        end = MakeTimeKey(end)
+        with self.__lock:
+            items = list(self.__runs.items())
+        result = []
+        for run, detectors in items:
+            timerange = detectors.get(detector)
+            if timerange is not None and timerange[0] <= end and timerange[1] >= start:
+                result.append(run)
+        return sorted(result)
+
+    def GetIndices(self, detector, start, end):
+        """
+        Get the minimal set of data indices holding snapshots of a
+        detector in a time window
+
+        :param detector: Name of the detector
+        :type detector: String
+        :param start: Start of the time window (time key or OverwatchTimestamp, inclusive)
+        :type start: Int
+        :param end: End of the time window (time key or OverwatchTimestamp, inclusive)
+        :type end: Int
+        :return: Names of the data indices, ordered by run
+        :rtype: List
+        """
+        return [MakeDataIndexName(detector, run) for run in self.GetListOfRuns(detector, start, end)]
+
+    def MakeDict(self):
+        """
+        Create dictionary representation
+
+        :return: Dictionary representation of the catalog
+        :rtype: Dictionary
+        """
+        with self.__lock:
+            runs = [{"run": run, "detectors": [{"detector": det, "start": r[0], "end": r[1]} for det, r in sorted(detectors.items())]} for run, detectors in sorted(self.__runs.items())]
+        return {"runs": runs}
+
+    def FromDict(self, inputdict):
+        """
+        Merge catalog from dictionary representation
+
+        :param inputdict: Input dictionary
+        :type inputdict: Dictionary
+        """
+        for run in inputdict["runs"]:
+            for det in run["detectors"]:
+                self.AddTimeRange(run["run"], det["detector"], det["start"], det["end"])
+
+class OverwatchPrefetchedScan(object):
+    """
+    Iterator over a scan, read ahead by a background thread into a
+    bounded buffer. The consumer only blocks if the buffer is empty,
+    the thread if it is full.
+    """
+
+    def __init__(self, scan, maxbuffered = 256):
+        """
+        Constructor, starting the thread
+
+        :param scan: Scan to read ahead (i.e. ScanTimeRange)
+        :type scan: Iterator
+        :param maxbuffered: Maximum number of documents read ahead
+        :type maxbuffered: Int
+        """
+        self.__scan = scan
+        self.__maxbuffered = maxbuffered
+        self.__buffer = collections.deque()
+        self.__condition = threading.Condition()
+        self.__done = False
+        self.__closed = False
+        self.__error = None
+        self.__thread = threading.Thread(target = self.__Run)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self.__condition:
+            while not self.__buffer and not self.__done:
+                self.__condition.wait()
+            if self.__buffer:
+                doc = self.__buffer.popleft()
+                self.__condition.notify_all()
+                return doc
+            if self.__error is not None:
+                raise self.__error
+            raise StopIteration
+
+    next = __next__
+
+    def Close(self):
+        """
+        Stop reading ahead (i.e. the consumer stopped early)
+        """
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+
+    def __Run(self):
+        """
+        Read the scan into the buffer until it is exhausted or closed
+        """
+        try:
+            for doc in self.__scan:
+                with self.__condition:
+                    while len(self.__buffer) >= self.__maxbuffered and not self.__closed:
+                        self.__condition.wait()
+                    if self.__closed:
+                        break
+                    self.__buffer.append(doc)
+                    self.__condition.notify_all()
+        except Exception as error:
+            self.__error = error
+        finally:
+            # Release the backend resources (i.e. the scroll context)
+            close = getattr(self.__scan, "close", None)
+            if close is not None:
+                close()
+            with self.__condition:
+                self.__done = True
+                self.__condition.notify_all()
+
+class OverwatchTimeWindowQuery(object):
+    """
+    Query of all snapshots of a histogram in a time window across runs.
+
+    The data indices of the detector (alice_overwatchdata_<detector>_<run>)
+    are listed in the backend and pruned with the run catalog: runs whose
+    time range is known are scanned only if they overlap the window. The
+    catalog only lives in memory and may have missed runs (i.e. in the UI
+    or after a restart of the writer), so runs without entry in the
+    catalog are always scanned.
+
+    The per-index scans (ScanTimeRange, each ordered in time) are merged
+    lazily into one stream ordered by time key, so only a bounded number
+    of documents per index is held in memory. Up to nworkers scans are
+    read ahead in parallel by background threads, the remaining ones are
+    read by the consumer.
+    """
+
+    def __init__(self, backend, catalog, nworkers = 4):
+        """
+        Constructor
+
+        :param backend: Storage backend
+        :type backend: OverwatchStorageBackend
+        :param catalog: Run catalog
+        :type catalog: OverwatchRunCatalog
+        :param nworkers: Maximum number of indices read ahead in parallel
+        :type nworkers: Int
+        """
+        self.__backend = backend
+        self.__catalog = catalog
+        self.__nworkers = nworkers
+
+    def SetNumberOfWorkers(self, nworkers):
+        self.__nworkers = nworkers
+
+    def GetCatalog(self):
+        return self.__catalog
+
+    def Query(self, detector, histname, start, end):
+        """
+        Get all snapshots of a histogram of a detector in a time window
+
+        :param detector: Name of the detector
+        :type detector: String
+        :param histname: Name of the histogram (None: all histograms)
+        :type histname: String
+        :param start: Start of the time window (time key or OverwatchTimestamp, inclusive)
+        :type start: Int
+        :param end: End of the time window (time key or OverwatchTimestamp, inclusive)
+        :type end: Int
+        :return: Data documents ordered by time
+        :rtype: Generator
+        """
+        start = MakeTimeKey(start)
+        end = MakeTimeKey(end)
+        # Only <prefix><run>: the pattern also matches detectors with the same prefix and reindex targets
+        prefix = MakeDataIndexPattern(detector)[:-1]
+        runs = set(int(index[len(prefix):]) for index in self.__backend.GetIndices(MakeDataIndexPattern(detector)) if index[len(prefix):].isdigit())
+        unknown = [run for run in runs if self.__catalog.GetTimeRange(run, detector) is None]
+        selected = runs.intersection(self.__catalog.GetListOfRuns(detector, start, end)).union(unknown)
+        indices = [MakeDataIndexName(detector, run) for run in sorted(selected)]
+        Count("overwatch_query_catalog_misses_total", len(unknown))
+        Count("overwatch_query_indices_total", len(indices))
+        if not indices:
+            return iter([])
+        return self.__Merge([self.__backend.ScanTimeRange(index, histname, start, end) for index in indices])
+
+    def __Merge(self, scans):
+        """
+        Merge per-index scans (each ordered in time) by time key. Ties
+        are resolved by the order of the indices (run number).
+        """
+        prefetched = []
+        if len(scans) > 1 and self.__nworkers > 1:
+            prefetched = [OverwatchPrefetchedScan(scan) for scan in scans[:self.__nworkers]]
+            scans = prefetched + scans[self.__nworkers:]
+        try:
+            streams = [self.__Decorate(i, docs) for i, docs in enumerate(scans)]
+            for entry in heapq.merge(*streams):
+                yield entry[3]
+        finally:
+            for scan in prefetched:
+                scan.Close()
+
+    @staticmethod
+    def __Decorate(position, docs):
+        """
+        Decorate documents with the sort key (time key, index position, position in index)
+        """
+        for i, doc in enumerate(docs):
+            yield doc["timekey"], position, i, doc
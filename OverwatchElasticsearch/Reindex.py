@@ -0,0 +1,385 @@
+"""
+Connector to the ALICE Overwatch histogram database based on Elasticsearch
+Copyright (C) 2017  Markus Fasel
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from OverwatchData.Entry import MakeDocumentId, ParseDocumentId
+from OverwatchData.Histogram import OverwatchHistogram, OverwatchHistogramData, OverwatchSparseHistogramData
+from OverwatchData.Serialization import OverwatchBulkBuffer
+from OverwatchData.Time import OverwatchTimestamp
+
+class OverwatchReindexError(Exception):
+    """
+    Error raised when documents could not be written to the target index
+    """
+    pass
+
+class OverwatchRateLimiter(object):
+    """
+    Token bucket limiting the number of documents per second,
+    shared among all reindexing threads
+    """
+
+    def __init__(self, rate, burst = None):
+        """
+        Constructor
+
+        :param rate: Maximum number of documents per second (None or 0: unlimited)
+        :type rate: Float
+        :param burst: Maximum number of tokens which can be accumulated (default: rate)
+        :type burst: Float
+        """
+        self.__rate = rate
+        self.__burst = burst if burst else rate
+        self.__tokens = self.__burst
+        self.__last = time.time()
+        self.__lock = threading.Lock()
+
+    def Acquire(self, ntokens):
+        """
+        Wait until the requested amount of tokens is available
+
+        :param ntokens: Number of documents to be sent
+        :type ntokens: Int
+        """
+        if not self.__rate:
+            return
+        with self.__lock:
+            now = time.time()
+            self.__tokens = min(self.__burst, self.__tokens + (now - self.__last) * self.__rate)
+            self.__last = now
+            self.__tokens -= ntokens
+            wait = -self.__tokens / self.__rate if self.__tokens < 0 else 0.
+        if wait > 0:
+            time.sleep(wait)
+
+class OverwatchReindexCheckpoint(object):
+    """
+    Persistent record of the indices which were fully reindexed, so
+    that an interrupted reindexing can be resumed. Indices which were
+    in progress are processed again from the start: documents keep
+    their ID, so rewriting them is idempotent.
+    """
+
+    def __init__(self, filename = None):
+        """
+        Constructor, loading an existing checkpoint file
+
+        :param filename: Checkpoint file (None: no persistency)
+        :type filename: String
+        """
+        self.__filename = filename
+        self.__completed = {}
+        self.__lock = threading.Lock()
+        if filename and os.path.exists(filename):
+            with open(filename) as reader:
+                self.__completed = json.load(reader)["completed"]
+
+    def IsCompleted(self, index):
+        """
+        Check whether the index was already fully reindexed
+
+        :param index: Name of the source index
+        :type index: String
+        :return: True if the index was completed
+        :rtype: Bool
+        """
+        with self.__lock:
+            return index in self.__completed
+
+    def MarkCompleted(self, index, ndocs):
+        """
+        Mark index as completed and write the checkpoint file
+
+        :param index: Name of the source index
+        :type index: String
+        :param ndocs: Number of documents reindexed
+        :type ndocs: Int
+        """
+        with self.__lock:
+            self.__completed[index] = ndocs
+            if self.__filename:
+                tmpfile = self.__filename + ".tmp"
+                with open(tmpfile, "w") as writer:
+                    json.dump({"completed": self.__completed}, writer)
+                os.rename(tmpfile, self.__filename)
+
+def ConvertHistogramDocument(source):
+    """
+    Default document converter: Read the document into the
+    overwatch data classes and return them in the current
+    representation.
+    - Documents with header (full histograms) go through OverwatchHistogram.FromDict
+    - Data documents (time, name, data) go through OverwatchHistogramData.FromDict,
+      or OverwatchSparseHistogramData.FromDict for N-dimensional data (ndim).
+      The time key is derived from the time stamp if missing (and if
+      the time stamp has one, see OverwatchTimestamp.MakeSortKey).
+
+    :param source: Source document
+    :type source: Dictionary
+    :return: Converted document (object with Serialize method or JSON-compatible value)
+    """
+    if "header" in source:
+        histogram = OverwatchHistogram()
+        histogram.FromDict(source)
+        return histogram
+    if "ndim" in source["data"]:
+        data = OverwatchSparseHistogramData()
+    else:
+        data = OverwatchHistogramData()
+    data.FromDict(source["data"])
+    result = dict(source)
+    result["data"] = data.MakeDict()
+    if result.get("timekey") is None and "time" in source:
+        timestamp = OverwatchTimestamp()
+        timestamp.FromDict(source["time"])
+        try:
+            result["timekey"] = timestamp.MakeSortKey()
+        except ValueError:
+            # Incomplete time or fractional seconds: no time key, the document keeps its ID
+            pass
+    return result
+
+class OverwatchReindexer(object):
+    """
+    Rewrite existing Overwatch indices into new indices, converting
+    each document into the current data representation.
+
+    Source indices are processed in parallel, the amount of documents
+    written per second is limited in order not to starve production
+    ingest, and completed indices are checkpointed.
+
+    Data documents of the original format carry no histogram name. The
+    name is recovered from the document ID if it has the form
+    <histogram>_<timekey>, otherwise it cannot be recovered: such
+    documents keep their ID, are counted and logged, and are not found
+    by name (ScanTimeRange).
+    """
+
+    def __init__(self, connector, sourcepattern = "alice_overwatchdata_*", targetsuffix = "_v2"):
+        """
+        Constructor
+
+        :param connector: Connection to the database
+        :type connector: OverwatchElasticsearchConnector
+        :param sourcepattern: Pattern of the source indices
+        :type sourcepattern: String
+        :param targetsuffix: Suffix appended to the source index name to build the target index name
+        :type targetsuffix: String
+        """
+        self.__connector = connector
+        self.__sourcepattern = sourcepattern
+        self.__targetsuffix = targetsuffix
+        self.__targetnamer = None
+        self.__converter = ConvertHistogramDocument
+        self.__nworkers = 4
+        self.__batchsize = 500
+        self.__ratelimiter = OverwatchRateLimiter(None)
+        self.__checkpoint = OverwatchReindexCheckpoint()
+
+    def SetTargetNamer(self, namer):
+        """
+        Set custom function mapping source index names to target index names
+
+        :param namer: Function source index name -> target index name
+        :type namer: Callable
+        """
+        self.__targetnamer = namer
+
+    def SetConverter(self, converter):
+        """
+        Set custom document converter
+
+        :param converter: Function source document -> converted document
+        :type converter: Callable
+        """
+        self.__converter = converter
+
+    def SetNumberOfWorkers(self, nworkers):
+        """
+        Set the number of indices processed in parallel
+
+        :param nworkers: Number of worker threads
+        :type nworkers: Int
+        """
+        self.__nworkers = nworkers
+
+    def SetBatchSize(self, batchsize):
+        """
+        Set the number of documents per bulk request
+
+        :param batchsize: Number of documents per bulk request
+        :type batchsize: Int
+        """
+        self.__batchsize = batchsize
+
+    def SetRateLimit(self, docspersecond):
+        """
+        Set the maximum number of documents written per second (all workers)
+
+        :param docspersecond: Maximum rate (None or 0: unlimited)
+        :type docspersecond: Float
+        """
+        self.__ratelimiter = OverwatchRateLimiter(docspersecond)
+
+    def SetCheckpointFile(self, filename):
+        """
+        Set file used to checkpoint completed indices (resuming from it if existing)
+
+        :param filename: Name of the checkpoint file
+        :type filename: String
+        """
+        self.__checkpoint = OverwatchReindexCheckpoint(filename)
+
+    def GetTargetIndex(self, sourceindex):
+        """
+        Get the name of the target index for a given source index
+
+        :param sourceindex: Name of the source index
+        :type sourceindex: String
+        :return: Name of the target index
+        :rtype: String
+        """
+        if self.__targetnamer:
+            return self.__targetnamer(sourceindex)
+        return sourceindex + self.__targetsuffix
+
+    def GetSourceIndices(self):
+        """
+        Get the source indices matching the source pattern. Target indices
+        (which can match the source pattern as well, i.e. with the default
+        suffix) are excluded, so that a re-run does not reindex its own output.
+
+        :return: Names of the source indices
+        :rtype: List
+        """
+        indices = self.__connector.GetIndices(self.__sourcepattern)
+        targets = set(self.GetTargetIndex(index) for index in indices)
+        result = []
+        for index in indices:
+            if index in targets:
+                continue
+            if not self.__targetnamer and index.endswith(self.__targetsuffix):
+                continue
+            result.append(index)
+        return result
+
+    def __Flush(self, buf, ndocs):
+        """
+        Send buffered documents
+        """
+        if not ndocs:
+            return
+        self.__ratelimiter.Acquire(ndocs)
+        response = self.__connector.Bulk(buf.GetBytes())
+        buf.Clear()
+        if response.get("errors"):
+            failed = [item for item in response["items"] if "error" in list(item.values())[0]]
+            raise OverwatchReindexError("%d documents failed, first error: %s" %(len(failed), json.dumps(failed[0])))
+
+    def ReindexIndex(self, sourceindex):
+        """
+        Reindex a single source index
+
+        :param sourceindex: Name of the source index
+        :type sourceindex: String
+        :return: Number of documents reindexed
+        :rtype: Int
+        """
+        targetindex = self.GetTargetIndex(sourceindex)
+        buf = OverwatchBulkBuffer()
+        ndocs = 0
+        nbuffered = 0
+        nunnamed = 0
+        for hit in self.__connector.Scan(sourceindex, size = self.__batchsize):
+            converted = self.__converter(hit["_source"])
+            docid = hit["_id"]
+            if isinstance(converted, dict) and "data" in converted:
+                if not "name" in converted:
+                    parsed = ParseDocumentId(docid)
+                    if parsed is not None:
+                        converted["name"] = parsed[0]
+                    else:
+                        nunnamed += 1
+                # Data documents get the current ID (<histogram>_<timekey>)
+                if "name" in converted and converted.get("timekey") is not None:
+                    docid = MakeDocumentId(converted["name"], converted["timekey"])
+            buf.WriteValue({"index": {"_index": targetindex, "_id": docid}})
+            buf.WriteNewline()
+            if hasattr(converted, "Serialize"):
+                converted.Serialize(buf)
+            else:
+                buf.WriteValue(converted)
+            buf.WriteNewline()
+            nbuffered += 1
+            if nbuffered >= self.__batchsize:
+                self.__Flush(buf, nbuffered)
+                ndocs += nbuffered
+                nbuffered = 0
+        self.__Flush(buf, nbuffered)
+        ndocs += nbuffered
+        if nunnamed:
+            logging.warning("%s: %d data documents without histogram name (not recoverable from the document ID)", sourceindex, nunnamed)
+        self.__checkpoint.MarkCompleted(sourceindex, ndocs)
+        logging.info("Reindexed %s -> %s: %d documents", sourceindex, targetindex, ndocs)
+        return ndocs
+
+    def Run(self):
+        """
+        Reindex all source indices which are not yet completed
+
+        :return: Map source index -> number of documents reindexed
+        :rtype: Dictionary
+        """
+        pending = [index for index in self.GetSourceIndices() if not self.__checkpoint.IsCompleted(index)]
+        logging.info("Reindexing %d indices with %d workers", len(pending), self.__nworkers)
+        pool = ThreadPool(self.__nworkers)
+        try:
+            counts = pool.map(self.ReindexIndex, pending)
+        finally:
+            pool.close()
+            pool.join()
+        return dict(zip(pending, counts))
+
+def main():
+    from OverwatchElasticsearch.Connector import OverwatchElasticsearchConnector
+    import argparse
+    parser = argparse.ArgumentParser(description = "Reindex Overwatch histogram indices into the current data format")
+    parser.add_argument("--host", action = "append", help = "Elasticsearch host (can be repeated)")
+    parser.add_argument("--source", default = "alice_overwatchdata_*", help = "Pattern of the source indices")
+    parser.add_argument("--suffix", default = "_v2", help = "Suffix of the target indices")
+    parser.add_argument("--workers", type = int, default = 4, help = "Number of indices processed in parallel")
+    parser.add_argument("--batchsize", type = int, default = 500, help = "Number of documents per bulk request")
+    parser.add_argument("--rate", type = float, default = 0., help = "Maximum documents per second (0: unlimited)")
+    parser.add_argument("--checkpoint", default = None, help = "Checkpoint file for resuming")
+    args = parser.parse_args()
+    logging.basicConfig(level = logging.INFO)
+    reindexer = OverwatchReindexer(OverwatchElasticsearchConnector(args.host), args.source, args.suffix)
+    reindexer.SetNumberOfWorkers(args.workers)
+    reindexer.SetBatchSize(args.batchsize)
+    reindexer.SetRateLimit(args.rate)
+    reindexer.SetCheckpointFile(args.checkpoint)
+    reindexer.Run()
+
+if __name__ == "__main__":
+    main()
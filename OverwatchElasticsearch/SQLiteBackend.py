@@ -0,0 +1,242 @@
+"""
+Connector to the ALICE Overwatch histogram database based on Elasticsearch
+Copyright (C) 2017  Markus Fasel
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import fnmatch
+import json
+import threading
+
+from OverwatchData.Entry import MakeHeaderIndexName, MakeManifestIndexName
+from OverwatchData.Metadata import OverwatchSnapshotManifest
+from OverwatchData.Serialization import OverwatchBulkBuffer
+from OverwatchElasticsearch.Backend import OverwatchStorageBackend
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS documents (idx TEXT NOT NULL, docid TEXT, name TEXT, timekey INTEGER, body BLOB NOT NULL)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS documents_id ON documents (idx, docid)",
+    "CREATE INDEX IF NOT EXISTS documents_name_time ON documents (idx, name, timekey)",
+    "CREATE INDEX IF NOT EXISTS documents_time ON documents (idx, timekey)"
+]
+
+def DecodeDocument(body):
+    """
+    Decode document stored as UTF-8 encoded JSON
+
+    :param body: Stored document
+    :type body: Bytes
+    :return: Document
+    :rtype: Dictionary
+    """
+    return json.loads(bytes(body).decode("utf-8"))
+
+class OverwatchSQLiteBackend(OverwatchStorageBackend):
+    """
+    Local embedded store (SQLite) as stand-in for the Elasticsearch
+    cluster, i.e. for test beams and laptops.
+
+    All documents are stored in one table keyed by (index, document ID),
+    using the same index names as in Elasticsearch. Secondary indexes on
+    (index, histogram name, time) and (index, time) serve time-range scans
+    and latest-snapshot lookups.
+    """
+
+    def __init__(self, filename = ":memory:"):
+        """
+        Constructor, opening (or creating) the database
+
+        :param filename: Name of the database file (default: in memory)
+        :type filename: String
+        """
+        import sqlite3
+        self.__binary = sqlite3.Binary
+        self.__connection = sqlite3.connect(filename, check_same_thread = False)
+        self.__lock = threading.Lock()
+        with self.__lock:
+            for statement in SCHEMA:
+                self.__connection.execute(statement)
+            self.__connection.commit()
+
+    def Close(self):
+        """
+        Close the database
+        """
+        with self.__lock:
+            self.__connection.close()
+
+    def WriteBatch(self, batch, withheaders = True):
+        """
+        Write entry batch (data documents, snapshot manifest and optionally
+        headers) in one transaction
+
+        :param batch: Batch of histograms to be written
+        :type batch: EntryBatch
+        :param withheaders: Write also the histogram headers
+        :type withheaders: Bool
+        """
+        dataindex = batch.GetDataIndex()
+        timekey = batch.GetTimeKey()
+        rows = [(dataindex, docid, name, timekey, self.__binary(body)) for docid, name, body in batch.IterDataDocuments()]
+        headerrows = []
+        if withheaders:
+            buf = OverwatchBulkBuffer()
+            for i in range(0, batch.GetNumberOfHistograms()):
+                buf.Clear()
+                batch.GetHeader(i).Serialize(buf)
+                headerrows.append((MakeHeaderIndexName(), batch.GetHistogramName(i), batch.GetHistogramName(i), None, self.__binary(buf.GetBytes())))
+        with self.__lock:
+            with self.__connection:
+                self.__connection.executemany("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?)", headerrows + rows)
+                if timekey is not None and rows:
+                    self.__UpdateManifest(batch.MakeManifest())
+
+    def __UpdateManifest(self, manifest):
+        """
+        Append the documents of the manifest to the stored manifest
+        (lock and transaction handled by the caller)
+        """
+        manifestindex = MakeManifestIndexName()
+        row = self.__connection.execute("SELECT body FROM documents WHERE idx = ? AND docid = ?", (manifestindex, manifest.GetManifestId())).fetchone()
+        if row is not None:
+            stored = OverwatchSnapshotManifest()
+            stored.FromDict(DecodeDocument(row[0]))
+            for docid in manifest.GetListOfDocuments():
+                stored.AddDocument(docid)
+            manifest = stored
+        buf = OverwatchBulkBuffer()
+        manifest.Serialize(buf)
+        self.__connection.execute("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?)", (manifestindex, manifest.GetManifestId(), manifest.GetDetector(), manifest.GetTimeKey(), self.__binary(buf.GetBytes())))
+
+    def GetIndices(self, pattern):
+        """
+        Get the names of all indices matching a pattern
+
+        :param pattern: Index pattern (i.e. alice_overwatchdata_*)
+        :type pattern: String
+        :return: Sorted list of index names
+        :rtype: List
+        """
+        # Walk the distinct index names starting with the literal prefix of
+        # the pattern, one seek in the (idx, docid) index per name
+        prefix = pattern
+        for wildcard in "*?[":
+            prefix = prefix.split(wildcard, 1)[0]
+        indices = []
+        with self.__lock:
+            row = self.__connection.execute("SELECT MIN(idx) FROM documents WHERE idx >= ?", (prefix,)).fetchone()
+            while row[0] is not None and row[0].startswith(prefix):
+                indices.append(row[0])
+                row = self.__connection.execute("SELECT MIN(idx) FROM documents WHERE idx > ?", (row[0],)).fetchone()
+        return sorted(fnmatch.filter(indices, pattern))
+
+    def GetHeader(self, histname):
+        """
+        Get the header document of a histogram
+
+        :param histname: Name of the histogram
+        :type histname: String
+        :return: Header document (None if not found)
+        :rtype: Dictionary
+        """
+        with self.__lock:
+            row = self.__connection.execute("SELECT body FROM documents WHERE idx = ? AND docid = ?", (MakeHeaderIndexName(), histname)).fetchone()
+        return DecodeDocument(row[0]) if row else None
+
+    def ScanTimeRange(self, index, histname, start, end):
+        """
+        Get all snapshots of a histogram in a time range, ordered in time
+
+        :param index: Name of the data index
+        :type index: String
+        :param histname: Name of the histogram (None: all histograms)
+        :type histname: String
+        :param start: Start of the time range (time key, inclusive)
+        :type start: Int
+        :param end: End of the time range (time key, inclusive)
+        :type end: Int
+        :return: Data documents ordered by time
+        :rtype: Generator
+        """
+        with self.__lock:
+            if histname is None:
+                rows = self.__connection.execute("SELECT body FROM documents WHERE idx = ? AND timekey BETWEEN ? AND ? ORDER BY timekey", (index, start, end)).fetchall()
+            else:
+                rows = self.__connection.execute("SELECT body FROM documents WHERE idx = ? AND name = ? AND timekey BETWEEN ? AND ? ORDER BY timekey", (index, histname, start, end)).fetchall()
+        for row in rows:
+            yield DecodeDocument(row[0])
+
+    def GetLatestSnapshot(self, index, histname):
+        """
+        Get the most recent snapshot of a histogram
+
+        :param index: Name of the data index
+        :type index: String
+        :param histname: Name of the histogram
+        :type histname: String
+        :return: Data document (None if not found)
+        :rtype: Dictionary
+        """
+        with self.__lock:
+            row = self.__connection.execute("SELECT body FROM documents WHERE idx = ? AND name = ? ORDER BY timekey DESC LIMIT 1", (index, histname)).fetchone()
+        return DecodeDocument(row[0]) if row else None
+
+    def GetManifest(self, detector, run, timekey):
+        """
+        Get the snapshot manifest of a detector for a given run and time
+
+        :param detector: Name of the detector
+        :type detector: String
+        :param run: Run number
+        :type run: Int
+        :param timekey: Time of the snapshot
+        :type timekey: Int
+        :return: Snapshot manifest (None if not found)
+        :rtype: OverwatchSnapshotManifest
+        """
+        manifest = OverwatchSnapshotManifest(run, detector, timekey)
+        with self.__lock:
+            row = self.__connection.execute("SELECT body FROM documents WHERE idx = ? AND docid = ?", (MakeManifestIndexName(), manifest.GetManifestId())).fetchone()
+        if row is None:
+            return None
+        manifest.FromDict(DecodeDocument(row[0]))
+        return manifest
+
+    def GetDetectorSnapshot(self, detector, run, timekey):
+        """
+        Load all histogram snapshots of a detector for a given run and time
+
+        :param detector: Name of the detector
+        :type detector: String
+        :param run: Run number
+        :type run: Int
+        :param timekey: Time of the snapshot
+        :type timekey: Int
+        :return: Data documents of all histograms in the snapshot (empty if not found)
+        :rtype: List
+        """
+        manifest = self.GetManifest(detector, run, timekey)
+        if manifest is None:
+            return []
+        documents = manifest.GetListOfDocuments()
+        bodies = {}
+        with self.__lock:
+            # Chunks below the SQLite limit of bound parameters
+            for first in range(0, len(documents), 500):
+                chunk = documents[first:first + 500]
+                query = "SELECT docid, body FROM documents WHERE idx = ? AND docid IN (%s)" %",".join("?" * len(chunk))
+                bodies.update(self.__connection.execute(query, [manifest.GetIndex()] + chunk))
+        # Same order as the manifest (as the multi-get in Elasticsearch)
+        return [DecodeDocument(bodies[docid]) for docid in documents if docid in bodies]
@@ -0,0 +1,193 @@
+"""
+Connector to the ALICE Overwatch histogram database based on Elasticsearch
+Copyright (C) 2017  Markus Fasel
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Simulation test of the adaptive bulk sender against a fake cluster with
+# programmable latency and capacity. The cluster is idle, becomes busy
+# (higher latency, rejected requests and rejected items) and recovers.
+# The fake cluster keeps the written documents and manifests. The script
+# prints the trajectory of each phase and fails (exit code 1) if
+# - batch size and concurrency do not shrink in the busy phase,
+# - they do not grow back once the cluster recovered,
+# - a high-priority document or the latest low-priority snapshot of a
+#   histogram was not written,
+# - a manifest references a document which was not written, or a written
+#   high-priority document is missing in its manifest.
+
+import json
+import random
+import sys
+import threading
+import time
+
+import Synthetic
+from OverwatchData.Entry import EntryBatch
+from OverwatchData.Time import OverwatchTimestamp
+from OverwatchElasticsearch.BulkSender import OverwatchAdaptiveBulkSender, OverwatchAIMDController
+
+class FakeRejection(Exception):
+    """
+    Whole bulk request rejected (HTTP 429)
+    """
+
+    def __init__(self):
+        Exception.__init__(self, "es_rejected_execution_exception")
+        self.status_code = 429
+
+class FakeCluster(object):
+    """
+    Fake bulk endpoint: latency = base + documents / throughput, requests
+    above the number of write threads are rejected, single items are
+    rejected with a given probability
+    """
+
+    def __init__(self, seed = 1):
+        self.__lock = threading.Lock()
+        self.__inflight = 0
+        self.__random = random.Random(seed)
+        self.__documents = set()
+        self.__manifests = {}
+        self.SetProfile(0.005, 200000., 8, 0.)
+
+    def SetProfile(self, baselatency, throughput, writethreads, itemrejection):
+        """
+        Program the behaviour of the cluster
+
+        :param baselatency: Latency of an empty request in seconds
+        :param throughput: Documents per second per request
+        :param writethreads: Maximum number of concurrent bulk requests
+        :param itemrejection: Probability that a single item is rejected
+        """
+        self.__baselatency = baselatency
+        self.__throughput = throughput
+        self.__writethreads = writethreads
+        self.__itemrejection = itemrejection
+
+    def GetDocuments(self):
+        return self.__documents
+
+    def GetManifests(self):
+        return self.__manifests
+
+    def Bulk(self, body):
+        lines = body.split(b"\n")
+        ndocs = len(lines) // 2
+        with self.__lock:
+            if self.__inflight >= self.__writethreads:
+                raise FakeRejection()
+            self.__inflight += 1
+        try:
+            time.sleep(self.__baselatency + ndocs / self.__throughput)
+        finally:
+            with self.__lock:
+                self.__inflight -= 1
+        items = []
+        errors = False
+        with self.__lock:
+            for i in range(0, len(lines) - 1, 2):
+                operation, meta = list(json.loads(lines[i].decode("utf-8")).items())[0]
+                if self.__random.random() < self.__itemrejection:
+                    items.append({operation: {"status": 429, "error": {"type": "es_rejected_execution_exception"}}})
+                    errors = True
+                    continue
+                if operation == "index":
+                    self.__documents.add((meta["_index"], meta["_id"]))
+                else:
+                    update = json.loads(lines[i + 1].decode("utf-8"))
+                    manifest = self.__manifests.setdefault(meta["_id"], (update["upsert"]["index"], set()))
+                    manifest[1].update(update["script"]["params"]["documents"])
+                items.append({operation: {"status": 200}})
+        return {"errors": errors, "items": items}
+
+PHASES = [
+    ("idle", 0.005, 200000., 8, 0.),
+    ("busy", 0.05, 5000., 2, 0.05),
+    ("recovered", 0.005, 200000., 8, 0.)
+]
+
+HIGHPRIORITY = ["EMC", "TPC"]
+LOWPRIORITY = ["TRD", "ZDC"]
+
+def Check(condition, message, failures):
+    print("%s: %s" %("ok" if condition else "FAILED", message))
+    if not condition:
+        failures.append(message)
+
+def main():
+    cluster = FakeCluster()
+    sender = OverwatchAdaptiveBulkSender(cluster, OverwatchAIMDController(startbatch = 200, maxbatch = 4000, maxconcurrency = 8, additive = 200, targetlatency = 0.25))
+    histograms = Synthetic.MakeOverwatchHistograms(200, [10])
+    high = set()
+    latestlow = {}
+    snapshot = 0
+    trajectories = {}
+    for phase, baselatency, throughput, writethreads, itemrejection in PHASES:
+        cluster.SetProfile(baselatency, throughput, writethreads, itemrejection)
+        before = sender.GetStatistics()
+        start = time.time()
+        trajectory = []
+        while time.time() - start < 3.:
+            snapshot += 1
+            for detector in HIGHPRIORITY + LOWPRIORITY:
+                batch = EntryBatch(detector, None, 1234, OverwatchTimestamp(2017, 6, 1, 0, snapshot // 60, snapshot % 60))
+                for hist in histograms:
+                    batch.AddHistogram(hist)
+                for i in range(0, batch.GetNumberOfHistograms()):
+                    if detector in HIGHPRIORITY:
+                        high.add((batch.GetDataIndex(), batch.GetDocumentId(i)))
+                    else:
+                        latestlow[(batch.GetDataIndex(), batch.GetHistogramName(i))] = batch.GetDocumentId(i)
+                # Detectors with low priority: only the latest snapshot is needed
+                sender.Submit(batch, lowpriority = detector in LOWPRIORITY)
+            statistics = sender.GetStatistics()
+            trajectory.append((statistics["batchsize"], statistics["concurrency"]))
+            time.sleep(0.05)
+        after = sender.GetStatistics()
+        seconds = time.time() - start
+        trajectories[phase] = trajectory
+        print("%-10s sent %8.0f docs/s, rejected %6d, shed %6d, pending %6d, batch size %s, concurrency %s" %(phase, (after["documents"] - before["documents"]) / seconds,
+              after["rejected"] - before["rejected"], after["shed"] - before["shed"], after["pending"],
+              "%d-%d" %(min(t[0] for t in trajectory), max(t[0] for t in trajectory)), "%d-%d" %(min(t[1] for t in trajectory), max(t[1] for t in trajectory))))
+    sender.Close()
+    statistics = sender.GetStatistics()
+    print("total", statistics)
+
+    failures = []
+    idle, busy, recovered = trajectories["idle"][-1], trajectories["busy"], trajectories["recovered"]
+    Check(min(t[0] for t in busy) < idle[0], "batch size shrinks when busy (%d -> %d)" %(idle[0], min(t[0] for t in busy)), failures)
+    Check(min(t[1] for t in busy) < idle[1], "concurrency shrinks when busy (%d -> %d)" %(idle[1], min(t[1] for t in busy)), failures)
+    Check(max(t[0] for t in recovered) > busy[-1][0], "batch size grows after recovery (%d -> %d)" %(busy[-1][0], max(t[0] for t in recovered)), failures)
+    Check(max(t[1] for t in recovered) > busy[-1][1], "concurrency grows after recovery (%d -> %d)" %(busy[-1][1], max(t[1] for t in recovered)), failures)
+    documents = cluster.GetDocuments()
+    Check(statistics["pending"] == 0 and statistics.get("pendingmanifests", 0) == 0 and statistics["failed"] == 0, "all pending documents and manifest updates sent", failures)
+    Check(not (high - documents), "no high-priority document lost (%d missing of %d)" %(len(high - documents), len(high)), failures)
+    missinglow = [key for key, docid in latestlow.items() if not (key[0], docid) in documents]
+    Check(not missinglow, "latest low-priority snapshot of each histogram written (%d missing)" %len(missinglow), failures)
+    dangling = 0
+    indexed = {}
+    for manifestid, (index, docids) in cluster.GetManifests().items():
+        dangling += len([docid for docid in docids if not (index, docid) in documents])
+        for docid in docids:
+            indexed[(index, docid)] = manifestid
+    Check(dangling == 0, "manifests reference only written documents (%d dangling)" %dangling, failures)
+    unlisted = len([key for key in high if not key in indexed])
+    Check(unlisted == 0, "written high-priority documents listed in their manifest (%d missing)" %unlisted, failures)
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Connector to the ALICE Overwatch histogram database based on Elasticsearch
+Copyright (C) 2017  Markus Fasel
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Behaviour test of the change detection (OverwatchData.Alerting) as ingest
+# stage of the adaptive bulk sender. Histograms are sent with a stable
+# baseline, then one snapshot with an empty histogram, a spike, a drop and
+# a loss of occupancy. Exits with an error code unless exactly the expected
+# alerts are raised, a new run with a different level restarts the
+# baselines without alerts, the number of tracked histograms stays bounded,
+# and concurrent first inserts from several threads keep consistent
+# baselines.
+
+import sys
+import threading
+import time
+
+import Synthetic
+from OverwatchData.Alerting import OverwatchAlert, OverwatchChangeDetector
+from OverwatchData.Entry import EntryBatch
+from OverwatchData.Histogram import OverwatchHistogram, OverwatchHistogramData
+from OverwatchData.Time import OverwatchTimestamp
+from OverwatchElasticsearch.BulkSender import OverwatchAdaptiveBulkSender
+
+class NullCluster(object):
+    """
+    Fake bulk endpoint accepting all documents
+    """
+
+    def Bulk(self, body):
+        return {"errors": False, "items": []}
+
+def MakeHistogram(name, nfilled, value):
+    data = OverwatchHistogramData()
+    data.SetNbinsTotal(1000)
+    for i in range(0, nfilled):
+        data.SetBin(i + 1, value)
+    histogram = OverwatchHistogram()
+    histogram.SetName(name)
+    histogram.SetData(data)
+    return histogram
+
+# name -> (baseline (filled bins, value per bin), last snapshot, expected alerts)
+SCENARIOS = {
+    "stable": ((100, 1.), (100, 1.), []),
+    "negative": ((10, -0.5), (10, -0.5), []),
+    "empty": ((100, 1.), (0, 0.), [OverwatchAlert.EMPTY]),
+    "spike": ((100, 1.), (100, 10.), [OverwatchAlert.SPIKE]),
+    "drop": ((100, 1.), (100, 0.1), [OverwatchAlert.DROP]),
+    "occupancy": ((100, 1.), (20, 5.), [OverwatchAlert.OCCUPANCY])
+}
+
+def Check(condition, message, failures):
+    print("%s: %s" %("ok" if condition else "FAILED", message))
+    if not condition:
+        failures.append(message)
+
+def TestAlerts(failures):
+    detector = OverwatchChangeDetector(window = 5, minsnapshots = 3)
+    alerts = []
+    detector.AddListener(alerts.append)
+    sender = OverwatchAdaptiveBulkSender(NullCluster())
+    sender.AddIngestStage(detector.ProcessBatch)
+    for snapshot in range(0, 6):
+        batch = EntryBatch("EMC", "histogram", 1234, OverwatchTimestamp(2017, 6, 1, 0, 0, snapshot))
+        for name, (baseline, last, expected) in sorted(SCENARIOS.items()):
+            nfilled, value = last if snapshot == 5 else baseline
+            batch.AddHistogram(MakeHistogram(name, nfilled, value))
+        sender.Submit(batch)
+    sender.Close()
+    raised = sorted((alert.GetHistogram(), alert.GetKind()) for alert in alerts)
+    expected = sorted((name, kind) for name, (baseline, last, kinds) in SCENARIOS.items() for kind in kinds)
+    Check(raised == expected, "alerts %s" %raised, failures)
+    Check(all(alert.GetTimeKey() == 20170601000005 for alert in alerts), "alerts carry the time of the snapshot", failures)
+
+def TestRunChange(failures):
+    detector = OverwatchChangeDetector(window = 5, minsnapshots = 3)
+    alerts = []
+    for run, (nfilled, value) in [(1234, (100, 1.)), (1235, (30, 20.))]:
+        for snapshot in range(0, 6):
+            batch = EntryBatch("EMC", "histogram", run, OverwatchTimestamp(2017, 6, 1, run - 1234, 0, snapshot))
+            batch.AddHistogram(MakeHistogram("hist", nfilled, value))
+            alerts.extend(detector.ProcessBatch(batch))
+    Check(not alerts, "no alerts at a run change (%d raised)" %len(alerts), failures)
+    Check(detector.GetBaseline("EMC", "hist") == (600., 30.), "baseline from the new run only", failures)
+    Check(detector.GetNumberOfTrackedHistograms() == 1, "one slot per histogram across runs", failures)
+
+def TestBound(failures):
+    detector = OverwatchChangeDetector(window = 4, minsnapshots = 2, maxhistograms = 3)
+    for snapshot in range(0, 2):
+        for i in range(0, 5):
+            detector.Process("EMC", "hist%d" %i, 100., 10)
+    Check(detector.GetNumberOfTrackedHistograms() == 3, "tracked histograms bounded (%d of 5)" %detector.GetNumberOfTrackedHistograms(), failures)
+    Check(detector.GetNumberOfUntrackedSnapshots() == 4, "snapshots beyond the bound counted (%d)" %detector.GetNumberOfUntrackedSnapshots(), failures)
+    Check(detector.GetBaseline("EMC", "hist4") is None, "histogram beyond the bound has no baseline", failures)
+
+def TestConcurrentInserts(failures, nthreads = 8, nhistograms = 500):
+    # Frequent thread switches in order to provoke races
+    sys.setswitchinterval(1e-6)
+    detector = OverwatchChangeDetector(window = 3, minsnapshots = 1)
+    def worker(thread):
+        for i in range(0, nhistograms):
+            detector.Process("EMC", "hist%d_%d" %(thread, i), float(thread * nhistograms + i), thread)
+    threads = [threading.Thread(target = worker, args = (t,)) for t in range(0, nthreads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    sys.setswitchinterval(0.005)
+    wrong = [(t, i) for t in range(0, nthreads) for i in range(0, nhistograms) if detector.GetBaseline("EMC", "hist%d_%d" %(t, i)) != (float(t * nhistograms + i), float(t))]
+    Check(detector.GetNumberOfTrackedHistograms() == nthreads * nhistograms and not wrong, "concurrent first inserts keep consistent baselines (%d wrong)" %len(wrong), failures)
+
+def MeasureThroughput():
+    detector = OverwatchChangeDetector()
+    batch = EntryBatch("EMC", "histogram", 1234, OverwatchTimestamp(2017, 6, 1, 0, 0, 0))
+    for histogram in Synthetic.MakeOverwatchHistograms(1000, [100], 0.5):
+        batch.AddHistogram(histogram)
+    start = time.time()
+    for i in range(0, 10):
+        detector.ProcessBatch(batch)
+    print("ProcessBatch: %.0f histograms/s" %(10 * len(batch) / (time.time() - start)))
+
+def main():
+    failures = []
+    TestAlerts(failures)
+    TestRunChange(failures)
+    TestBound(failures)
+    TestConcurrentInserts(failures)
+    MeasureThroughput()
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Connector to the ALICE Overwatch histogram database based on Elasticsearch
+Copyright (C) 2017  Markus Fasel
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Stress test of the thread-safe shared metadata (OverwatchData.Concurrent).
+#
+# Race test: 2 to 16 threads register the same detectors and histograms in
+# random order. The names yield the interpreter lock whenever they are
+# hashed, which forces thread switches between the membership check and
+# the insert. The shared descriptors must neither duplicate nor lose an
+# entry (the script fails otherwise); the plain OverwatchRunDescriptor
+# (check-then-append) is run the same way to show the race.
+#
+# Throughput test: each thread registers its own runs (disjoint keys), so
+# every call takes the writer path. With the interpreter lock no parallel
+# speed-up is expected, the numbers show the cost of the locking.
+
+import random
+import sys
+import threading
+import time
+
+import Synthetic
+from OverwatchData.Concurrent import OverwatchSharedHeaderCache, OverwatchSharedRunRegistry
+from OverwatchData.Histogram import OverwatchHistogramHeader
+from OverwatchData.Metadata import OverwatchRunDescriptor
+
+NDETECTORS = 20
+NHISTOGRAMS = 100
+NDISJOINT = 5000
+
+class YieldingName(str):
+    """
+    Name giving up the interpreter lock each time it is hashed
+    """
+
+    def __hash__(self):
+        time.sleep(0)
+        return str.__hash__(self)
+
+def MakeWork(seed):
+    work = [(YieldingName("DET%d" %d), YieldingName("hist%d" %h)) for d in range(0, NDETECTORS) for h in range(0, NHISTOGRAMS)]
+    random.Random(seed).shuffle(work)
+    return work
+
+def RunThreads(works, target):
+    threads = [threading.Thread(target = target, args = (work,)) for work in works]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - start
+
+def CountErrors(descriptordict):
+    """
+    Count duplicated and missing detectors and histograms
+
+    :return: Tuple (duplicates, missing)
+    """
+    detectors = [d["detector"] for d in descriptordict["detectors"]]
+    duplicates = len(detectors) - len(set(detectors))
+    missing = NDETECTORS - len(set(detectors))
+    for d in descriptordict["detectors"]:
+        duplicates += len(d["histograms"]) - len(set(d["histograms"]))
+    histograms = {}
+    for d in descriptordict["detectors"]:
+        histograms.setdefault(d["detector"], set()).update(d["histograms"])
+    missing += sum(NHISTOGRAMS - len(h) for h in histograms.values())
+    return duplicates, missing
+
+def RaceShared(nthreads):
+    registry = OverwatchSharedRunRegistry()
+    headers = OverwatchSharedHeaderCache()
+    def worker(work):
+        for detector, histogram in work:
+            run = registry.GetRun(1234)
+            run.AddHistogramForDetector(detector, histogram)
+            run.GetDetector(detector).HasHistogram(histogram)
+            if headers.GetHeader(histogram) is None:
+                header = OverwatchHistogramHeader()
+                header.SetName(histogram)
+                headers.AddHeader(header)
+    RunThreads([MakeWork(i) for i in range(0, nthreads)], worker)
+    duplicates, missing = CountErrors(registry.GetRun(1234).MakeDict())
+    return duplicates, missing, len(headers)
+
+def RacePlain(nthreads):
+    descriptor = OverwatchRunDescriptor(1234)
+    def worker(work):
+        for detector, histogram in work:
+            descriptor.AddHistogramForDetector(detector, histogram)
+    RunThreads([MakeWork(i) for i in range(0, nthreads)], worker)
+    return CountErrors(descriptor.MakeDict())
+
+def ThroughputShared(nthreads):
+    registry = OverwatchSharedRunRegistry()
+    works = [[(nthreads * 1000 + t, "DET%d" %(i % NDETECTORS), "hist%d" %i) for i in range(0, NDISJOINT)] for t in range(0, nthreads)]
+    def worker(work):
+        for run, detector, histogram in work:
+            registry.AddHistogram(run, detector, histogram)
+    seconds = RunThreads(works, worker)
+    return nthreads * NDISJOINT / seconds
+
+def main():
+    # Frequent thread switches in order to provoke races
+    sys.setswitchinterval(1e-5)
+    failed = False
+    plainraces = 0
+    for nthreads in [2, 4, 8, 16]:
+        duplicates, missing, nheaders = RaceShared(nthreads)
+        plainduplicates, plainmissing = RacePlain(nthreads)
+        plainraces += plainduplicates
+        print("race %2d threads: shared %d duplicates, %d missing, %d headers | plain %d duplicates, %d missing" %(nthreads, duplicates, missing, nheaders, plainduplicates, plainmissing))
+        if duplicates or missing or nheaders != NHISTOGRAMS:
+            failed = True
+    if not plainraces:
+        print("Note: no race provoked in the plain descriptor")
+    for nthreads in [1, 2, 4, 8, 16]:
+        print("disjoint %2d threads: shared %10.0f ops/s" %(nthreads, ThroughputShared(nthreads)))
+    if failed:
+        print("FAILED: shared metadata duplicated or lost entries")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
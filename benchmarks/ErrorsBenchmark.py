@@ -0,0 +1,60 @@
+"""
+Connector to the ALICE Overwatch histogram database based on Elasticsearch
+Copyright (C) 2017  Markus Fasel
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Cost of storing bin errors in OverwatchHistogramData: memory (tracemalloc,
+# Python 3 only) and JSON bytes per histogram for
+# - contents only (errors not requested)
+# - unweighted histograms (errors equal to sqrt(content), not stored)
+# - weighted histograms (sumw2, errors stored)
+
+import tracemalloc
+
+from Synthetic import SyntheticHistogram
+from OverwatchData.Histogram import OverwatchHistogram
+from OverwatchData.Serialization import OverwatchBulkBuffer
+
+CASES = [
+    ("contents only", False, False),
+    ("unweighted, sqrt errors", False, True),
+    ("weighted, errors stored", True, True)
+]
+
+def Measure(nhist, nbins, occupancy, weighted, witherrors):
+    roothists = [SyntheticHistogram("hist%d" %i, nbins, occupancy, seed = i, weighted = weighted) for i in range(0, nhist)]
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    datas = []
+    for roothist in roothists:
+        hist = OverwatchHistogram()
+        hist.Initialize(roothist, witherrors)
+        datas.append(hist.GetData())
+    end = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    buf = OverwatchBulkBuffer()
+    for data in datas:
+        data.Serialize(buf)
+    return float(end - start) / nhist, float(len(buf)) / nhist
+
+def main():
+    for name, nbins, occupancy in [("TH1 100 bins", [100], 1.), ("TH2 1e4 cells, 10%", [100, 100], 0.1)]:
+        for case, weighted, witherrors in CASES:
+            memory, size = Measure(100, nbins, occupancy, weighted, witherrors)
+            print("%-20s %-25s %10.0f bytes in memory %10.0f JSON bytes" %(name, case, memory, size))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Connector to the ALICE Overwatch histogram database based on Elasticsearch
+Copyright (C) 2017  Markus Fasel
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Memory footprint (bytes per object) of the OverwatchData classes,
+# measured with tracemalloc (Python 3 only) when creating many instances
+
+import tracemalloc
+
+import Synthetic
+from OverwatchData.Entry import Entry
+from OverwatchData.Histogram import OverwatchHistogram, OverwatchHistogramAxis, OverwatchHistogramData, OverwatchHistogramHeader
+from OverwatchData.Metadata import OverwatchDetectorDescriptor, OverwatchRunDescriptor
+from OverwatchData.Time import OverwatchTimestamp
+
+def MeasureBytesPerObject(factory, nobjects = 100000):
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    objects = [factory() for i in range(0, nobjects)]
+    end = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # Subtract the list holding the objects
+    return float(end - start) / nobjects - 8., objects
+
+FACTORIES = [
+    ("OverwatchTimestamp", lambda: OverwatchTimestamp(2017, 1, 2, 3, 4, 5)),
+    ("OverwatchHistogramAxis", OverwatchHistogramAxis),
+    ("OverwatchHistogramData", OverwatchHistogramData),
+    ("OverwatchHistogramHeader", OverwatchHistogramHeader),
+    ("OverwatchHistogram", OverwatchHistogram),
+    ("OverwatchDetectorDescriptor", lambda: OverwatchDetectorDescriptor("EMC")),
+    ("OverwatchRunDescriptor", lambda: OverwatchRunDescriptor(1234)),
+    ("Entry", lambda: Entry("EMC", "histo", 1234))
+]
+
+def main():
+    for name, factory in FACTORIES:
+        bytesperobject, objects = MeasureBytesPerObject(factory)
+        print("%-30s %8.1f bytes/object" %(name, bytesperobject))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Connector to the ALICE Overwatch histogram database based on Elasticsearch
+Copyright (C) 2017  Markus Fasel
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Time-window query across runs on the embedded SQLite backend: the run
+# catalog prunes the data indices to the runs overlapping the window,
+# compared with a naive scan of all alice_overwatchdata_<detector>_* indices
+# merged afterwards. Both must return the same snapshots.
+
+import time
+
+import Synthetic
+from OverwatchData.Entry import EntryBatch
+from OverwatchData.Time import OverwatchTimestamp
+from OverwatchElasticsearch.Query import OverwatchRunCatalog, OverwatchTimeWindowQuery
+from OverwatchElasticsearch.SQLiteBackend import OverwatchSQLiteBackend
+
+NRUNS = 100
+DETECTORS = ["EMC", "TPC", "TRD"]
+NSNAPSHOTS = 12
+NHISTOGRAMS = 20
+
+def Fill(backend, catalog):
+    histograms = Synthetic.MakeOverwatchHistograms(NHISTOGRAMS, [100], 0.5)
+    for run in range(0, NRUNS):
+        for detector in DETECTORS:
+            for snapshot in range(0, NSNAPSHOTS):
+                # one run per hour, one snapshot every 5 minutes
+                batch = EntryBatch(detector, "histogram", run, OverwatchTimestamp(2017, 6, 1 + run // 24, run % 24, snapshot * 5, 0))
+                for hist in histograms:
+                    batch.AddHistogram(hist)
+                backend.WriteBatch(batch, False)
+                catalog.AddBatch(batch)
+
+def NaiveQuery(backend, detector, histname, start, end):
+    docs = []
+    for index in backend.GetIndices("alice_overwatchdata_%s_*" %detector):
+        docs.extend(backend.ScanTimeRange(index, histname, start, end))
+    return sorted(docs, key = lambda doc: doc["timekey"])
+
+def main():
+    backend = OverwatchSQLiteBackend()
+    catalog = OverwatchRunCatalog()
+    Fill(backend, catalog)
+    query = OverwatchTimeWindowQuery(backend, catalog)
+    for hours in [1, 6, 24]:
+        start = OverwatchTimestamp(2017, 6, 2, 0, 0, 0)
+        end = OverwatchTimestamp(2017, 6, 2 + hours // 24, hours % 24, 0, 0)
+        tstart = time.time()
+        docs = list(query.Query("EMC", "hist0", start, end))
+        pruned = time.time() - tstart
+        tstart = time.time()
+        naive = NaiveQuery(backend, "EMC", "hist0", start.MakeSortKey(), end.MakeSortKey())
+        naiveseconds = time.time() - tstart
+        same = [d["timekey"] for d in docs] == [d["timekey"] for d in naive]
+        print("%2dh window: %3d snapshots, %3d/%d indices, pruned %7.2f ms | naive %7.2f ms | same result: %s" %(hours, len(docs), len(catalog.GetIndices("EMC", start, end)), NRUNS, pruned * 1000., naiveseconds * 1000., same))
+
+if __name__ == "__main__":
+    main()
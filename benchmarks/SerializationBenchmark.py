@@ -0,0 +1,53 @@
+"""
+Connector to the ALICE Overwatch histogram database based on Elasticsearch
+Copyright (C) 2017  Markus Fasel
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Throughput of the document serialization (documents/second):
+# - dict: MakeDict + json.dumps from the standard library (previous path)
+# - buffer: Serialize into a reusable OverwatchBulkBuffer, for each available encoder
+
+import json
+import timeit
+
+from Synthetic import MakeOverwatchHistograms
+from OverwatchData import Serialization
+from OverwatchData.Serialization import OverwatchBulkBuffer
+
+def RunDictPath(histograms):
+    for hist in histograms:
+        json.dumps(hist.MakeDict())
+
+def RunBufferPath(histograms, buf):
+    buf.Clear()
+    for hist in histograms:
+        hist.Serialize(buf)
+        buf.WriteNewline()
+
+def Measure(function, ndocs, repeat = 5):
+    return ndocs / min(timeit.repeat(function, number = 1, repeat = repeat))
+
+def main():
+    histograms = MakeOverwatchHistograms(2000, [100])
+    ndocs = len(histograms)
+    print("%-20s %15.0f docs/s" %("dict+json", Measure(lambda: RunDictPath(histograms), ndocs)))
+    buf = OverwatchBulkBuffer()
+    for encoder in Serialization.GetListOfEncoders():
+        Serialization.SetEncoder(encoder)
+        print("%-20s %15.0f docs/s" %("buffer+" + encoder, Measure(lambda: RunBufferPath(histograms, buf), ndocs)))
+
+if __name__ == "__main__":
+    main()
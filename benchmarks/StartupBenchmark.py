@@ -0,0 +1,97 @@
+"""
+Connector to the ALICE Overwatch histogram database based on Elasticsearch
+Copyright (C) 2017  Markus Fasel
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Import time of the Overwatch modules. Each module is imported in a fresh
+# interpreter (like a short-lived conversion job), the best time out of
+# several repetitions is reported together with the heavy dependencies
+# the import pulled in. The standard library modules the data model needs
+# anyway (array, math, threading) are measured as baseline. Exits with an
+# error code if the pure data model (OverwatchData) takes longer than the
+# budget on top of the baseline:
+#
+#   python benchmarks/StartupBenchmark.py [--repeat 10] [--budget 5]
+
+import argparse
+import os
+import subprocess
+import sys
+
+MODULES = [
+    "OverwatchData.Histogram",
+    "OverwatchData.Metadata",
+    "OverwatchData.Entry",
+    "OverwatchData.Alerting",
+    "OverwatchData.Concurrent",
+    "OverwatchElasticsearch.Connector",
+    "OverwatchElasticsearch.SQLiteBackend",
+    "OverwatchElasticsearch.BulkSender",
+    "OverwatchElasticsearch.Reindex"
+]
+
+BASELINE = "array, bisect, math, threading"
+
+HEAVY = ["ROOT", "numpy", "elasticsearch", "sqlite3", "orjson", "ujson", "json", "logging", "argparse"]
+
+# Imports of the interpreter itself are subtracted by measuring from
+# inside the child process
+PROGRAM = """
+import sys, time
+sys.path.insert(0, %r)
+start = time.time()
+import %s
+elapsed = time.time() - start
+print("%%f %%s" %%(elapsed * 1000., ",".join(m for m in %r if m in sys.modules)))
+"""
+
+def MeasureImport(module, repeat):
+    """
+    Best import time of a module in a fresh interpreter
+
+    :return: Tuple (milliseconds, list of heavy modules loaded)
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    best = None
+    heavy = []
+    for i in range(0, repeat):
+        output = subprocess.check_output([sys.executable, "-c", PROGRAM %(root, module, HEAVY)]).decode("utf-8").split()
+        milliseconds = float(output[0])
+        heavy = output[1].split(",") if len(output) > 1 else []
+        if best is None or milliseconds < best:
+            best = milliseconds
+    return best, heavy
+
+def main():
+    parser = argparse.ArgumentParser(description = "Import time of the Overwatch modules")
+    parser.add_argument("--repeat", type = int, default = 10, help = "Number of fresh interpreters per module")
+    parser.add_argument("--budget", type = float, default = 5., help = "Maximum import time of the OverwatchData modules on top of the baseline in ms")
+    args = parser.parse_args()
+
+    baseline, heavy = MeasureImport(BASELINE, args.repeat)
+    print("%-40s %8.2f ms" %("baseline (" + BASELINE + ")", baseline))
+    failed = []
+    for module in MODULES:
+        milliseconds, heavy = MeasureImport(module, args.repeat)
+        print("%-40s %8.2f ms   %+8.2f ms   %s" %(module, milliseconds, milliseconds - baseline, " ".join(heavy)))
+        if module.startswith("OverwatchData.") and milliseconds - baseline > args.budget:
+            failed.append(module)
+    if failed:
+        print("Above the budget of %.1f ms: %s" %(args.budget, ", ".join(failed)))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
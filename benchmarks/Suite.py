@@ -0,0 +1,180 @@
+"""
+Connector to the ALICE Overwatch histogram database based on Elasticsearch
+Copyright (C) 2017  Markus Fasel
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Benchmark suite with synthetic Overwatch workloads. Results are written
+# as JSON (tagged with the git commit) and can be compared with a previous
+# result file in order to spot regressions:
+#
+#   python benchmarks/Suite.py --output before.json
+#   python benchmarks/Suite.py --output after.json --compare before.json
+
+import argparse
+import json
+import platform
+import subprocess
+import time
+import timeit
+
+from Synthetic import SyntheticHistogram, SyntheticSparseHistogram
+from OverwatchData import Serialization
+from OverwatchData.Entry import EntryBatch
+from OverwatchData.Histogram import OverwatchHistogram, OverwatchHistogramHeader
+from OverwatchData.Metadata import OverwatchDetectorDescriptor, OverwatchRunDescriptor
+from OverwatchData.Serialization import OverwatchBulkBuffer
+from OverwatchData.Time import OverwatchTimestamp
+
+# name -> (number of histograms, factory creating the i-th ROOT-like histogram)
+HISTOGRAM_WORKLOADS = [
+    ("th1_100bins", 1000, lambda i: SyntheticHistogram("hist%d" %i, [100], 1., seed = i)),
+    ("th2_sparse_1e5cells", 5, lambda i: SyntheticHistogram("hist%d" %i, [314, 314], 0.01, seed = i)),
+    ("th3_detectormap", 5, lambda i: SyntheticHistogram("hist%d" %i, [48, 24, 10], 0.3, seed = i)),
+    ("thnsparse_6d_1e4filled", 5, lambda i: SyntheticSparseHistogram("hist%d" %i, [100] * 6, 10000, seed = i))
+]
+
+def Measure(function, nops, repeat):
+    """
+    Best time out of several repetitions
+
+    :return: Dictionary with time per repetition and operations per second
+    """
+    seconds = min(timeit.repeat(function, number = 1, repeat = repeat))
+    return {"seconds": seconds, "ops": nops, "ops_per_second": nops / seconds if seconds else None}
+
+def RunHistogramWorkload(nhist, factory, repeat):
+    """
+    Ingest (Initialize from ROOT-like histograms), serialize and decode
+    """
+    roothists = [factory(i) for i in range(0, nhist)]
+    histograms = [OverwatchHistogram() for i in range(0, nhist)]
+    def ingest():
+        for hist, roothist in zip(histograms, roothists):
+            hist.Initialize(roothist)
+    results = {"ingest": Measure(ingest, nhist, repeat)}
+    buf = OverwatchBulkBuffer()
+    def serialize():
+        buf.Clear()
+        for hist in histograms:
+            hist.Serialize(buf)
+            buf.WriteNewline()
+    results["serialize"] = Measure(serialize, nhist, repeat)
+    results["document_bytes"] = len(buf) / float(nhist)
+    documents = [json.loads(line) for line in buf.GetBytes().splitlines()]
+    def decode():
+        for document in documents:
+            OverwatchHistogram().FromDict(document)
+    results["decode"] = Measure(decode, nhist, repeat)
+    return results
+
+def RunRunWorkload(ndetectors, nhistograms, nsnapshots, repeat):
+    """
+    One run with ndetectors x nhistograms histograms, sent in nsnapshots snapshots:
+    descriptor build, bulk build per (detector, snapshot) and query-side lookups
+    """
+    template = OverwatchHistogram()
+    template.Initialize(SyntheticHistogram("template", [100], 0.5))
+    names = ["hist%d" %i for i in range(0, nhistograms)]
+    detectors = ["DET%d" %i for i in range(0, ndetectors)]
+    histograms = []
+    for name in names:
+        # Own header per histogram (SetName changes the header)
+        header = OverwatchHistogramHeader()
+        header.FromDict(template.GetHeader().MakeDict())
+        hist = OverwatchHistogram()
+        hist.SetHeader(header)
+        hist.SetData(template.GetData())
+        hist.SetName(name)
+        histograms.append(hist)
+    descriptor = OverwatchRunDescriptor(1234)
+    def descriptorbuild():
+        for detector in detectors:
+            for name in names:
+                descriptor.AddHistogramForDetector(detector, name)
+    results = {"descriptor_build": Measure(descriptorbuild, ndetectors * nhistograms, repeat)}
+    buf = OverwatchBulkBuffer()
+    def bulkbuild():
+        for snapshot in range(0, nsnapshots):
+            timestamp = OverwatchTimestamp(2017, 6, 1, snapshot // 3600, (snapshot // 60) % 60, snapshot % 60)
+            for detector in detectors:
+                batch = EntryBatch(detector, "histogram", 1234, timestamp)
+                for hist in histograms:
+                    batch.AddHistogram(hist)
+                buf.Clear()
+                batch.WriteBulk(buf, withheaders = False)
+    results["bulk_build"] = Measure(bulkbuild, ndetectors * nhistograms * nsnapshots, repeat)
+    descriptordicts = descriptor.MakeDict()["detectors"]
+    def query():
+        for detectordict in descriptordicts:
+            lookup = OverwatchDetectorDescriptor()
+            lookup.FromDict(detectordict)
+            for name in names:
+                lookup.HasHistorgam(name)
+    results["descriptor_lookup"] = Measure(query, ndetectors * nhistograms, repeat)
+    return results
+
+def GetCommit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"]).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def Compare(current, reference):
+    """
+    Print throughput ratio current / reference for all common measurements
+    """
+    for workload, operations in sorted(current["results"].items()):
+        for operation, result in sorted(operations.items()):
+            if not isinstance(result, dict):
+                continue
+            try:
+                before = reference["results"][workload][operation]["ops_per_second"]
+            except KeyError:
+                continue
+            print("%-25s %-20s %12.0f -> %12.0f ops/s (x%.2f)" %(workload, operation, before, result["ops_per_second"], result["ops_per_second"] / before))
+
+def main():
+    parser = argparse.ArgumentParser(description = "Overwatch benchmark suite")
+    parser.add_argument("--output", default = None, help = "Output JSON file")
+    parser.add_argument("--compare", default = None, help = "Reference JSON file to compare with")
+    parser.add_argument("--repeat", type = int, default = 3, help = "Number of repetitions (best is taken)")
+    parser.add_argument("--detectors", type = int, default = 20, help = "Detectors in the run workload")
+    parser.add_argument("--histograms", type = int, default = 2000, help = "Histograms per detector in the run workload")
+    parser.add_argument("--snapshots", type = int, default = 5, help = "Snapshots in the run workload (production: 500)")
+    parser.add_argument("--encoder", default = None, help = "JSON encoder (default: fastest available)")
+    args = parser.parse_args()
+
+    if args.encoder:
+        Serialization.SetEncoder(args.encoder)
+    results = {}
+    for name, nhist, factory in HISTOGRAM_WORKLOADS:
+        results[name] = RunHistogramWorkload(nhist, factory, args.repeat)
+    results["run_%dx%dx%d" %(args.detectors, args.histograms, args.snapshots)] = RunRunWorkload(args.detectors, args.histograms, args.snapshots, args.repeat)
+    output = {"commit": GetCommit(), "time": time.time(), "python": platform.python_version(), "encoder": Serialization.GetEncoderName(), "results": results}
+
+    for workload, operations in sorted(results.items()):
+        for operation, result in sorted(operations.items()):
+            if isinstance(result, dict):
+                print("%-25s %-20s %12.0f ops/s" %(workload, operation, result["ops_per_second"]))
+    if args.output:
+        with open(args.output, "w") as writer:
+            json.dump(output, writer, indent = 2, sort_keys = True)
+    if args.compare:
+        with open(args.compare) as reader:
+            Compare(output, json.load(reader))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""
+Connector to the ALICE Overwatch histogram database based on Elasticsearch
+Copyright (C) 2017  Markus Fasel
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import math
+import os
+import random
+import sys
+
+# Make the repository importable when running the benchmarks as scripts
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class SyntheticArray(object):
+    """
+    Stand-in for ROOT TArrayD (variable bin edges)
+    """
+
+    def __init__(self, values = None):
+        self.__values = values if values else []
+
+    def GetSize(self):
+        return len(self.__values)
+
+    def GetAt(self, i):
+        return self.__values[i]
+
+class SyntheticAxis(object):
+    """
+    Stand-in for ROOT TAxis with linear binning
+    """
+
+    def __init__(self, name, nbins, xmin = 0., xmax = 1.):
+        self.__name = name
+        self.__nbins = nbins
+        self.__xmin = xmin
+        self.__xmax = xmax
+
+    def GetName(self):
+        return self.__name
+
+    def GetTitle(self):
+        return self.__name
+
+    def GetNbins(self):
+        return self.__nbins
+
+    def GetXbins(self):
+        return SyntheticArray()
+
+    def GetXmin(self):
+        return self.__xmin
+
+    def GetXmax(self):
+        return self.__xmax
+
+class SyntheticClass(object):
+    """
+    Stand-in for ROOT TClass
+    """
+
+    def __init__(self, name, bases = None):
+        self.__name = name
+        self.__bases = bases if bases else []
+
+    def GetName(self):
+        return self.__name
+
+    def InheritsFrom(self, name):
+        return self.__name == name or name in self.__bases
+
+class SyntheticHistogram(object):
+    """
+    Stand-in for ROOT TH1/TH2/TH3 with the interface used by
+    OverwatchHistogram.Initialize. Only a fraction of the cells
+    (occupancy) is filled.
+    """
+
+    def __init__(self, name, nbins, occupancy = 1., seed = 42, weighted = False):
+        """
+        Constructor
+
+        :param name: Name of the histogram
+        :type name: String
+        :param nbins: Number of bins per dimension (1 to 3 dimensions)
+        :type nbins: List
+        :param occupancy: Fraction of filled cells
+        :type occupancy: Float
+        :param seed: Seed of the random generator
+        :type seed: Int
+        :param weighted: Simulate weighted filling (sumw2, errors different from sqrt(content))
+        :type weighted: Bool
+        """
+        self.__name = name
+        self.__weighted = weighted
+        self.__axes = [SyntheticAxis("xyz"[i] + "axis", n) for i, n in enumerate(nbins)]
+        self.__ncells = 1
+        for n in nbins:
+            self.__ncells *= n + 2
+        generator = random.Random(seed)
+        nfilled = int(self.__ncells * occupancy)
+        self.__content = {}
+        for cell in generator.sample(range(0, self.__ncells), nfilled):
+            self.__content[cell] = generator.uniform(1., 1000.)
+
+    def IsA(self):
+        return SyntheticClass("TH%dD" %len(self.__axes))
+
+    def GetName(self):
+        return self.__name
+
+    def GetTitle(self):
+        return self.__name
+
+    def __GetAxis(self, i):
+        return self.__axes[i] if i < len(self.__axes) else None
+
+    def GetXaxis(self):
+        return self.__GetAxis(0)
+
+    def GetYaxis(self):
+        return self.__GetAxis(1)
+
+    def GetZaxis(self):
+        return self.__GetAxis(2)
+
+    def GetNcells(self):
+        return self.__ncells
+
+    def GetBinContent(self, cell):
+        return self.__content.get(cell, 0.)
+
+    def GetSumw2N(self):
+        return self.__ncells if self.__weighted else 0
+
+    def GetBinError(self, cell):
+        content = self.__content.get(cell, 0.)
+        return 0.1 * content if self.__weighted else math.sqrt(content)
+
+class SyntheticSparseHistogram(object):
+    """
+    Stand-in for ROOT THnSparse with the interface used by
+    OverwatchHistogram.Initialize: GetNbins is the number of
+    filled bins, GetBinContent(i, coords) fills the coordinates
+    """
+
+    def __init__(self, name, nbins, nfilled, seed = 42):
+        """
+        Constructor
+
+        :param name: Name of the histogram
+        :type name: String
+        :param nbins: Number of bins per dimension
+        :type nbins: List
+        :param nfilled: Number of filled bins
+        :type nfilled: Int
+        :param seed: Seed of the random generator
+        :type seed: Int
+        """
+        self.__name = name
+        self.__axes = [SyntheticAxis("axis%d" %i, n) for i, n in enumerate(nbins)]
+        generator = random.Random(seed)
+        self.__filled = {}
+        while len(self.__filled) < nfilled:
+            coords = tuple(generator.randint(1, n) for n in nbins)
+            self.__filled[coords] = generator.uniform(1., 1000.)
+        self.__bins = list(self.__filled.items())
+
+    def IsA(self):
+        return SyntheticClass("THnSparseD", ["THnSparse", "THnBase"])
+
+    def GetName(self):
+        return self.__name
+
+    def GetTitle(self):
+        return self.__name
+
+    def GetNdimensions(self):
+        return len(self.__axes)
+
+    def GetAxis(self, i):
+        return self.__axes[i]
+
+    def GetNbins(self):
+        return len(self.__bins)
+
+    def GetBinContent(self, filledbin, coords):
+        bincoords, value = self.__bins[filledbin]
+        for i, c in enumerate(bincoords):
+            coords[i] = c
+        return value
+
+def MakeOverwatchHistograms(nhist, nbins, occupancy = 1.):
+    """
+    Create list of initialized overwatch histograms
+
+    :param nhist: Number of histograms
+    :type nhist: Int
+    :param nbins: Number of bins per dimension
+    :type nbins: List
+    :param occupancy: Fraction of filled cells
+    :type occupancy: Float
+    :return: Overwatch histograms
+    :rtype: List
+    """
+    from OverwatchData.Histogram import OverwatchHistogram
+    result = []
+    for i in range(0, nhist):
+        hist = OverwatchHistogram()
+        hist.Initialize(SyntheticHistogram("hist%d" %i, nbins, occupancy, seed = i))
+        result.append(hist)
+    return result
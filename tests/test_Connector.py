@@ -0,0 +1,89 @@
+"""
+Connector to the ALICE Overwatch histogram database based on Elasticsearch
+Copyright (C) 2017  Markus Fasel
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Tests of OverwatchElasticsearchConnector.WriteBatch with the bulk
+# requests answered in memory (no Elasticsearch client).
+
+import json
+
+import pytest
+
+from OverwatchData.Entry import EntryBatch, MakeManifestIndexName
+from OverwatchData.Histogram import OverwatchHistogram, OverwatchHistogramData, OverwatchHistogramHeader
+from OverwatchData.Time import OverwatchTimestamp
+from OverwatchElasticsearch.Connector import OverwatchBulkError, OverwatchElasticsearchConnector
+
+class FakeBulkConnector(OverwatchElasticsearchConnector):
+    """
+    Connector answering bulk requests in memory, items with an ID in
+    failing are rejected with 429
+    """
+
+    def __init__(self, failing = ()):
+        self.requests = []
+        self.failing = set(failing)
+
+    def Bulk(self, body):
+        lines = [json.loads(line) for line in body.decode("utf-8").splitlines()]
+        self.requests.append(lines)
+        items = []
+        for action in lines[0::2]:
+            operation, meta = list(action.items())[0]
+            result = {"_index": meta["_index"], "_id": meta.get("_id"), "status": 200}
+            if meta.get("_id") in self.failing:
+                result.update({"status": 429, "error": {"type": "es_rejected_execution_exception"}})
+            items.append({operation: result})
+        return {"errors": any("error" in list(item.values())[0] for item in items), "items": items}
+
+def MakeBatch(names):
+    batch = EntryBatch("EMC", "histogram", 1234, OverwatchTimestamp(2017, 6, 1, 3, 0, 0))
+    for name in names:
+        header = OverwatchHistogramHeader()
+        header.SetName(name)
+        data = OverwatchHistogramData()
+        data.SetNbinsTotal(3)
+        data.SetBin(1, 1.)
+        histogram = OverwatchHistogram()
+        histogram.SetHeader(header)
+        histogram.SetData(data)
+        batch.AddHistogram(histogram)
+    return batch
+
+def GetManifestUpdates(connector):
+    return [request[1]["script"]["params"]["documents"] for request in connector.requests if list(request[0].values())[0]["_index"] == MakeManifestIndexName()]
+
+def test_manifest_is_sent_after_the_data():
+    connector = FakeBulkConnector()
+    connector.WriteBatch(MakeBatch(["a", "b"]))
+    assert len(connector.requests) == 2
+    assert all(list(action.values())[0]["_index"] != MakeManifestIndexName() for action in connector.requests[0][0::2])
+    assert GetManifestUpdates(connector) == [["a_20170601030000", "b_20170601030000"]]
+
+@pytest.mark.parametrize("withheaders", [True, False])
+def test_failed_documents_raise_and_are_not_in_the_manifest(withheaders):
+    connector = FakeBulkConnector(["b_20170601030000"])
+    with pytest.raises(OverwatchBulkError) as error:
+        connector.WriteBatch(MakeBatch(["a", "b", "c"]), withheaders)
+    assert "1 documents failed" in str(error.value)
+    assert GetManifestUpdates(connector) == [["a_20170601030000", "c_20170601030000"]]
+
+def test_no_manifest_if_nothing_was_written():
+    connector = FakeBulkConnector(["a_20170601030000"])
+    with pytest.raises(OverwatchBulkError):
+        connector.WriteBatch(MakeBatch(["a"]), False)
+    assert len(connector.requests) == 1
@@ -0,0 +1,72 @@
+"""
+Connector to the ALICE Overwatch histogram database based on Elasticsearch
+Copyright (C) 2017  Markus Fasel
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Tests of the time-window query on the embedded SQLite backend with
+# complete, partial and empty run catalogs.
+
+import pytest
+
+from OverwatchData.Entry import EntryBatch
+from OverwatchData.Histogram import OverwatchHistogram, OverwatchHistogramData, OverwatchHistogramHeader
+from OverwatchData.Time import OverwatchTimestamp
+from OverwatchElasticsearch.Query import OverwatchRunCatalog, OverwatchTimeWindowQuery
+from OverwatchElasticsearch.SQLiteBackend import OverwatchSQLiteBackend
+
+def MakeHistogram(name):
+    header = OverwatchHistogramHeader()
+    header.SetName(name)
+    data = OverwatchHistogramData()
+    data.SetNbinsTotal(3)
+    data.SetBin(1, 1.)
+    histogram = OverwatchHistogram()
+    histogram.SetHeader(header)
+    histogram.SetData(data)
+    return histogram
+
+@pytest.fixture
+def backend():
+    """
+    Runs 1 to 3 of EMC with one snapshot each (at 01:00, 02:00, 03:00),
+    and a detector with the same prefix
+    """
+    backend = OverwatchSQLiteBackend()
+    for detector, run in [("EMC", 1), ("EMC", 2), ("EMC", 3), ("EMC_X", 4)]:
+        batch = EntryBatch(detector, "histogram", run, OverwatchTimestamp(2017, 6, 1, run, 0, 0))
+        batch.AddHistogram(MakeHistogram("hist"))
+        backend.WriteBatch(batch, False)
+    yield backend
+    backend.Close()
+
+def QueryDay(backend, catalog):
+    return [doc["timekey"] for doc in OverwatchTimeWindowQuery(backend, catalog).Query("EMC", "hist", 20170601000000, 20170601235959)]
+
+def test_partial_catalog_scans_unknown_runs(backend):
+    # Writer restarted: only run 3 was seen
+    catalog = OverwatchRunCatalog()
+    catalog.AddSnapshot(3, "EMC", 20170601030000)
+    assert QueryDay(backend, catalog) == [20170601010000, 20170601020000, 20170601030000]
+
+def test_empty_catalog_scans_all_runs(backend):
+    assert QueryDay(backend, OverwatchRunCatalog()) == [20170601010000, 20170601020000, 20170601030000]
+
+def test_known_runs_outside_the_window_are_pruned(backend):
+    catalog = OverwatchRunCatalog()
+    for run in [1, 2, 3]:
+        catalog.AddSnapshot(run, "EMC", 20170601000000 + run * 10000)
+    documents = list(OverwatchTimeWindowQuery(backend, catalog).Query("EMC", "hist", 20170601015000, 20170601023000))
+    assert [doc["timekey"] for doc in documents] == [20170601020000]
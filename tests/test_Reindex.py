@@ -0,0 +1,152 @@
+"""
+Connector to the ALICE Overwatch histogram database based on Elasticsearch
+Copyright (C) 2017  Markus Fasel
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Tests of the reindexing tool against a fake connector keeping the
+# indices in memory (Scan / Bulk / GetIndices as the Elasticsearch
+# connector).
+
+import collections
+import fnmatch
+import json
+import logging
+
+import pytest
+
+from OverwatchElasticsearch.Reindex import OverwatchReindexError, OverwatchReindexer
+
+TIME = {"year": 2017, "month": 6, "day": 1, "hours": 3, "minutes": 0, "seconds": 0}
+TIMEKEY = 20170601030000
+
+class FakeConnector(object):
+    """
+    Indices in memory, items with an ID in failing are rejected by Bulk
+    """
+
+    def __init__(self, indices):
+        self.indices = collections.OrderedDict((name, collections.OrderedDict(docs)) for name, docs in indices.items())
+        self.failing = set()
+        self.nbulk = 0
+
+    def GetIndices(self, pattern):
+        return sorted(fnmatch.filter(self.indices.keys(), pattern))
+
+    def Scan(self, index, query = None, size = 500):
+        for docid, source in list(self.indices[index].items()):
+            yield {"_index": index, "_id": docid, "_source": json.loads(json.dumps(source))}
+
+    def Bulk(self, body):
+        self.nbulk += 1
+        lines = body.decode("utf-8").splitlines()
+        items = []
+        for action, document in zip(lines[0::2], lines[1::2]):
+            meta = json.loads(action)["index"]
+            assert set(meta.keys()) == set(["_index", "_id"])
+            if meta["_id"] in self.failing:
+                items.append({"index": {"_index": meta["_index"], "_id": meta["_id"], "status": 400, "error": {"type": "mapper_parsing_exception"}}})
+                continue
+            self.indices.setdefault(meta["_index"], collections.OrderedDict())[meta["_id"]] = json.loads(document)
+            items.append({"index": {"_index": meta["_index"], "_id": meta["_id"], "status": 201}})
+        return {"errors": any("error" in item["index"] for item in items), "items": items}
+
+def MakeOldDocument(values):
+    """
+    Data document of the original format (no name, no time key, map bin -> value)
+    """
+    return {"time": TIME, "data": {"nbins": 12, "data": dict((str(k), v) for k, v in values.items())}}
+
+def test_source_indices_exclude_targets():
+    connector = FakeConnector({"alice_overwatchdata_EMC_1": {}, "alice_overwatchdata_EMC_1_v2": {}, "alice_overwatchdata_TPC_2": {}})
+    assert OverwatchReindexer(connector).GetSourceIndices() == ["alice_overwatchdata_EMC_1", "alice_overwatchdata_TPC_2"]
+    connector = FakeConnector({"alice_overwatchdata_EMC_1": {}, "alice_overwatchdata_migrated_EMC_1": {}})
+    reindexer = OverwatchReindexer(connector)
+    reindexer.SetTargetNamer(lambda index: index.replace("overwatchdata_", "overwatchdata_migrated_"))
+    assert reindexer.GetSourceIndices() == ["alice_overwatchdata_EMC_1"]
+
+def test_old_format_is_converted_and_named_from_the_id(caplog):
+    connector = FakeConnector({"alice_overwatchdata_EMC_1": {
+        "hist1_%d" %TIMEKEY: MakeOldDocument({7: 1., 3: 2.}),
+        "AVx3bq7autogenerated": MakeOldDocument({1: 5.})
+    }})
+    with caplog.at_level(logging.WARNING):
+        assert OverwatchReindexer(connector).Run() == {"alice_overwatchdata_EMC_1": 2}
+    target = connector.indices["alice_overwatchdata_EMC_1_v2"]
+    assert list(target.keys()) == ["hist1_%d" %TIMEKEY, "AVx3bq7autogenerated"]
+    named = target["hist1_%d" %TIMEKEY]
+    assert named["name"] == "hist1"
+    assert named["timekey"] == TIMEKEY
+    assert named["data"] == {"nbins": 12, "bins": [3, 7], "values": [2., 1.]}
+    # Name not recoverable: the document keeps its ID, which is reported
+    unnamed = target["AVx3bq7autogenerated"]
+    assert not "name" in unnamed
+    assert unnamed["timekey"] == TIMEKEY
+    assert "1 data documents without histogram name" in caplog.text
+
+def test_sparse_document_gets_time_key_and_id():
+    sparse = {"ndim": 2, "coords": [1, 2, 3, 4], "values": [5., 6.]}
+    connector = FakeConnector({"alice_overwatchdata_EMC_1": {"legacy-id": {"time": TIME, "name": "hsparse", "data": sparse}}})
+    OverwatchReindexer(connector).Run()
+    target = connector.indices["alice_overwatchdata_EMC_1_v2"]
+    assert list(target.keys()) == ["hsparse_%d" %TIMEKEY]
+    assert target["hsparse_%d" %TIMEKEY]["data"] == sparse
+    assert target["hsparse_%d" %TIMEKEY]["timekey"] == TIMEKEY
+
+def test_checkpoint_resumes_with_pending_indices(tmp_path):
+    checkpoint = str(tmp_path / "checkpoint.json")
+    connector = FakeConnector({
+        "alice_overwatchdata_EMC_1": {"h_%d" %TIMEKEY: MakeOldDocument({1: 1.})},
+        "alice_overwatchdata_EMC_2": {"h_%d" %TIMEKEY: MakeOldDocument({1: 1.})}
+    })
+    reindexer = OverwatchReindexer(connector)
+    reindexer.SetCheckpointFile(checkpoint)
+    assert reindexer.ReindexIndex("alice_overwatchdata_EMC_1") == 1
+    # Interrupted after the first index: a new run only processes the second one
+    resumed = OverwatchReindexer(connector)
+    resumed.SetCheckpointFile(checkpoint)
+    assert resumed.Run() == {"alice_overwatchdata_EMC_2": 1}
+    nbulk = connector.nbulk
+    finished = OverwatchReindexer(connector)
+    finished.SetCheckpointFile(checkpoint)
+    assert finished.Run() == {}
+    assert connector.nbulk == nbulk
+
+def test_item_failures_raise_and_are_not_checkpointed(tmp_path):
+    checkpoint = str(tmp_path / "checkpoint.json")
+    connector = FakeConnector({"alice_overwatchdata_EMC_1": {
+        "h1_%d" %TIMEKEY: MakeOldDocument({1: 1.}),
+        "h2_%d" %TIMEKEY: MakeOldDocument({1: 1.})
+    }})
+    connector.failing.add("h2_%d" %TIMEKEY)
+    reindexer = OverwatchReindexer(connector)
+    reindexer.SetCheckpointFile(checkpoint)
+    with pytest.raises(OverwatchReindexError) as error:
+        reindexer.Run()
+    assert "1 documents failed" in str(error.value)
+    # Not completed: processed again after the failure is resolved
+    connector.failing.clear()
+    resumed = OverwatchReindexer(connector)
+    resumed.SetCheckpointFile(checkpoint)
+    assert resumed.Run() == {"alice_overwatchdata_EMC_1": 2}
+
+def test_document_without_time_key_keeps_its_id():
+    incomplete = MakeOldDocument({1: 1.})
+    incomplete["time"] = {"year": 2017, "month": 6, "day": 1, "hours": None, "minutes": None, "seconds": None}
+    connector = FakeConnector({"alice_overwatchdata_EMC_1": {"AVx3bq7autogenerated": incomplete}})
+    OverwatchReindexer(connector).Run()
+    target = connector.indices["alice_overwatchdata_EMC_1_v2"]
+    assert list(target.keys()) == ["AVx3bq7autogenerated"]
+    assert not "timekey" in target["AVx3bq7autogenerated"]
@@ -0,0 +1,58 @@
+"""
+Connector to the ALICE Overwatch histogram database based on Elasticsearch
+Copyright (C) 2017  Markus Fasel
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Tests of the process-local symbol table used by descriptors and batches.
+
+from OverwatchData.Entry import EntryBatch
+from OverwatchData.Histogram import OverwatchHistogram, OverwatchHistogramData, OverwatchHistogramHeader
+from OverwatchData.Metadata import OverwatchDetectorDescriptor
+from OverwatchData.Symbols import OverwatchSymbolTable
+
+def MakeHistogram(name):
+    header = OverwatchHistogramHeader()
+    header.SetName(name)
+    histogram = OverwatchHistogram()
+    histogram.SetHeader(header)
+    histogram.SetData(OverwatchHistogramData())
+    return histogram
+
+def test_ids_are_dense_and_stable():
+    symbols = OverwatchSymbolTable()
+    symbols.AddSymbols(["b", "a", "b"])
+    assert symbols.GetListOfSymbols() == ["b", "a"]
+    assert symbols.GetId("a") == 1
+    assert symbols.GetId("c") == 2
+    assert symbols.FindId("d") == -1
+    assert len(symbols) == 3
+
+def test_descriptor_round_trip_keeps_the_strings():
+    symbols = OverwatchSymbolTable()
+    # Default descriptor interns the empty detector name first
+    descriptor = OverwatchDetectorDescriptor(symbols = symbols)
+    other = OverwatchDetectorDescriptor(symbols = OverwatchSymbolTable())
+    other.FromDict({"detector": "TPC", "histograms": ["h2", "h1"]})
+    descriptor.FromDict(other.MakeDict())
+    assert descriptor.MakeDict() == {"detector": "TPC", "histograms": ["h2", "h1"]}
+    assert descriptor == other
+
+def test_batch_interns_names_once():
+    symbols = OverwatchSymbolTable()
+    batch = EntryBatch("EMC", "histogram", 1234, None, symbols)
+    batch.AddHistograms([MakeHistogram("h%d" %i) for i in range(0, 3)])
+    assert symbols.GetListOfSymbols() == ["h0", "h1", "h2"]
+    assert [batch.GetHistogramName(i) for i in range(0, 3)] == ["h0", "h1", "h2"]